@@ -1,6 +1,7 @@
 import bpy
 import os
-from . import common, setReader
+import shutil
+from . import common, setReader, exportStats
 from bpy.props import (
     BoolProperty,
     FloatProperty,
@@ -79,10 +80,7 @@ def exportFile(op, outType, context, **keywords):
     del keywords["profile_output"]
 
     if profile_output:
-        import cProfile
-        import pstats
-        pr = cProfile.Profile()
-        pr.enable()
+        exportStats.start()
 
     try:
         if outType == 'MDL':
@@ -95,25 +93,23 @@ def exportFile(op, outType, context, **keywords):
     except (strippifier.TopologyError, common.ExportError) as e:
         op.report({'WARNING'}, "Export stopped!\n" + str(e))
         removeFile()
-        if profile_output:
-            pr.disable()
         return {'CANCELLED'}
     except Exception as e:
         removeFile()
-        if profile_output:
-            pqr.disable()
         raise e
+    finally:
+        if profile_output:
+            stats = exportStats.report()
+            exportStats.stop()
 
     filepath = keywords["filepath"]
 
     if profile_output:
-        pr.disable()
-        prPath = filepath + ".profile"
-        if(os.path.isfile(prPath)):
-            os.remove(prPath)
-        with open(prPath, 'w') as prStream:
-            ps = pstats.Stats(pr, stream=prStream)
-            ps.sort_stats("cumulative").print_stats()
+        # timings, call counts and memory peaks of the export stages
+        exportStats.writeReport(filepath + ".stats.json", stats)
+        summary = exportStats.summary(stats)
+        print(summary)
+        op.report({'INFO'}, "Export stages:\n" + summary)
 
     # moving and renaming the temporary file
     # Note: this is also removing the file that existed before
@@ -121,7 +117,9 @@ def exportFile(op, outType, context, **keywords):
 
     if(os.path.isfile(filepath)):
         os.remove(filepath)
-    os.rename(fileW.filepath, filepath)
+    # (moving instead of renaming, as the temporary
+    # file may be on a different drive)
+    shutil.move(fileW.filepath, filepath)
 
     return {'FINISHED'}
 
@@ -151,6 +149,18 @@ class ExportSA1MDL(bpy.types.Operator, ExportHelper):
         default=True,
         )
 
+    optimize_vertex_cache: BoolProperty(
+        name="Optimize Vertex Cache",
+        description="Reorders the triangles of meshes written as triangle lists so that the console reuses more transformed vertices. Slows down exporting",
+        default=False,
+        )
+
+    strip_swaps: BoolProperty(
+        name="Strip Swaps",
+        description="Lets triangle strips turn corners, which results in fewer strips on grid-like meshes (e.g. level terrain). Only used where it results in less data. Slows down exporting",
+        default=False,
+        )
+
     console_debug_output: BoolProperty(
         name = "Console Output",
         description = "Shows exporting progress in Console (Slows down Exporting Immensely)",
@@ -159,7 +169,7 @@ class ExportSA1MDL(bpy.types.Operator, ExportHelper):
 
     profile_output: BoolProperty(
         name = "Profiling output",
-        description = "Records where the addon spends most of its time and writes it to a file next to the actual output file",
+        description = "Records the time, call count and memory peak of each export stage, writes them to a .stats.json file next to the actual output file and lists them in the info log",
         default = False
         )
 
@@ -176,6 +186,8 @@ class ExportSA1MDL(bpy.types.Operator, ExportHelper):
 
         layout.prop(self, "use_selection")
         layout.prop(self, "apply_modifs")
+        layout.prop(self, "optimize_vertex_cache")
+        layout.prop(self, "strip_swaps")
         layout.separator()
         layout.prop(self, "console_debug_output")
         layout.prop(self, "profile_output")
@@ -212,6 +224,34 @@ class ExportSA2MDL(bpy.types.Operator, ExportHelper):
         default=True,
         )
 
+    strip_swaps: BoolProperty(
+        name="Strip Swaps",
+        description="Lets triangle strips turn corners, which results in fewer strips on grid-like meshes (e.g. level terrain). Only used where it results in less data. Slows down exporting",
+        default=False,
+        )
+
+    weight_threshold: FloatProperty(
+        name="Weight Threshold",
+        description="Bone weights below this are dropped (each vertex keeps its biggest weight at least)",
+        default=0.0,
+        min=0.0,
+        max=0.5,
+        )
+
+    max_weights: IntProperty(
+        name="Max Weights",
+        description="Amount of bones that may weigh a single vertex. Only the biggest weights of each vertex are kept (0 = no limit)",
+        default=0,
+        min=0,
+        max=8,
+        )
+
+    compact_weights: BoolProperty(
+        name="Compact Weights",
+        description="Only writes a vertex for bones that actually weigh it, instead of writing every vertex for the first bone",
+        default=False,
+        )
+
     console_debug_output: BoolProperty(
         name = "Console Output",
         description = "Shows exporting progress in Console (Slows down Exporting Immensely)",
@@ -220,7 +260,7 @@ class ExportSA2MDL(bpy.types.Operator, ExportHelper):
 
     profile_output: BoolProperty(
         name = "Profiling output",
-        description = "Records where the addon spends most of its time and writes it to a file next to the actual output file",
+        description = "Records the time, call count and memory peak of each export stage, writes them to a .stats.json file next to the actual output file and lists them in the info log",
         default = False
         )
 
@@ -237,6 +277,10 @@ class ExportSA2MDL(bpy.types.Operator, ExportHelper):
         layout.prop(self, "write_Specular")
         layout.prop(self, "use_selection")
         layout.prop(self, "apply_modifs")
+        layout.prop(self, "strip_swaps")
+        layout.prop(self, "weight_threshold")
+        layout.prop(self, "max_weights")
+        layout.prop(self, "compact_weights")
         layout.separator()
         layout.prop(self, "console_debug_output")
         layout.prop(self, "profile_output")
@@ -267,6 +311,26 @@ class ExportSA2BMDL(bpy.types.Operator, ExportHelper):
         default=True,
         )
 
+    optimize_vertex_cache: BoolProperty(
+        name="Optimize Vertex Cache",
+        description="Reorders the triangles of meshes written as triangle lists so that the console reuses more transformed vertices. Slows down exporting",
+        default=False,
+        )
+
+    strip_swaps: BoolProperty(
+        name="Strip Swaps",
+        description="Lets triangle strips turn corners, which results in fewer strips on grid-like meshes (e.g. level terrain). Only used where it results in less data. Slows down exporting",
+        default=False,
+        )
+
+    pool_precision: IntProperty(
+        name="Pool Precision",
+        description="Decimal places that positions and normals get rounded to when pooling them, so that nearly equal values share one entry (0 = only exactly equal values)",
+        default=0,
+        min=0,
+        max=8,
+        )
+
     console_debug_output: BoolProperty(
         name = "Console Output",
         description = "Shows exporting progress in Console (Slows down Exporting Immensely)",
@@ -275,7 +339,7 @@ class ExportSA2BMDL(bpy.types.Operator, ExportHelper):
 
     profile_output: BoolProperty(
         name = "Profiling output",
-        description = "Records where the addon spends most of its time and writes it to a file next to the actual output file",
+        description = "Records the time, call count and memory peak of each export stage, writes them to a .stats.json file next to the actual output file and lists them in the info log",
         default = False
         )
 
@@ -292,6 +356,9 @@ class ExportSA2BMDL(bpy.types.Operator, ExportHelper):
 
         layout.prop(self, "use_selection")
         layout.prop(self, "apply_modifs")
+        layout.prop(self, "optimize_vertex_cache")
+        layout.prop(self, "strip_swaps")
+        layout.prop(self, "pool_precision")
         layout.separator()
         layout.prop(self, "console_debug_output")
         layout.prop(self, "profile_output")
@@ -322,6 +389,37 @@ class ExportSA1LVL(bpy.types.Operator, ExportHelper):
         default=True,
         )
 
+    optimize_vertex_cache: BoolProperty(
+        name="Optimize Vertex Cache",
+        description="Reorders the triangles of meshes written as triangle lists so that the console reuses more transformed vertices. Slows down exporting",
+        default=False,
+        )
+
+    strip_swaps: BoolProperty(
+        name="Strip Swaps",
+        description="Lets triangle strips turn corners, which results in fewer strips on grid-like meshes (e.g. level terrain). Only used where it results in less data. Slows down exporting",
+        default=False,
+        )
+
+    use_attach_cache: BoolProperty(
+        name="Reuse Unchanged Meshes",
+        description="Caches converted meshes on disk and reuses them in later exports, as long as neither the mesh nor its settings changed",
+        default=False,
+        )
+
+    attach_cache_size: IntProperty(
+        name="Cache Size (MB)",
+        description="Maximum size of the mesh cache. The least recently used meshes get removed first",
+        default=512,
+        min=1,
+        )
+
+    stream_meshes: BoolProperty(
+        name="Low Memory",
+        description="Evaluates, writes and frees the meshes one at a time instead of keeping all of them in memory. Uses less memory on big levels, but less of the strippifying can run in parallel",
+        default=False,
+        )
+
     console_debug_output: BoolProperty(
         name = "Console Output",
         description = "Shows exporting progress in Console (Slows down Exporting Immensely)",
@@ -330,7 +428,7 @@ class ExportSA1LVL(bpy.types.Operator, ExportHelper):
 
     profile_output: BoolProperty(
         name = "Profiling output",
-        description = "Records where the addon spends most of its time and writes it to a file next to the actual output file",
+        description = "Records the time, call count and memory peak of each export stage, writes them to a .stats.json file next to the actual output file and lists them in the info log",
         default = False
         )
 
@@ -347,6 +445,12 @@ class ExportSA1LVL(bpy.types.Operator, ExportHelper):
 
         layout.prop(self, "use_selection")
         layout.prop(self, "apply_modifs")
+        layout.prop(self, "optimize_vertex_cache")
+        layout.prop(self, "strip_swaps")
+        layout.prop(self, "use_attach_cache")
+        if self.use_attach_cache:
+            layout.prop(self, "attach_cache_size")
+        layout.prop(self, "stream_meshes")
         layout.separator()
         layout.prop(self, "console_debug_output")
         layout.prop(self, "profile_output")
@@ -383,6 +487,37 @@ class ExportSA2LVL(bpy.types.Operator, ExportHelper):
         default=True,
         )
 
+    optimize_vertex_cache: BoolProperty(
+        name="Optimize Vertex Cache",
+        description="Reorders the triangles of collision meshes written as triangle lists so that the console reuses more transformed vertices. Has no effect on the CHUNK meshes, which are always strips. Slows down exporting",
+        default=False,
+        )
+
+    strip_swaps: BoolProperty(
+        name="Strip Swaps",
+        description="Lets triangle strips turn corners, which results in fewer strips on grid-like meshes (e.g. level terrain). Only used where it results in less data. Slows down exporting",
+        default=False,
+        )
+
+    use_attach_cache: BoolProperty(
+        name="Reuse Unchanged Meshes",
+        description="Caches converted meshes on disk and reuses them in later exports, as long as neither the mesh nor its settings changed",
+        default=False,
+        )
+
+    attach_cache_size: IntProperty(
+        name="Cache Size (MB)",
+        description="Maximum size of the mesh cache. The least recently used meshes get removed first",
+        default=512,
+        min=1,
+        )
+
+    stream_meshes: BoolProperty(
+        name="Low Memory",
+        description="Evaluates, writes and frees the meshes one at a time instead of keeping all of them in memory. Uses less memory on big levels, but less of the strippifying can run in parallel",
+        default=False,
+        )
+
     console_debug_output: BoolProperty(
         name = "Console Output",
         description = "Shows exporting progress in Console (Slows down Exporting Immensely)",
@@ -391,7 +526,7 @@ class ExportSA2LVL(bpy.types.Operator, ExportHelper):
 
     profile_output: BoolProperty(
         name = "Profiling output",
-        description = "Records where the addon spends most of its time and writes it to a file next to the actual output file",
+        description = "Records the time, call count and memory peak of each export stage, writes them to a .stats.json file next to the actual output file and lists them in the info log",
         default = False
         )
 
@@ -408,6 +543,12 @@ class ExportSA2LVL(bpy.types.Operator, ExportHelper):
         layout.prop(self, "write_Specular")
         layout.prop(self, "use_selection")
         layout.prop(self, "apply_modifs")
+        layout.prop(self, "optimize_vertex_cache")
+        layout.prop(self, "strip_swaps")
+        layout.prop(self, "use_attach_cache")
+        if self.use_attach_cache:
+            layout.prop(self, "attach_cache_size")
+        layout.prop(self, "stream_meshes")
         layout.separator()
         layout.prop(self, "console_debug_output")
         layout.prop(self, "profile_output")
@@ -438,6 +579,45 @@ class ExportSA2BLVL(bpy.types.Operator, ExportHelper):
         default=True,
         )
 
+    optimize_vertex_cache: BoolProperty(
+        name="Optimize Vertex Cache",
+        description="Reorders the triangles of meshes written as triangle lists so that the console reuses more transformed vertices. Slows down exporting",
+        default=False,
+        )
+
+    strip_swaps: BoolProperty(
+        name="Strip Swaps",
+        description="Lets triangle strips turn corners, which results in fewer strips on grid-like meshes (e.g. level terrain). Only used where it results in less data. Slows down exporting",
+        default=False,
+        )
+
+    use_attach_cache: BoolProperty(
+        name="Reuse Unchanged Meshes",
+        description="Caches converted meshes on disk and reuses them in later exports, as long as neither the mesh nor its settings changed",
+        default=False,
+        )
+
+    attach_cache_size: IntProperty(
+        name="Cache Size (MB)",
+        description="Maximum size of the mesh cache. The least recently used meshes get removed first",
+        default=512,
+        min=1,
+        )
+
+    stream_meshes: BoolProperty(
+        name="Low Memory",
+        description="Evaluates, writes and frees the meshes one at a time instead of keeping all of them in memory. Uses less memory on big levels, but less of the strippifying can run in parallel",
+        default=False,
+        )
+
+    pool_precision: IntProperty(
+        name="Pool Precision",
+        description="Decimal places that positions and normals get rounded to when pooling them, so that nearly equal values share one entry (0 = only exactly equal values)",
+        default=0,
+        min=0,
+        max=8,
+        )
+
     console_debug_output: BoolProperty(
         name = "Console Output",
         description = "Shows exporting progress in Console (Slows down Exporting Immensely)",
@@ -446,7 +626,7 @@ class ExportSA2BLVL(bpy.types.Operator, ExportHelper):
 
     profile_output: BoolProperty(
         name = "Profiling output",
-        description = "Records where the addon spends most of its time and writes it to a file next to the actual output file",
+        description = "Records the time, call count and memory peak of each export stage, writes them to a .stats.json file next to the actual output file and lists them in the info log",
         default = False
         )
 
@@ -464,6 +644,13 @@ class ExportSA2BLVL(bpy.types.Operator, ExportHelper):
 
         layout.prop(self, "use_selection")
         layout.prop(self, "apply_modifs")
+        layout.prop(self, "optimize_vertex_cache")
+        layout.prop(self, "strip_swaps")
+        layout.prop(self, "pool_precision")
+        layout.prop(self, "use_attach_cache")
+        if self.use_attach_cache:
+            layout.prop(self, "attach_cache_size")
+        layout.prop(self, "stream_meshes")
         layout.separator()
         layout.prop(self, "console_debug_output")
         layout.prop(self, "profile_output")
@@ -515,6 +702,12 @@ class ExportAnim(bpy.types.Operator, ExportHelper):
         default=False
         )
 
+    binary: BoolProperty(
+        name = "Binary (.saanim)",
+        description="Write a binary .saanim file instead of a json file. Much smaller and faster to write and load for long animations",
+        default=False
+        )
+
     @classmethod
     def poll(cls, context):
         active = context.active_object
@@ -526,10 +719,16 @@ class ExportAnim(bpy.types.Operator, ExportHelper):
             return False
         return active.animation_data.action != None
 
+    def check(self, context):
+        self.filename_ext = ".saanim" if self.binary else ".json"
+        return super().check(context)
+
     def execute(self, context):
         #return exportFile(self, 'ANIM', context, self.as_keywords())
         from . import file_SAANIM
-        file_SAANIM.write(self.filepath, self.bakeAll, self.shortRot, self.bezierInterpolation, self.currentTransforms, context.active_object)
+        self.filename_ext = ".saanim" if self.binary else ".json"
+        filepath = bpy.path.ensure_ext(os.path.splitext(self.filepath)[0], self.filename_ext)
+        file_SAANIM.write(filepath, self.bakeAll, self.shortRot, self.bezierInterpolation, self.currentTransforms, context.active_object)
         return {'FINISHED'}
 
 # import operators
@@ -722,11 +921,11 @@ class LoadSetFile(bpy.types.Operator, ImportHelper):
 class LoadAnimFile(bpy.types.Operator, ImportHelper):
     """Loads animations from saanim files to a selected armature"""
     bl_idname = "object.load_saanim"
-    bl_label = "Load Anim JSON file"
-    bl_description = "Loads JSON animation files to a selected armature"
+    bl_label = "Load Anim file"
+    bl_description = "Loads JSON or binary (.saanim) animation files to a selected armature"
 
     filter_glob: StringProperty(
-        default="*.json",
+        default="*.json;*.saanim",
         options={'HIDDEN'},
         )
 
@@ -3129,11 +3328,16 @@ def register():
     path = str(pathlib.Path(__file__).parent.absolute()) + "\\IOSA2.dll"
 
     import ctypes
-    common.DLL = ctypes.cdll.LoadLibrary(path)
+    try:
+        common.DLL = ctypes.cdll.LoadLibrary(path)
+    except OSError:
+        # no dll (e.g. not on windows); the python strippifier is used instead
+        print("IOSA2.dll could not be loaded, using python strippifier")
+        common.DLL = None
 
 
 def unregister():
-    del common.DLL
+    common.DLL = None
 
     bpy.types.TOPBAR_MT_file_export.remove(menu_func_exportsa)
     bpy.types.TOPBAR_MT_file_import.remove(menu_func_importsa)
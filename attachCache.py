@@ -0,0 +1,385 @@
+import bpy
+import mathutils
+
+import contextlib
+import hashlib
+import io
+import numpy
+import os
+import pickle
+import struct
+from typing import List, Dict, Tuple
+
+from . import common, fileHelper, strippifier, format_GC, exportStats
+
+DO = False  # Debug Out
+
+# has to be increased whenever the written attach data changes,
+# so that entries from older versions dont get used anymore
+cacheVersion = 1
+
+
+def defaultFolder() -> str:
+    """Returns the folder in which the attach cache is stored"""
+    return bpy.utils.user_resource('DATAFILES',
+                                   path="BlenderSASupport/attachCache",
+                                   create=True)
+
+
+def rnaKey(data) -> list:
+    """Returns the values of all properties of a property group, which
+    can be used as part of a cache key"""
+    values = list()
+    for prop in data.bl_rna.properties:
+        identifier = prop.identifier
+        if identifier == "rna_type":
+            continue
+        value = getattr(data, identifier)
+        if prop.type == 'POINTER':
+            if isinstance(value, bpy.types.PropertyGroup):
+                value = rnaKey(value)
+            else:
+                value = getattr(value, "name", None)
+        elif prop.type == 'COLLECTION':
+            value = [rnaKey(v) for v in value]
+        elif getattr(prop, "is_array", False):
+            value = tuple(value)
+        values.append((identifier, value))
+    return values
+
+
+def meshKey(mesh: bpy.types.Mesh,
+            export_matrix: mathutils.Matrix,
+            materials: Dict[str, bpy.types.Material],
+            settings: tuple) -> str:
+    """Hashes everything that the attach of a mesh depends on:
+    the evaluated mesh data, the mesh and material settings and
+    the export settings"""
+    from . import bl_info
+
+    snapshot = common.MeshSnapshot.get(mesh, export_matrix)
+    key = hashlib.sha1()
+
+    for array in (snapshot.positions,
+                  snapshot.normals,
+                  snapshot.loopVertices,
+                  snapshot.loopColors,
+                  snapshot.loopUVs,
+                  snapshot.polyMaterials,
+                  snapshot.polyLoopStart,
+                  snapshot.polyLoopTotal):
+        if array is None:
+            key.update(b"None")
+        else:
+            key.update(str((array.dtype, array.shape)).encode())
+            key.update(numpy.ascontiguousarray(array).tobytes())
+
+    meshMaterials = list()
+    for m in mesh.materials:
+        if m is None:
+            meshMaterials.append(None)
+        else:
+            meshMaterials.append((m.name,
+                                  materials is None or m.name in materials,
+                                  rnaKey(m.saSettings)))
+
+    key.update(repr((cacheVersion,
+                     bl_info["version"],
+                     settings,
+                     mesh.name,
+                     rnaKey(mesh.saSettings),
+                     meshMaterials,
+                     strippifier.backend,
+                     strippifier.optimizeVertexCache,
+                     strippifier.vertexCacheSize,
+                     strippifier.stripSwaps,
+                     common.DLL is None,
+                     format_GC.poolPrecision)).encode())
+
+    return key.hexdigest()
+
+
+class AttachCache:
+    """Stores written attach data on disk, so that attaches of
+    unchanged meshes can be copied into the next export instead of
+    being converted again.
+
+    Each entry is a file named after its key. The least recently used
+    entries get removed once the cache is bigger than maxSize bytes
+    """
+
+    folder: str
+    maxSize: int
+    hits: int
+    misses: int
+
+    def __init__(self, folder: str, maxSize: int):
+        self.folder = folder
+        self.maxSize = maxSize
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(folder, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.folder, key + ".bin")
+
+    def get(self, key: str) -> dict:
+        """Returns the entry of a key, or None if there is none"""
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                entry = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            self.misses += 1
+            return None
+
+        # marking the entry as recently used
+        os.utime(path)
+        self.hits += 1
+        return entry
+
+    def put(self, key: str, entry: dict):
+        path = self.path(key)
+        try:
+            with open(path + ".tmp", "wb") as f:
+                pickle.dump(entry, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            print(" Attach cache entry could not be written:", e)
+
+    def evict(self):
+        """Removes the least recently used entries until
+        the cache fits into maxSize"""
+        files = list()
+        size = 0
+        for name in os.listdir(self.folder):
+            if not name.endswith(".bin"):
+                continue
+            stat = os.stat(os.path.join(self.folder, name))
+            files.append((stat.st_mtime, stat.st_size, name))
+            size += stat.st_size
+
+        files.sort()
+        for mtime, fileSize, name in files:
+            if size <= self.maxSize:
+                break
+            os.remove(os.path.join(self.folder, name))
+            size -= fileSize
+            if DO:
+                print(" Evicted", name)
+
+    def close(self):
+        """Evicts old entries and prints the hit rate"""
+        self.evict()
+        total = self.hits + self.misses
+        if total > 0:
+            print(" Attach cache:", self.hits, "of", total, "attaches reused",
+                  "({:.0%})".format(self.hits / total))
+
+
+def capture(fileW: fileHelper.FileWriter,
+            start: int,
+            endian: str,
+            labels: dict,
+            meshDict: dict,
+            write) -> dict:
+    """Creates a cache entry out of attach data that has just been
+    written to fileW, starting at start with the given endian.
+
+    The data gets written a second time at a different address, so that
+    the pointers in it can be found. Returns None if the data cannot be
+    relocated"""
+    end = fileW.tell()
+    alignment = start % 4
+
+    # the scratch data is written at an address that differs by a
+    # multiple of 4, but never by a multiple of 256. That way the lowest
+    # byte of every pointer changes, which marks where the pointer is
+    scratchStart = alignment
+    if (start - scratchStart) % 256 == 0:
+        scratchStart += 4
+    delta = start - scratchStart
+    if delta <= 0:
+        return None
+
+    scratch = fileHelper.FileWriter(inMemory=True)
+    scratch.setBigEndian(endian == ">")
+    scratch.w(bytes(scratchStart))
+    sLabels = dict()
+    sMeshDict = dict()
+    # the debug output has already been printed by the first write
+    with contextlib.redirect_stdout(io.StringIO()):
+        write(scratch, sLabels, sMeshDict)
+
+    data = bytes(scratch.buffer[scratchStart:])
+    real = bytes(fileW.buffer[start:end])
+    if len(data) != len(real):
+        return None
+
+    # grouping the changed bytes into pointers
+    changed = numpy.nonzero(numpy.frombuffer(data, dtype=numpy.uint8)
+                            != numpy.frombuffer(real, dtype=numpy.uint8))[0]
+    relocations = list()
+    if endian == ">":
+        # the lowest byte is the last one
+        covered = len(data)
+        for i in reversed(changed.tolist()):
+            if i < covered:
+                relocations.append(i - 3)
+                covered = i - 3
+        relocations.reverse()
+    else:
+        covered = -1
+        for i in changed.tolist():
+            if i > covered:
+                relocations.append(i)
+                covered = i + 3
+
+    uint = struct.Struct(endian + "I")
+    for r in relocations:
+        if r < 0 or r + 4 > len(data) \
+                or uint.unpack_from(real, r)[0] \
+                - uint.unpack_from(data, r)[0] != delta:
+            return None
+
+    # storing the data as it would be at the start of the file
+    data = bytearray(data)
+    for r in relocations:
+        uint.pack_into(data, r, uint.unpack_from(data, r)[0] - scratchStart)
+    entryLabels = sorted((a - start, n) for a, n in labels.items())
+    if entryLabels != sorted((a - scratchStart, n)
+                             for a, n in sLabels.items()):
+        return None
+
+    meshes = list()
+    for name, value in meshDict.items():
+        address, bounds = value
+        if sMeshDict.get(name, (None,))[0] != address - delta:
+            return None
+        meshes.append((name,
+                       address - start,
+                       tuple(bounds.boundCenter),
+                       bounds.radius))
+
+    return {
+        "data": bytes(data),
+        "endian": endian,
+        "alignment": alignment,
+        "relocations": relocations,
+        "labels": entryLabels,
+        "meshes": meshes
+    }
+
+
+def splice(fileW: fileHelper.FileWriter,
+           labels: dict,
+           meshDict: dict,
+           entry: dict) -> bool:
+    """Writes the data of a cache entry at the current position,
+    relocating its pointers. Returns False if the entry cant be placed
+    at the current position"""
+    start = fileW.tell()
+    if start % 4 != entry["alignment"] or fileW.endian != entry["endian"]:
+        return False
+
+    data = bytearray(entry["data"])
+    uint = struct.Struct(fileW.endian + "I")
+    for r in entry["relocations"]:
+        uint.pack_into(data, r, uint.unpack_from(data, r)[0] + start)
+    fileW.w(data)
+
+    for offset, name in entry["labels"]:
+        labels[start + offset] = name
+
+    for name, offset, center, radius in entry["meshes"]:
+        bounds = common.BoundingBox(None)
+        bounds.boundCenter = common.Vector3(center)
+        bounds.radius = radius
+        meshDict[name] = (start + offset, bounds)
+
+    return True
+
+
+def writeAttaches(fileW: fileHelper.FileWriter,
+                  labels: dict,
+                  meshDict: dict,
+                  meshes: List[bpy.types.Mesh],
+                  convert,
+                  write,
+                  cache: AttachCache = None,
+                  export_matrix: mathutils.Matrix = None,
+                  materials: Dict[str, bpy.types.Material] = None,
+                  settings: tuple = (),
+                  stream: bool = False):
+    """Converts the meshes and writes their attaches in order.
+
+    convert(mesh) returns the conversion generator of a mesh
+    (see common.convertAttaches), write(fileW, labels, meshDict,
+    mesh, attach) writes the attach and everything that belongs to it.
+
+    If a cache is passed, the meshes found in it are copied over
+    instead of converted. settings are the export settings which
+    change the written data.
+
+    With stream, the meshes are common.PendingMesh handles. Each one
+    gets evaluated, converted and written on its own and freed right
+    after, instead of converting all meshes together
+    """
+
+    if stream:
+        for pending in meshes:
+            mesh = pending.get()
+            try:
+                writeAttaches(fileW, labels, meshDict, [mesh],
+                              convert, write, cache,
+                              export_matrix, materials, settings)
+            finally:
+                pending.free()
+        return
+
+    entries: List[dict] = [None] * len(meshes)
+    keys: List[str] = [None] * len(meshes)
+    if cache is not None:
+        with exportStats.span("attachCache.lookup"):
+            for i, m in enumerate(meshes):
+                keys[i] = meshKey(m, export_matrix, materials, settings)
+                entries[i] = cache.get(keys[i])
+
+    missing = [i for i, e in enumerate(entries) if e is None]
+    attaches = dict(zip(missing, common.convertAttaches(
+        [convert(meshes[i]) for i in missing])))
+
+    for i, m in enumerate(meshes):
+        if entries[i] is not None:
+            with exportStats.span("attachCache.splice"):
+                spliced = splice(fileW, labels, meshDict, entries[i])
+            if spliced:
+                continue
+            # wrong alignment, so it has to be converted after all
+            cache.hits -= 1
+            cache.misses += 1
+            attaches[i] = common.convertAttaches([convert(m)])[0]
+
+        attach = attaches.pop(i)
+        if cache is None:
+            with exportStats.span("writeAttach"):
+                write(fileW, labels, meshDict, m, attach)
+            continue
+
+        start = fileW.tell()
+        endian = fileW.endian
+        aLabels = dict()
+        aMeshDict = dict()
+        with exportStats.span("writeAttach"):
+            write(fileW, aLabels, aMeshDict, m, attach)
+
+        with exportStats.span("attachCache.capture"):
+            entry = capture(fileW, start, endian, aLabels, aMeshDict,
+                            lambda w, l, d: write(w, l, d, m, attach))
+        if entry is not None:
+            cache.put(keys[i], entry)
+        elif DO:
+            print(" Attach of", m.name, "could not be cached")
+
+        labels.update(aLabels)
+        meshDict.update(aMeshDict)
@@ -0,0 +1,329 @@
+# batch exporter for running the addon without the blender ui,
+# e.g. on build machines:
+#
+#   blender -b --python batchExport.py -- jobs.json [--summary out.json]
+#                                         [--processes 4]
+#
+# the addon has to be installed in blender. jobs.json is a manifest:
+#
+#   {
+#     "defaults": {"apply_modifs": true},
+#     "jobs": [
+#       {"blend": "stage01.blend", "collection": "Level",
+#        "format": "SA2BLVL", "output": "out/stage01.sa2blvl"},
+#       {"blend": "chars.blend", "collection": "Sonic",
+#        "format": "SA2MDL", "output": "out/sonic.sa2mdl",
+#        "options": {"write_Specular": true}}
+#     ]
+#   }
+#
+# paths are relative to the manifest. "collection" is optional; without
+# it, the entire scene gets exported. "options" and "defaults" take the
+# same keywords as the export operators (apply_modifs, write_Specular,
+# optimize_vertex_cache, strip_swaps, use_attach_cache, attach_cache_size,
+# stream_meshes, weight_threshold, max_weights, compact_weights,
+# pool_precision, console_debug_output, profile_output).
+#
+# jobs of the same .blend file run in one blender session. With
+# --processes, the .blend files get split across multiple blender
+# processes, which export at the same time.
+#
+# the summary lists the status, time and output size of each job.
+# the exit code is 1 if any job failed
+
+import argparse
+import importlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Dict
+
+DIR = os.path.dirname(os.path.abspath(__file__))
+
+# format: (file type, export_format, default for write_Specular)
+FORMATS = {
+    "SA1MDL": ('MDL', 'SA1', True),
+    "SA2MDL": ('MDL', 'SA2', False),
+    "SA2BMDL": ('MDL', 'SA2B', False),
+    "SA1LVL": ('LVL', 'SA1', True),
+    "SA2LVL": ('LVL', 'SA2', False),
+    "SA2BLVL": ('LVL', 'SA2B', False),
+}
+
+# keywords that only the level exporter takes
+LVL_OPTIONS = ("use_attach_cache", "attach_cache_size", "stream_meshes")
+# keywords that only the model exporter takes
+MDL_OPTIONS = ("weight_threshold", "max_weights", "compact_weights")
+
+
+def readManifest(path: str) -> List[dict]:
+    """Reads the jobs of a manifest, with their defaults applied and
+    their paths made absolute"""
+    with open(path) as f:
+        manifest = json.load(f)
+
+    folder = os.path.dirname(os.path.abspath(path))
+    defaults = manifest.get("defaults", dict())
+
+    jobs = list()
+    for i, j in enumerate(manifest["jobs"]):
+        if j["format"] not in FORMATS:
+            raise ValueError(f"job {i}: unknown format {j['format']}")
+
+        options = dict(defaults)
+        options.update(j.get("options", dict()))
+
+        output = os.path.join(folder, j["output"])
+        jobs.append({
+            "index": i,
+            "name": j.get("name", os.path.basename(output)),
+            "blend": os.path.join(folder, j["blend"]),
+            "collection": j.get("collection"),
+            "format": j["format"],
+            "output": output,
+            "options": options,
+        })
+    return jobs
+
+
+# == exporting ==
+
+class JobContext:
+    """Passes everything on to the blender context, except for the
+    selected objects, which are the objects of the exported collection"""
+
+    def __init__(self, context, objects):
+        self._context = context
+        self.selected_objects = objects
+
+    def __getattr__(self, name):
+        return getattr(self._context, name)
+
+
+class JobReport:
+    """Stands in for the export operator, collecting its reports"""
+
+    def __init__(self):
+        self.messages = list()
+
+    def report(self, type, message):
+        self.messages.append(message)
+
+
+def loadAddon():
+    """Enables the addon in the running blender session"""
+    import addon_utils
+    name = os.path.basename(DIR)
+    addon_utils.enable(name, default_set=False)
+    return importlib.import_module(name)
+
+
+def jobResult(job: dict, error: str = None) -> dict:
+    """Creates the summary entry of a job"""
+    result = {
+        "index": job["index"],
+        "name": job["name"],
+        "blend": job["blend"],
+        "collection": job["collection"],
+        "format": job["format"],
+        "output": job["output"],
+    }
+    if error is not None:
+        result["status"] = "error"
+        result["error"] = error
+    return result
+
+
+def runJob(addon, job: dict) -> dict:
+    import bpy
+
+    result = jobResult(job)
+
+    outType, export_format, specular = FORMATS[job["format"]]
+
+    keywords = {
+        "filepath": job["output"],
+        "export_format": export_format,
+        "write_Specular": specular,
+        "use_selection": False,
+        "apply_modifs": True,
+        "console_debug_output": False,
+        "profile_output": False,
+    }
+    for k, v in job["options"].items():
+        if k in LVL_OPTIONS and outType != 'LVL' \
+                or k in MDL_OPTIONS and outType != 'MDL':
+            continue
+        keywords[k] = v
+
+    context = bpy.context
+    if job["collection"] is not None:
+        collection = bpy.data.collections.get(job["collection"])
+        if collection is None:
+            return jobResult(job, "collection not found")
+        context = JobContext(context, list(collection.all_objects))
+        keywords["use_selection"] = True
+
+    os.makedirs(os.path.dirname(job["output"]), exist_ok=True)
+    report = JobReport()
+
+    start = time.perf_counter()
+    try:
+        out = addon.exportFile(report, outType, context, **keywords)
+    except Exception as e:
+        out = None
+        report.messages.append(f"{type(e).__name__}: {e}")
+    result["seconds"] = round(time.perf_counter() - start, 3)
+
+    if out == {'FINISHED'} and os.path.isfile(job["output"]):
+        result["status"] = "ok"
+        result["bytes"] = os.path.getsize(job["output"])
+    else:
+        result["status"] = "error"
+        result["error"] = "\n".join(report.messages) or "export cancelled"
+    return result
+
+
+def runJobs(jobs: List[dict]) -> List[dict]:
+    """Runs the jobs in this blender session, opening each
+    .blend file once"""
+    import bpy
+
+    addon = loadAddon()
+
+    byBlend: Dict[str, List[dict]] = dict()
+    for j in jobs:
+        byBlend.setdefault(j["blend"], list()).append(j)
+
+    results = list()
+    for blend, blendJobs in byBlend.items():
+        start = time.perf_counter()
+        try:
+            bpy.ops.wm.open_mainfile(filepath=blend)
+        except Exception as e:
+            results.extend(jobResult(j, f"could not open {blend}: {e}")
+                           for j in blendJobs)
+            continue
+        print(f"opened {blend} in {time.perf_counter() - start:.2f}s")
+
+        for j in blendJobs:
+            res = runJob(addon, j)
+            print(f"{res['name']:<32} {res['status']:<6} "
+                  f"{res.get('seconds', 0):>8.2f}s {res.get('bytes', 0):>10}")
+            results.append(res)
+
+    return results
+
+
+# == multiple processes ==
+
+def splitJobs(jobs: List[dict], count: int) -> List[List[dict]]:
+    """Splits the jobs into count groups, keeping jobs of the same
+    .blend file together (they share a session)"""
+    byBlend: Dict[str, List[dict]] = dict()
+    for j in jobs:
+        byBlend.setdefault(j["blend"], list()).append(j)
+
+    def blendSize(path):
+        return os.path.getsize(path) if os.path.isfile(path) else 0
+
+    # the file size is a rough guess for the work. biggest files
+    # go first, each to the group with the least work so far
+    groups = [list() for i in range(min(count, len(byBlend)))]
+    work = [0] * len(groups)
+    for blend in sorted(byBlend, key=blendSize, reverse=True):
+        g = work.index(min(work))
+        groups[g].extend(byBlend[blend])
+        work[g] += blendSize(blend) * len(byBlend[blend])
+    return groups
+
+
+def runProcesses(jobs: List[dict], count: int) -> List[dict]:
+    """Runs the jobs across count background blender processes"""
+    import bpy
+
+    processes = list()
+    folder = tempfile.mkdtemp()
+    for i, group in enumerate(splitJobs(jobs, count)):
+        manifest = os.path.join(folder, f"jobs{i}.json")
+        summary = os.path.join(folder, f"summary{i}.json")
+        with open(manifest, "w") as f:
+            json.dump({"jobs": group}, f)
+        process = subprocess.Popen([bpy.app.binary_path,
+                                    "--background",
+                                    "--python", os.path.abspath(__file__),
+                                    "--", manifest,
+                                    "--summary", summary,
+                                    "--worker"])
+        processes.append((process, group, summary))
+
+    results = list()
+    for process, group, summary in processes:
+        process.wait()
+        if os.path.isfile(summary):
+            with open(summary) as f:
+                results.extend(json.load(f)["jobs"])
+        else:
+            results.extend(
+                jobResult(j, f"blender exited with {process.returncode}")
+                for j in group)
+    return results
+
+
+def main(args: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="Batch exporter")
+    parser.add_argument("manifest", help="json file with the export jobs")
+    parser.add_argument("--summary", help="write the job results to this json file")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="amount of blender processes to export with")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(args)
+
+    try:
+        import bpy
+    except ImportError:
+        print("the batch exporter has to run inside blender:\n"
+              " blender -b --python batchExport.py -- jobs.json")
+        return 1
+
+    if args.worker:
+        # manifest written by runProcesses, already resolved
+        with open(args.manifest) as f:
+            jobs = json.load(f)["jobs"]
+    else:
+        jobs = readManifest(args.manifest)
+
+    start = time.perf_counter()
+    if args.processes > 1:
+        results = runProcesses(jobs, args.processes)
+    else:
+        results = runJobs(jobs)
+    results.sort(key=lambda r: r["index"])
+
+    failed = [r for r in results if r["status"] != "ok"]
+    summary = {
+        "jobs": results,
+        "seconds": round(time.perf_counter() - start, 3),
+        "failed": len(failed),
+    }
+
+    if args.summary is not None:
+        with open(args.summary, "w") as f:
+            json.dump(summary, f, indent=2)
+
+    if not args.worker:
+        for r in failed:
+            print(f"failed: {r['name']}: {r['error']}")
+        print(f"{len(results) - len(failed)} of {len(results)} jobs exported "
+              f"in {summary['seconds']:.2f}s")
+
+    return 1 if len(failed) > 0 else 0
+
+
+if __name__ == "__main__":
+    # blender passes its own arguments; ours come after "--"
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else sys.argv[1:]
+    sys.exit(main(argv))
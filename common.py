@@ -1,12 +1,17 @@
 from struct import error
 import bpy
+import hashlib
+import itertools
 import mathutils
 import math
+import numpy
+import os
 import queue
 from typing import List, Dict, Tuple
-from . import fileHelper, enums
+from . import fileHelper, enums, strippifier, exportStats
 
 DO = False  # Debug Out
+DLL = None  # IOSA2.dll, loaded on register if available
 
 
 def center(p1: float, p2: float) -> float:
@@ -39,6 +44,13 @@ def RadToBAMS(v: float, asInt=False) -> int:
     return val
 
 
+def RadToBAMSArray(v: numpy.ndarray, asInt=False) -> numpy.ndarray:
+    """RadToBAMS for an entire array of angles"""
+    val = numpy.round(numpy.degrees(v) / 360.0 * 0x10000).astype(numpy.int64)
+    val[numpy.round(v, 4) == 0] = 0
+    return val & (0xFFFFFFFF if asInt else 0xFFFF)
+
+
 def BAMSToRad(v: int, shortRot=False) -> float:
     if not shortRot and v & 0x80000000:
         v -= 0x100000000
@@ -47,26 +59,142 @@ def BAMSToRad(v: int, shortRot=False) -> float:
     return math.radians(v / (0x10000 / 360.0))
 
 
-def getDistinctwID(items: list):
+def distinctKey(item, precision: int = None):
+    """Returns a hashable key for an item, which is equal for two items
+    whenever the items themselves are equal
+
+    Objects can provide their own key via a "distinctKey" method,
+    sequences (tuples, lists, vectors) get converted to tuples. If a
+    precision is given, floats get rounded to that many decimal places
+    """
+
+    if item is None:
+        return None
+    if hasattr(item, "distinctKey"):
+        return item.distinctKey(precision)
+    if isinstance(item, float):
+        return item if precision is None else round(item, precision)
+    if isinstance(item, (int, str, bytes)):
+        return item
+    return tuple(distinctKey(i, precision) for i in item)
+
+
+def zipKeys(*columns) -> List[tuple]:
+    """Returns a key tuple for every row of the columns. A column is a
+    numpy array, whose rows become tuples themselves if it has two
+    dimensions, or None, which puts None into every key"""
+    values = list()
+    for c in columns:
+        if c is None:
+            values.append(itertools.repeat(None))
+        elif c.ndim > 1:
+            values.append(map(tuple, c.tolist()))
+        else:
+            values.append(c.tolist())
+    return list(zip(*values))
+
+
+def getDistinctwID(items: list, precision: int = None):
+    """Returns the distinct items of a list and, for every item, the index
+    of its distinct counterpart
+
+    Items are looked up by their distinct key (see distinctKey) in a hash
+    table, so this runs in linear time. The distinct items keep the order
+    in which they first appear
+    """
 
     distinct = list()
     IDs = [0] * len(items)
+    lookup = dict()
 
     for i, o in enumerate(items):
-        found = None
-        for j, d in enumerate(distinct):
-            if o == d:
-                found = j
-                break
+        key = distinctKey(o, precision)
+        found = lookup.get(key)
         if found is None:
+            found = len(distinct)
+            lookup[key] = found
             distinct.append(o)
-            IDs[i] = len(distinct) - 1
-        else:
-            IDs[i] = found
+        IDs[i] = found
 
     return distinct, IDs
 
 
+def optimizeVertexCache(indexList: List[int],
+                        corners: list = None,
+                        strips: List[List[int]] = ()):
+    """Reorders the triangles of a triangle list for the post transform
+    vertex cache, if enabled (see strippifier.optimizeVertexCache).
+
+    Only triangle lists that get written in the given order can be
+    reordered, as strips are drawn in the order the strippifier picked.
+    strips are the strips written before the triangle list, if any.
+    The new order is only kept if it lowers the cache misses of the
+    whole written index stream. corners are the triangle corners that
+    the indices belong to, which get reordered along with them.
+    Returns the index list and corners
+    """
+    if not strippifier.optimizeVertexCache:
+        return indexList, corners
+
+    cacheSize = strippifier.vertexCacheSize
+    stream = [i for s in strips for i in s]
+    before = strippifier.CacheMisses(stream + indexList, cacheSize)
+    after = before
+
+    if len(indexList) >= 6:
+        order = strippifier.VertexCacheOrder(indexList, cacheSize)
+        result = [indexList[t * 3 + i] for t in order for i in range(3)]
+        misses = strippifier.CacheMisses(stream + result, cacheSize)
+        if misses < before:
+            after = misses
+            indexList = result
+            if corners is not None:
+                corners = [corners[t * 3 + i]
+                           for t in order for i in range(3)]
+
+    addVertexCacheStats(len(strippifier.stripTriangles(strips))
+                        + len(indexList) // 3, before, after)
+    return indexList, corners
+
+
+def countVertexCache(strips: List[List[int]]):
+    """Adds the cache misses of strips that get written on their own
+    to the vertex cache stats, if the optimization is enabled. Strips
+    keep the order of the strippifier, so their misses stay the same"""
+    if not strippifier.optimizeVertexCache:
+        return
+    misses = strippifier.CacheMisses([i for s in strips for i in s],
+                                     strippifier.vertexCacheSize)
+    addVertexCacheStats(len(strippifier.stripTriangles(strips)),
+                        misses, misses)
+
+
+def addVertexCacheStats(triangles: int, before: int, after: int):
+    vertexCacheStats[0] += triangles
+    vertexCacheStats[1] += before
+    vertexCacheStats[2] += after
+
+
+# written triangles, cache misses before and after reordering them
+vertexCacheStats = [0, 0, 0]
+
+
+def printVertexCacheStats():
+    """Prints the average cache miss ratio of the written index streams"""
+    triangles, before, after = vertexCacheStats
+    if triangles > 0:
+        print(" Vertex cache: ACMR {:.3f} -> {:.3f} over {} written triangles"
+              .format(before / triangles, after / triangles, triangles))
+
+
+def printSwapStats():
+    """Prints how many strips and indices the strip swaps saved"""
+    strips, indices, plainStrips, plainIndices = strippifier.swapStats
+    if plainStrips > 0:
+        print(" Strip swaps: {} -> {} strips, {} -> {} indices"
+              .format(plainStrips, strips, plainIndices, indices))
+
+
 class ExportError(Exception):
 
     def __init__(self, message):
@@ -109,7 +237,7 @@ class ColorARGB:
 
     @classmethod
     def fromARGB(cls, value: int):
-        col = ColorARGB()
+        col = cls.__new__(cls)
         col.a = (value >> 24) & 0xFF
         col.r = (value >> 16) & 0xFF
         col.g = (value >> 8) & 0xFF
@@ -144,6 +272,12 @@ class ColorARGB:
             and self.g == other.g \
             and self.b == other.b
 
+    def __hash__(self):
+        return hash(self.distinctKey())
+
+    def distinctKey(self, precision: int = None):
+        return (self.a, self.r, self.g, self.b)
+
     def __str__(self):
         return f"({self.a},{self.r},{self.g},{self.b})"
 
@@ -163,6 +297,19 @@ class UV:
     def __eq__(self, other):
         return self.x == other.x and self.y == other.y
 
+    def __hash__(self):
+        return hash(self.distinctKey())
+
+    def distinctKey(self, precision: int = None):
+        return (self.x, self.y)
+
+    @classmethod
+    def fromKey(cls, key: Tuple[int, int]):
+        """Returns the UV of a distinct key"""
+        uv = cls.__new__(cls)
+        uv.x, uv.y = key
+        return uv
+
     def getBlenderUV(self):
         return (self.x / 256.0, 1-(self.y / 256.0))
 
@@ -227,48 +374,28 @@ class BoundingBox:
     radius: float
 
     def __init__(self, vertices):
-        """Creates a bounding sphere from a set of vertices"""
+        """Creates a bounding sphere from a set of vertices
+
+        vertices can be an (n, 3) numpy array of points,
+        a mesh vertex collection or a list of objects with a "co"
+        """
 
         if vertices is None:
             self.radius = 0
             self.boundCenter = Vector3((0, 0, 0))
             return
 
-        x = 0
-        xn = 0
-        y = 0
-        yn = 0
-        z = 0
-        zn = 0
-
-        for v in vertices:
-            if x < v.co.x:
-                x = v.co.x
-            elif xn > v.co.x:
-                xn = v.co.x
-
-            if y < v.co.y:
-                y = v.co.y
-            elif yn > v.co.y:
-                yn = v.co.y
-
-            if z < v.co.z:
-                z = v.co.z
-            elif zn > v.co.z:
-                zn = v.co.z
-
-        cx = center(x, xn)
-        cy = center(y, yn)
-        cz = center(z, zn)
-
-        distance = 0
-        for v in vertices:
-            tDist = Vector3((cx - v.co.x,  cy - v.co.y, cz - v.co.z)).length()
-            if tDist > distance:
-                distance = tDist
-
-        self.boundCenter = Vector3((cx, cy, cz))
-        self.radius = distance
+        if isinstance(vertices, numpy.ndarray):
+            points = vertices
+        elif hasattr(vertices, "foreach_get"):
+            points = numpy.empty(len(vertices) * 3, dtype=numpy.float32)
+            vertices.foreach_get("co", points)
+        else:
+            points = numpy.array([tuple(v.co) for v in vertices])
+
+        center, radius = boundingSphere(points.reshape(-1, 3))
+        self.boundCenter = Vector3(center)
+        self.radius = radius
 
     def adjust(self, matrix: mathutils.Matrix):
         self.boundCenter = matrix @ self.boundCenter
@@ -282,6 +409,60 @@ class BoundingBox:
         return str(self.boundCenter) + " - " + str(self.radius)
 
 
+def boundingSphere(points: numpy.ndarray) -> Tuple[tuple, float]:
+    """Calculates a tight bounding sphere around an (n, 3) array of points
+
+    Uses Ritter's algorithm: starting with the sphere between two
+    far apart points, the sphere gets grown to include the point
+    furthest outside of it, until all points are inside. The result is
+    compared with the sphere around the center of the bounding box, and
+    the smaller one is used. Results are cached by the point data
+    """
+    if len(points) == 0:
+        return (0.0, 0.0, 0.0), 0.0
+
+    points = numpy.ascontiguousarray(points, dtype=numpy.float64)
+    key = (len(points), hashlib.sha1(points.tobytes()).digest())
+    cached = boundsCache.get(key)
+    if cached is not None:
+        return cached
+
+    # initial sphere
+    y = points[numpy.argmax(((points - points[0]) ** 2).sum(axis=1))]
+    z = points[numpy.argmax(((points - y) ** 2).sum(axis=1))]
+    center = (y + z) / 2
+    radius = numpy.linalg.norm(z - y) / 2
+
+    # growing it until everything is inside
+    while True:
+        distances = numpy.linalg.norm(points - center, axis=1)
+        far = numpy.argmax(distances)
+        distance = distances[far]
+        if distance <= radius * (1 + 1e-9):
+            break
+        newRadius = (radius + distance) / 2
+        center = center + (points[far] - center) * \
+            ((newRadius - radius) / distance)
+        radius = newRadius
+
+    radius = distances.max()
+
+    # the bounding box sphere can be tighter for box shaped meshes
+    boxCenter = (points.min(axis=0) + points.max(axis=0)) / 2
+    boxRadius = numpy.linalg.norm(points - boxCenter, axis=1).max()
+    if boxRadius < radius:
+        center = boxCenter
+        radius = boxRadius
+
+    result = (tuple(center.tolist()), float(radius))
+    boundsCache[key] = result
+    return result
+
+
+# bounding spheres by the point count and sha1 digest of the points
+boundsCache: Dict[Tuple[int, bytes], Tuple[tuple, float]] = dict()
+
+
 class ModelData:
     """A class that holds all necessary data to export an Object/COL"""
 
@@ -789,10 +970,7 @@ class Armature(ModelData):
 
         # now we have all objects that get modified by the armature
         # lets get the meshes
-        meshes = list()
-        for o in objects:
-            if o.processedMesh not in meshes:
-                meshes.append(o.processedMesh)
+        meshes = list(dict.fromkeys(o.processedMesh for o in objects))
 
         # giving each mesh an index buffer offset
         meshesWOffset = dict()
@@ -826,37 +1004,38 @@ class Armature(ModelData):
             obj = o.origObject
 
             if case1:
-                usedBoneGroups: Dict[Bone, bpy.types.VertexGroup] = dict()
+                # the first vertex group of each name
+                groupsByName: Dict[str, bpy.types.VertexGroup] = dict()
+                for g in obj.vertex_groups:
+                    groupsByName.setdefault(g.name, g)
 
+                # the vertex groups of the bones, in bone order
+                usedBoneGroups: Dict[Bone, bpy.types.VertexGroup] = dict()
                 for b in bones:
-                    for g in obj.vertex_groups:
-                        if g.name == b.name:
-                            usedBoneGroups[b] = g
-                            break
+                    g = groupsByName.get(b.name)
+                    if g is not None:
+                        usedBoneGroups[b] = g
 
-                usedGroups = [g.index for g in usedBoneGroups.values()]
+                # bone of each used group index
+                groupBones: Dict[int, Bone] = {
+                    g.index: b for b, g in usedBoneGroups.items()}
 
                 setStart = False
                 last = None
                 # checking valid weight groups
-                validGroups = list()
+                validGroups = set()
                 emptyVertsFound = False
                 for v in mesh.vertices:
                     found = False
                     for g in v.groups:
-                        if g.group in usedGroups and g.weight > 0:
+                        if g.weight > 0 and g.group in groupBones:
                             found = True
-                            if g.group not in validGroups:
-                                validGroups.append(g.group)
+                            validGroups.add(g.group)
                     if not found:
                         emptyVertsFound = True
-                usedGroups = validGroups
 
-                validBoneGroups: Dict[Bone, bpy.types.VertexGroup] = dict()
-                for b, g in usedBoneGroups.items():
-                    if g.index in usedGroups:
-                        validBoneGroups[b] = g
-                usedBoneGroups = validBoneGroups
+                usedBoneGroups = {b: g for b, g in usedBoneGroups.items()
+                                  if g.index in validGroups}
 
                 if emptyVertsFound:
                     weightMap[root.name] = [-2, enums.WeightStatus.Start]
@@ -926,15 +1105,31 @@ class Armature(ModelData):
         return bones[0].objectPtr
 
 
+@exportStats.timed("convertObjectData")
 def convertObjectData(context: bpy.types.Context,
                       use_selection: bool,
                       apply_modifs: bool,
                       export_matrix: mathutils.Matrix,
                       fmt: str,
-                      lvl: bool):
+                      lvl: bool,
+                      stream: bool = False):
+    """Converts the objects to export into ModelData and gets their meshes.
+
+    stream (levels only) gets PendingMesh handles instead of the meshes,
+    see getMeshes. Levels additionally get a function returned, which
+    undoes the modifier changes made for the export. Streamed meshes
+    need those until they are evaluated, so it has to be called after
+    they have been written; without stream, it does nothing"""
 
     global DO
 
+    # snapshots and normals of previous exports are outdated
+    meshSnapshots.clear()
+    normalCache.clear()
+    boundsCache.clear()
+    vertexCacheStats[:] = [0, 0, 0]
+    strippifier.swapStats[:] = [0, 0, 0, 0]
+
     # gettings the objects to export
     if use_selection:
         objects = context.selected_objects
@@ -1003,11 +1198,11 @@ def convertObjectData(context: bpy.types.Context,
                                       meshObjects,
                                       apply_modifs,
                                       context.evaluated_depsgraph_get(),
-                                      addESplit,
-                                      modifierStates)
+                                      modifierStates,
+                                      stream=lvl and stream)
 
-        for k, v in modifierStates.items():
-            k.show_viewport = v
+        restore = modifierRestorer([(addESplit, modifierStates)],
+                                   lvl and stream)
 
         ModelData.updateMeshes(objects, meshes)
 
@@ -1033,6 +1228,8 @@ def convertObjectData(context: bpy.types.Context,
             print("  Objects:", len(objects))
             print("  - - - - - -\n")
 
+        if lvl:
+            return objects, meshes, materials, mObjects, restore
         return objects, meshes, materials, mObjects
 
     else:  # only occurs when format is sa2lvl or sa2blvl
@@ -1059,8 +1256,8 @@ def convertObjectData(context: bpy.types.Context,
                                        mObjects2,
                                        apply_modifs,
                                        despgraph,
-                                       addESplit2,
-                                       modifierStates2)
+                                       modifierStates2,
+                                       stream=stream)
 
         finished = dict()
         for m in vMeshes:
@@ -1070,14 +1267,16 @@ def convertObjectData(context: bpy.types.Context,
                                      mObjects1,
                                      apply_modifs,
                                      despgraph,
-                                     addESplit1,
                                      modifierStates1,
-                                     finished)
+                                     finished,
+                                     stream)
 
-        for k, v in modifierStates1.items():
-            k.show_viewport = v
-        for k, v in modifierStates2.items():
-            k.show_viewport = v
+        # the visual states get restored first, as objects that are
+        # visible collisions had their modifiers hidden already when
+        # the visual states were stored
+        restore = modifierRestorer([(addESplit2, modifierStates2),
+                                    (addESplit1, modifierStates1)],
+                                   stream)
 
         meshes = list()
         meshes.extend(cMeshes)
@@ -1093,7 +1292,29 @@ def convertObjectData(context: bpy.types.Context,
             print("  Objects:", len(objects))
             print("  - - - - - -\n")
 
-        return objects, cMeshes, vMeshes, materials, cObjects, vObjects
+        return objects, cMeshes, vMeshes, materials, cObjects, vObjects, \
+            restore
+
+
+def modifierRestorer(changes: List[Tuple[Dict, Dict]], defer: bool):
+    """Returns a function that removes the added edge split modifiers
+    and resets the modifier visibilities (see evaluateMeshModifiers)
+    of each (addESplit, modifierStates) pair in order. Unless the
+    restoring gets deferred, it happens right away and the returned
+    function does nothing"""
+
+    def restore():
+        for addESplit, modifierStates in changes:
+            for obj, modifier in addESplit.items():
+                obj.modifiers.remove(modifier)
+            addESplit.clear()
+            for k, v in modifierStates.items():
+                k.show_viewport = v
+            modifierStates.clear()
+
+    if not defer:
+        restore()
+    return restore
 
 
 def sortChildren(cObject: bpy.types.Object,
@@ -1181,6 +1402,7 @@ def sortChildren(cObject: bpy.types.Object,
     return model
 
 
+@exportStats.timed("evaluateMeshModifiers")
 def evaluateMeshModifiers(objects: List[ModelData], apply_modifs: bool):
     tMeshes = list()
     for o in objects:
@@ -1229,13 +1451,19 @@ def evaluateMeshModifiers(objects: List[ModelData], apply_modifs: bool):
     return mObjects, meshesToConvert, addESplit, modifierStates
 
 
+@exportStats.timed("getMeshes")
 def getMeshes(meshesToConvert: List[ModelData],
               mObjects: List[ModelData],
               apply_modifs: bool,
               depsgraph,
-              addESplit: Dict[bpy.types.Object, bpy.types.EdgeSplitModifier],
               modifierStates: Dict[bpy.types.Modifier, bool],
-              finished=dict()):
+              finished=dict(),
+              stream: bool = False):
+    """Returns the triangulated meshes and the materials of the objects.
+
+    With stream, the meshes are PendingMesh handles instead, which
+    evaluate their mesh only once it is needed. The modifier changes of
+    evaluateMeshModifiers have to stay until then"""
     outMeshes = list()
     materials: Dict[str, bpy.types.Material] = dict()
 
@@ -1257,122 +1485,458 @@ def getMeshes(meshesToConvert: List[ModelData],
         ob_for_convert = obj.evaluated_get(depsgraph) if t_apply_modifs \
             else obj.original
 
-        me = ob_for_convert.to_mesh(preserve_all_data_layers=True,
-                                    depsgraph=depsgraph)
-        trianglulateMesh(me)
-
-        if obj in addESplit:
-            obj.modifiers.remove(addESplit[obj])
-
-        me.saSettings.sa2ExportType = obj.data.saSettings.sa2ExportType
-        me.saSettings.sa2IndexOffset = obj.data.saSettings.sa2IndexOffset
+        if stream:
+            me = PendingMesh(obj, ob_for_convert, depsgraph)
+        else:
+            me = evaluateMesh(obj, ob_for_convert, depsgraph)
 
         outMeshes.append(me)
 
     return outMeshes, materials
 
 
+@exportStats.timed("evaluateMesh")
+def evaluateMesh(obj: bpy.types.Object,
+                 ob_for_convert: bpy.types.Object,
+                 depsgraph) -> bpy.types.Mesh:
+    """Creates the triangulated mesh of an object"""
+    me = ob_for_convert.to_mesh(preserve_all_data_layers=True,
+                                depsgraph=depsgraph)
+    trianglulateMesh(me)
+
+    me.saSettings.sa2ExportType = obj.data.saSettings.sa2ExportType
+    me.saSettings.sa2IndexOffset = obj.data.saSettings.sa2IndexOffset
+    return me
+
+
+class PendingMesh:
+    """The mesh of an object which gets evaluated only when it is
+    needed and can be freed right after, so that only one evaluated
+    mesh has to exist at a time (see getMeshes with stream)"""
+
+    name: str
+    obj: bpy.types.Object
+    ob_for_convert: bpy.types.Object
+    depsgraph: bpy.types.Depsgraph
+    mesh: bpy.types.Mesh
+
+    def __init__(self,
+                 obj: bpy.types.Object,
+                 ob_for_convert: bpy.types.Object,
+                 depsgraph):
+        self.name = obj.data.name
+        self.obj = obj
+        self.ob_for_convert = ob_for_convert
+        self.depsgraph = depsgraph
+        self.mesh = None
+
+    def get(self) -> bpy.types.Mesh:
+        """Returns the triangulated mesh, evaluating it if necessary"""
+        if self.mesh is None:
+            self.mesh = evaluateMesh(self.obj,
+                                     self.ob_for_convert,
+                                     self.depsgraph)
+        return self.mesh
+
+    def free(self):
+        """Releases the mesh and everything cached for it"""
+        if self.mesh is None:
+            return
+        forgetMesh(self.mesh)
+        self.mesh = None
+        self.ob_for_convert.to_mesh_clear()
+
+
+@exportStats.timed("trianglulateMesh")
 def trianglulateMesh(mesh: bpy.types.Mesh):
     """Transforms a mesh into a mesh only consisting
     of triangles, so that it can be stripped"""
 
     # if we use custom normals, we gotta correct them
     # manually, since blenders triangulate is shit
-    if mesh.use_auto_smooth:
+    useSplit = mesh.use_auto_smooth
+    if useSplit:
         # calculate em, so that we can collect the correct normals
         mesh.calc_normals_split()
 
-        # and now store them, together with the vertex indices,
-        # since those will be the only identical data after triangulating
-        normalData = list()
-        for p in mesh.polygons:
-            indices = list()
-            normals = list()
-
-            for l in p.loop_indices:
-                loop = mesh.loops[l]
-                nrm = loop.normal
-                normals.append((nrm.x, nrm.y, nrm.z))
-                indices.append(loop.vertex_index)
-
-            normalData.append((indices, normals))
-
-        # free the split data
-        # mesh.free_normals_split()
+        loopCount = len(mesh.loops)
+        polyCount = len(mesh.polygons)
+        loopNormals = numpy.empty(loopCount * 3, dtype=numpy.float32)
+        mesh.loops.foreach_get("normal", loopNormals)
+        loopVertices = numpy.empty(loopCount, dtype=numpy.int32)
+        mesh.loops.foreach_get("vertex_index", loopVertices)
+        loopStart = numpy.empty(polyCount, dtype=numpy.int32)
+        mesh.polygons.foreach_get("loop_start", loopStart)
+        loopTotal = numpy.empty(polyCount, dtype=numpy.int32)
+        mesh.polygons.foreach_get("loop_total", loopTotal)
+
+        loopNormals = loopNormals.reshape(-1, 3).tolist()
+        loopVertices = loopVertices.tolist()
+
+        # and now store them by vertex index for each polygon, since
+        # the vertex indices are the only identical data after triangulating
+        normalData: List[Dict[int, tuple]] = list()
+        for start, total in zip(loopStart.tolist(), loopTotal.tolist()):
+            normals = dict()
+            for l in range(start, start + total):
+                normals.setdefault(loopVertices[l], tuple(loopNormals[l]))
+            normalData.append(normals)
 
     import bmesh
     bm = bmesh.new()
     bm.from_mesh(mesh)
+
+    if useSplit:
+        # remembering which polygon each face came from. the triangles
+        # created from a face inherit its layer values
+        origLayer = bm.faces.layers.int.new("saOrigIndex")
+        bm.faces.index_update()
+        for f in bm.faces:
+            f[origLayer] = f.index
+
     bmesh.ops.triangulate(bm,
                           faces=bm.faces,
                           quad_method='FIXED',
                           ngon_method='EAR_CLIP')
+
+    if useSplit:
+        # the mesh loops will be in the same order as the face loops
+        splitNormals = list()
+        for f in bm.faces:
+            normals = normalData[f[origLayer]]
+            for l in f.loops:
+                splitNormals.append(normals[l.vert.index])
+        bm.faces.layers.int.remove(origLayer)
+
     bm.to_mesh(mesh)
     bm.free()
 
-    if mesh.use_auto_smooth:
-        polygons = list()
-        for p in mesh.polygons:
-            polygons.append(p)
+    if useSplit:
+        mesh.normals_split_custom_set(splitNormals)
 
-        splitNormals = [None] * len(mesh.loops)
+    exportStats.count(len(mesh.vertices), len(mesh.polygons))
 
-        for nd in normalData:
-            foundTris = 0
-            toFind = len(nd[0])-2
 
-            out = False
-            toRemove = list()
+def getNormalArray(mesh: bpy.types.Mesh) -> numpy.ndarray:
+    """Returns the normal of every vertex as an (n, 3) array
 
-            for p in polygons:
-                found = 0
-                for l in p.loop_indices:
-                    if mesh.loops[l].vertex_index in nd[0]:
-                        found += 1
+    If the mesh uses auto smooth, the split normals of the loops
+    belonging to a vertex get averaged. Results are cached per mesh for
+    the current export (see normalCache)
+    """
+    key = mesh.as_pointer()
+    cached = normalCache.get(key)
+    if cached is not None and cached[0] is mesh:
+        return cached[1]
 
-                if found == 3:
-                    foundTris += 1
+    vertexCount = len(mesh.vertices)
+    normals = numpy.empty(vertexCount * 3, dtype=numpy.float32)
+    mesh.vertices.foreach_get("normal", normals)
+    normals = normals.reshape(-1, 3)
 
-                    for l in p.loop_indices:
-                        splitNormals[l] \
-                            = nd[1][nd[0].index(mesh.loops[l].vertex_index)]
+    if mesh.use_auto_smooth:
+        mesh.calc_normals_split()
+        loopCount = len(mesh.loops)
+        loopNormals = numpy.empty(loopCount * 3, dtype=numpy.float32)
+        mesh.loops.foreach_get("normal", loopNormals)
+        loopVertices = numpy.empty(loopCount, dtype=numpy.int32)
+        mesh.loops.foreach_get("vertex_index", loopVertices)
+        mesh.free_normals_split()
 
-                    toRemove.append(p)
-                    if foundTris == toFind:
-                        break
+        sums = numpy.zeros((vertexCount, 3), dtype=numpy.float32)
+        numpy.add.at(sums, loopVertices, loopNormals.reshape(-1, 3))
+        counts = numpy.bincount(loopVertices, minlength=vertexCount)
 
-            for p in toRemove:
-                polygons.remove(p)
+        # vertices without loops keep their vertex normal
+        used = counts > 0
+        normals[used] = sums[used] / counts[used, None].astype(numpy.float32)
 
-        if len(polygons) > 0:
-            print("\ntriangulating went wrong?", len(polygons))
-        else:
-            mesh.normals_split_custom_set(splitNormals)
+    normalCache[key] = (mesh, normals)
+    return normals
 
 
-def getNormalData(mesh: bpy.types.Mesh) -> list():
-    normals = list()
-    if mesh.use_auto_smooth:
-        mesh.calc_normals_split()
-        for v in mesh.vertices:
-            normal = mathutils.Vector((0, 0, 0))
-            normalCount = 0
-            for l in mesh.loops:
-                if l.vertex_index == v.index:
-                    normal += l.normal
-                    normalCount += 1
-            if normalCount == 0:
-                normals.append(v.normal)
-            else:
-                normals.append(normal / normalCount)
+def getNormalData(mesh: bpy.types.Mesh) -> List[mathutils.Vector]:
+    """Returns the normal of every vertex (see getNormalArray)"""
+    return [mathutils.Vector(n) for n in getNormalArray(mesh).tolist()]
+
+
+# vertex normals of the meshes of the current export, by mesh pointer
+normalCache: Dict[int, Tuple[bpy.types.Mesh, numpy.ndarray]] = dict()
+
+
+def transformPoints(points: numpy.ndarray,
+                    matrix: mathutils.Matrix) -> numpy.ndarray:
+    """Transforms an (n, 3) array of points by a matrix"""
+    m = numpy.array(matrix, dtype=numpy.float32)
+    result = points @ m[:3, :3].T
+    if m.shape[1] > 3:
+        result += m[:3, 3]
+    return result
+
+
+# axes and parity of each euler rotation order, as blender defines them
+eulerOrders = {
+    'XYZ': ((0, 1, 2), False),
+    'XZY': ((0, 2, 1), True),
+    'YXZ': ((1, 0, 2), True),
+    'YZX': ((1, 2, 0), False),
+    'ZXY': ((2, 0, 1), False),
+    'ZYX': ((2, 1, 0), True),
+}
+
+
+def eulersToMatrices(eulers: numpy.ndarray, order: str) -> numpy.ndarray:
+    """Returns the rotation matrices of an (n, 3) array of euler angles
+    with the given rotation order, as an (n, 3, 3) array"""
+    matrices = numpy.broadcast_to(numpy.eye(3), (len(eulers), 3, 3))
+    for axis in order:
+        i = "XYZ".index(axis)
+        j, k = (i + 1) % 3, (i + 2) % 3
+        cos = numpy.cos(eulers[:, i])
+        sin = numpy.sin(eulers[:, i])
+        rotation = numpy.zeros((len(eulers), 3, 3))
+        rotation[:, i, i] = 1
+        rotation[:, j, j] = cos
+        rotation[:, k, k] = cos
+        rotation[:, j, k] = -sin
+        rotation[:, k, j] = sin
+        matrices = rotation @ matrices
+    return matrices
+
+
+def quaternionsToMatrices(quaternions: numpy.ndarray) -> numpy.ndarray:
+    """Returns the rotation matrices of an (n, 4) array of quaternions
+    (w, x, y, z), as an (n, 3, 3) array"""
+    w, x, y, z = quaternions.T
+    return numpy.stack((
+        1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y),
+        2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x),
+        2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y)),
+        axis=1).reshape(-1, 3, 3)
+
+
+def matricesToEulers(matrices: numpy.ndarray, order: str) -> numpy.ndarray:
+    """Returns the euler angles of an (n, 3, 3) array of rotation matrices,
+    as an (n, 3) array. Of the two possible solutions, the same one as in
+    Matrix.to_euler() gets picked"""
+    (i, j, k), parity = eulerOrders[order]
+    m = matrices / numpy.linalg.norm(matrices, axis=1, keepdims=True)
+
+    cy = numpy.hypot(m[:, i, i], m[:, j, i])
+    eul1 = numpy.empty((len(m), 3))
+    eul2 = numpy.empty((len(m), 3))
+    eul1[:, i] = numpy.arctan2(m[:, k, j], m[:, k, k])
+    eul1[:, j] = numpy.arctan2(-m[:, k, i], cy)
+    eul1[:, k] = numpy.arctan2(m[:, j, i], m[:, i, i])
+    eul2[:, i] = numpy.arctan2(-m[:, k, j], -m[:, k, k])
+    eul2[:, j] = numpy.arctan2(-m[:, k, i], -cy)
+    eul2[:, k] = numpy.arctan2(-m[:, j, i], -m[:, i, i])
+
+    # gimbal lock
+    locked = cy <= 16 * numpy.finfo(numpy.float32).eps
+    eul1[locked, i] = numpy.arctan2(-m[locked, j, k], m[locked, j, j])
+    eul1[locked, k] = 0
+    eul2[locked] = eul1[locked]
+
+    if parity:
+        eul1 = -eul1
+        eul2 = -eul2
+
+    smaller = numpy.abs(eul1).sum(axis=1) > numpy.abs(eul2).sum(axis=1)
+    return numpy.where(smaller[:, None], eul2, eul1)
+
+
+class MeshSnapshot:
+    """The data of a triangulated mesh that the exporters need
+
+    All of it gets read in bulk via foreach_get into numpy arrays, so
+    that the formats dont have to access the mesh per vertex or loop.
+    Positions and normals are already transformed by the export matrix
+    """
 
-        mesh.free_normals_split()
-    else:
-        for v in mesh.vertices:
-            normals.append(v.normal)
-    return normals
+    mesh: bpy.types.Mesh
+    positions: numpy.ndarray  # (vertex count, 3)
+    normals: numpy.ndarray  # (vertex count, 3)
+    loopVertices: numpy.ndarray  # vertex index of each loop
+    loopColors: numpy.ndarray  # (loop count, 4) or None
+    loopUVs: numpy.ndarray  # (loop count, 2) or None
+    polyMaterials: numpy.ndarray  # material index of each polygon
+    polyLoopStart: numpy.ndarray
+    polyLoopTotal: numpy.ndarray
+
+    def __init__(self, mesh: bpy.types.Mesh, export_matrix: mathutils.Matrix):
+        self.mesh = mesh
+        self.name = mesh.name
+        self.matrix = export_matrix
+
+        vertexCount = len(mesh.vertices)
+        loopCount = len(mesh.loops)
+        polyCount = len(mesh.polygons)
+
+        co = numpy.empty(vertexCount * 3, dtype=numpy.float32)
+        mesh.vertices.foreach_get("co", co)
+        self.positions = transformPoints(co.reshape(-1, 3), export_matrix)
+
+        self.normals = transformPoints(getNormalArray(mesh), export_matrix)
+
+        self.loopVertices = numpy.empty(loopCount, dtype=numpy.int32)
+        mesh.loops.foreach_get("vertex_index", self.loopVertices)
+
+        self.loopColors = None
+        if len(mesh.vertex_colors) > 0:
+            colors = numpy.empty(loopCount * 4, dtype=numpy.float32)
+            mesh.vertex_colors[0].data.foreach_get("color", colors)
+            self.loopColors = colors.reshape(-1, 4)
+
+        self.loopUVs = None
+        if len(mesh.uv_layers) > 0:
+            uvs = numpy.empty(loopCount * 2, dtype=numpy.float32)
+            mesh.uv_layers[0].data.foreach_get("uv", uvs)
+            self.loopUVs = uvs.reshape(-1, 2)
+
+        self.polyMaterials = numpy.empty(polyCount, dtype=numpy.int32)
+        mesh.polygons.foreach_get("material_index", self.polyMaterials)
+        self.polyLoopStart = numpy.empty(polyCount, dtype=numpy.int32)
+        mesh.polygons.foreach_get("loop_start", self.polyLoopStart)
+        self.polyLoopTotal = numpy.empty(polyCount, dtype=numpy.int32)
+        mesh.polygons.foreach_get("loop_total", self.polyLoopTotal)
+
+    @classmethod
+    def get(cls, mesh: bpy.types.Mesh, export_matrix: mathutils.Matrix):
+        """Returns the snapshot of a mesh, which gets created only once
+        per export (see meshSnapshots)"""
+        key = mesh.as_pointer()
+        snapshot = meshSnapshots.get(key)
+        if snapshot is None or snapshot.mesh is not mesh \
+                or snapshot.matrix != export_matrix:
+            snapshot = MeshSnapshot(mesh, export_matrix)
+            meshSnapshots[key] = snapshot
+        return snapshot
+
+    def positionVectors(self) -> List[Vector3]:
+        return [Vector3(p) for p in self.positions.tolist()]
+
+    def normalVectors(self) -> List[Vector3]:
+        return [Vector3(n) for n in self.normals.tolist()]
+
+    def positionKeys(self) -> List[tuple]:
+        """Returns the distinct key of every position vector"""
+        return list(map(tuple, self.positions.tolist()))
+
+    def normalKeys(self) -> List[tuple]:
+        """Returns the distinct key of every normal vector"""
+        return list(map(tuple, self.normals.tolist()))
+
+    def colorValues(self) -> numpy.ndarray:
+        """Returns the ARGB value of every loop color"""
+        c = numpy.rint(self.loopColors.astype(numpy.float64) * 255)
+        c = c.astype(numpy.int64)
+        return (c[:, 3] << 24) | (c[:, 0] << 16) | (c[:, 1] << 8) | c[:, 2]
+
+    def colorObjects(self) -> List[ColorARGB]:
+        """Returns a ColorARGB for every loop"""
+        return [ColorARGB.fromARGB(v) for v in self.colorValues().tolist()]
+
+    def uvValues(self) -> numpy.ndarray:
+        """Returns the (x, y) UV values of every loop, as an (n, 2) array"""
+        uvs = self.loopUVs.astype(numpy.float64)
+        x = numpy.clip(numpy.rint(uvs[:, 0] * 256), -32767, 32767)
+        y = numpy.clip(numpy.rint((1 - uvs[:, 1]) * 256), -32767, 32767)
+        return numpy.stack((x, y), axis=1).astype(numpy.int32)
+
+    def uvObjects(self) -> List[UV]:
+        """Returns a UV for every loop"""
+        return [UV.fromKey(uv) for uv in self.uvValues().tolist()]
+
+    def loopOrder(self) -> Tuple[numpy.ndarray, numpy.ndarray]:
+        """Returns the loop indices in the order of the polygons (as
+        polygonLoops yields them) and the polygon of every one of them"""
+        totals = self.polyLoopTotal
+        polygons = numpy.repeat(numpy.arange(len(totals)), totals)
+        offsets = numpy.cumsum(totals) - totals
+        loops = numpy.arange(len(polygons)) - offsets[polygons] \
+            + self.polyLoopStart[polygons]
+        return loops, polygons
+
+    def polygonLoops(self):
+        """Yields the material index and loop indices of every polygon"""
+        for mat, start, total in zip(self.polyMaterials.tolist(),
+                                     self.polyLoopStart.tolist(),
+                                     self.polyLoopTotal.tolist()):
+            yield mat, range(start, start + total)
+
+
+# snapshots of the meshes of the current export, by mesh pointer
+meshSnapshots: Dict[int, MeshSnapshot] = dict()
+
+
+def forgetMesh(mesh: bpy.types.Mesh):
+    """Removes the cached data of a mesh that is about to be freed"""
+    key = mesh.as_pointer()
+    meshSnapshots.pop(key, None)
+    normalCache.pop(key, None)
+
+
+def pythonExecutable() -> str:
+    """Returns the python interpreter that blender runs on"""
+    # before 2.91, sys.executable is the blender binary
+    path = getattr(bpy.app, "binary_path_python", None)
+    if isinstance(path, str) and path != "":
+        return path
+    import sys
+    return sys.executable
+
+
+def conversionName(conversion) -> str:
+    """Returns the stage name of a conversion generator
+    (e.g. format_GC.Attach.convert)"""
+    module = conversion.gi_code.co_filename
+    module = os.path.splitext(os.path.basename(module))[0]
+    return module + "." + conversion.__qualname__
+
+
+def convertAttaches(conversions: list) -> list:
+    """Runs attach conversions and returns their results in order.
+
+    A conversion is a generator which yields lists of jobs (see
+    strippifier.RunJob) it needs, receives their results and finally
+    returns the attach. The jobs of all conversions run together, which
+    lets the deduplication and strippification run on all cores:
+
+    1. every conversion gets its mesh data and yields its first jobs
+    2. the jobs of all conversions run as one batch
+    3. every conversion continues with its results, yielding its
+       next jobs (back to 2.) or returning the attach
+    """
+
+    results = [None] * len(conversions)
+    sent = [None] * len(conversions)
+    pending = list(range(len(conversions)))
+
+    with strippifier.JobRunner(pythonExecutable()) as runner:
+        while True:
+            jobs = dict()
+            for i in pending:
+                c = conversions[i]
+                try:
+                    with exportStats.span(conversionName(c),
+                                          call=sent[i] is None):
+                        jobs[i] = c.send(sent[i])
+                except StopIteration as result:
+                    results[i] = result.value
+
+            pending = list(jobs.keys())
+            if len(pending) == 0:
+                break
+            batch = iter(runner.run(
+                [j for i in pending for j in jobs[i]]))
+            for i in pending:
+                sent[i] = [next(batch) for j in jobs[i]]
 
+    return results
 
+
+@exportStats.timed("writeMethaData")
 def writeMethaData(fileW: fileHelper.FileWriter,
                    labels: dict,
                    scene: bpy.types.Scene,
@@ -1408,18 +1972,13 @@ def writeMethaData(fileW: fileHelper.FileWriter,
         fileW.wString(strKey)
         fileW.align(4)
 
-    # returning to the dictionary start
+    # filling in the size and the dictionary
     size = fileW.tell() - sizeLoc - 4
-    fileW.seek(sizeLoc, 0)
-    fileW.wUInt(size)
-
-    # writing the dictionary
+    dictionary = [size]
     for key, val in newLabels.items():
-        fileW.wUInt(key)
-        fileW.wUInt(val)
-
-    # back to the end
-    fileW.seek(0, 2)
+        dictionary.append(key)
+        dictionary.append(val)
+    fileW.wUIntsAt(sizeLoc, dictionary)
 
     # getting the file info
     settings = scene.saSettings
@@ -1432,9 +1991,7 @@ def writeMethaData(fileW: fileHelper.FileWriter,
         fileW.wString(settings.author)
         fileW.align(4)
         size = fileW.tell() - sizeLoc - 4
-        fileW.seek(sizeLoc, 0)
-        fileW.wUInt(size)
-        fileW.seek(0, 2)
+        fileW.wUIntAt(sizeLoc, size)
 
         if DO:
             print(" Author:", settings.author)
@@ -1447,9 +2004,7 @@ def writeMethaData(fileW: fileHelper.FileWriter,
         fileW.wString(settings.description)
         fileW.align(4)
         size = fileW.tell() - sizeLoc - 4
-        fileW.seek(sizeLoc, 0)
-        fileW.wUInt(size)
-        fileW.seek(0, 2)
+        fileW.wUIntAt(sizeLoc, size)
 
         if DO:
             print(" Description:", settings.description)
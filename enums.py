@@ -17,6 +17,11 @@ class LVLFormatIndicator(Enum):
     SA2BLVL = 0x004C564C42324153
 
 
+class ANIMFormatIndicator(Enum):
+    """Format indicator for the binary animation file"""
+    SAANIM = 0x00004D494E414153
+
+
 class Chunktypes(Enum):
     """Meta Data type"""
     null = 0x0
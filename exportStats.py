@@ -0,0 +1,184 @@
+# timing and memory statistics of the export stages.
+#
+# the stages are marked with spans (either "with span(name):" or the
+# @timed(name) decorator), which record their time, amount of calls,
+# the vertices/triangles processed in them and their memory peak.
+# spans do nothing unless the statistics have been started
+
+import contextlib
+import functools
+import json
+import time
+import tracemalloc
+from typing import List, Dict
+
+enabled = False
+
+
+class Stage:
+    """Statistics of one export stage"""
+
+    name: str
+    calls: int
+    seconds: float
+    vertices: int
+    triangles: int
+    peakMemory: int  # bytes allocated on top of what was allocated before
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0
+        self.vertices = 0
+        self.triangles = 0
+        self.peakMemory = 0
+
+    def toDict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "seconds": round(self.seconds, 4),
+            "vertices": self.vertices,
+            "triangles": self.triangles,
+            "peakMemory": self.peakMemory,
+        }
+
+
+class SpanFrame:
+    """A running span"""
+
+    stage: Stage
+    startTime: float
+    startMemory: int
+    peak: int  # highest absolute memory peak seen inside of the span
+
+    def __init__(self, stage: Stage):
+        self.stage = stage
+        self.startTime = time.perf_counter()
+        self.startMemory = 0
+        self.peak = 0
+
+
+stages: Dict[str, Stage] = dict()
+stack: List[SpanFrame] = list()
+startTime = 0.0
+# older python versions cant reset the peak, in which case
+# the peaks are the highest memory usage of the entire export so far
+canResetPeak = hasattr(tracemalloc, "reset_peak")
+
+
+def start(trackMemory: bool = True):
+    """Clears the statistics and starts recording"""
+    global enabled, startTime
+    stages.clear()
+    stack.clear()
+    enabled = True
+    startTime = time.perf_counter()
+    if trackMemory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def stop():
+    """Stops recording"""
+    global enabled
+    enabled = False
+    stack.clear()
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def enter(name: str):
+    stage = stages.get(name)
+    if stage is None:
+        stage = Stage(name)
+        stages[name] = stage
+    frame = SpanFrame(stage)
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1].peak = max(stack[-1].peak, peak)
+        if canResetPeak:
+            tracemalloc.reset_peak()
+        frame.startMemory = current
+    stack.append(frame)
+
+
+def leave(call: bool = True):
+    frame = stack.pop()
+    stage = frame.stage
+    if call:
+        stage.calls += 1
+    stage.seconds += time.perf_counter() - frame.startTime
+
+    if tracemalloc.is_tracing():
+        peak = max(frame.peak, tracemalloc.get_traced_memory()[1])
+        stage.peakMemory = max(stage.peakMemory, peak - frame.startMemory)
+        if stack:
+            stack[-1].peak = max(stack[-1].peak, peak)
+
+
+@contextlib.contextmanager
+def span(name: str, call: bool = True):
+    """Records the statistics of the code inside the with block.
+    call=False continues a call that has been recorded already,
+    e.g. when a generator gets resumed"""
+    if not enabled:
+        yield
+        return
+    enter(name)
+    try:
+        yield
+    finally:
+        leave(call)
+
+
+def timed(name: str):
+    """Decorator that records each call of a function as a span"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            enter(name)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                leave()
+        return wrapper
+    return decorator
+
+
+def count(vertices: int = 0, triangles: int = 0):
+    """Adds processed vertices and triangles to the running span"""
+    if enabled and stack:
+        stack[-1].stage.vertices += vertices
+        stack[-1].stage.triangles += triangles
+
+
+def report() -> dict:
+    """Returns the recorded statistics"""
+    return {
+        "seconds": round(time.perf_counter() - startTime, 4),
+        "memoryTracked": tracemalloc.is_tracing(),
+        "peaksPerSpan": canResetPeak,
+        "stages": {s.name: s.toDict() for s in stages.values()},
+    }
+
+
+def writeReport(filepath: str, stats: dict):
+    """Writes a report (see report()) to a json file"""
+    with open(filepath, "w") as f:
+        json.dump(stats, f, indent=2)
+
+
+def summary(stats: dict) -> str:
+    """Returns the stages of a report as a table, slowest first.
+    The time of a stage includes the stages running inside of it"""
+    lines = [f"{'stage':<32} {'calls':>6} {'seconds':>9} "
+             f"{'verts':>8} {'tris':>8} {'peak MB':>8}"]
+    stages = sorted(stats["stages"].items(), key=lambda s: -s[1]["seconds"])
+    for name, s in stages:
+        lines.append(f"{name:<32} {s['calls']:>6} {s['seconds']:>9.3f} "
+                     f"{s['vertices']:>8} {s['triangles']:>8} "
+                     f"{s['peakMemory'] / 1048576:>8.2f}")
+    lines.append(f"{'total':<32} {'':>6} {stats['seconds']:>9.3f}")
+    return "\n".join(lines)
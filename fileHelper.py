@@ -1,54 +1,82 @@
 import bpy
 import os
 import mathutils
+import mmap
 import struct
 import tempfile
 
 
+def compileStructs(endian: str) -> dict:
+    """Precompiles the single value structs for an endian"""
+    return {f: struct.Struct(endian + f) for f in "bBhHeiIfqQd"}
+
+
+structsLittle = compileStructs("<")
+structsBig = compileStructs(">")
+
+
 class FileWriter:
     """Handles file writing
 
-    Contains methods to make binary writing easier
+    Contains methods to make binary writing easier.
+    Everything gets written into a buffer in memory, which gets
+    written to the file upon closing it
 
     Default endian: little
     """
 
-    def __init__(self, filepath=None):
-        if filepath is None:
+    def __init__(self, filepath=None, inMemory=False):
+        if inMemory:
+            # only the buffer is used, nothing gets written to disk
+            self.oFile = None
+            self.filepath = None
+        elif filepath is None:
             # write and read, binary
-            self.oFile = tempfile.TemporaryFile(mode="wb+", delete=False)
+            self.oFile = tempfile.NamedTemporaryFile(mode="wb+", delete=False)
             self.filepath = self.oFile.name
         else:
             self.oFile = open(filepath, "wb+")  # write and read, binary
             self.filepath = filepath
 
-        self.endian = "<"
+        self.buffer = bytearray()
+        self.position = 0
+        self.setBigEndian(False)
 
     # general methods
 
     def setBigEndian(self, bigEndian=False):
         self.endian = ">" if bigEndian else "<"
+        self.structs = structsBig if bigEndian else structsLittle
 
     def isBigEndian(self):
         return self.endian == ">"
 
     def tell(self):
         """Returns current position in file"""
-        return self.oFile.tell()
+        return self.position
 
     def seek(self, offset, relativeTo):
         """Moves writer position in current file
 
         relativeTo: 0 = start, 1 = current position, 2 = end
         """
-        self.oFile.seek(offset, relativeTo)
+        if relativeTo == 0:
+            self.position = offset
+        elif relativeTo == 1:
+            self.position += offset
+        else:
+            self.position = len(self.buffer) + offset
 
     def seekEnd(self):
         """Returns writer position to the end of the file"""
-        self.oFile.seek(0, 2)
+        self.position = len(self.buffer)
 
     def close(self):
-        """Closes File"""
+        """Writes the buffer to the file and closes it"""
+        if self.oFile is None:
+            return
+        if not self.oFile.closed:
+            self.oFile.write(self.buffer)
         self.oFile.close()
 
     def align(self, by):
@@ -56,67 +84,123 @@ class FileWriter:
         remaining = by - (size % by)
         if remaining == by:
             return
-        self.w(bytes([0] * remaining))
+        self.w(bytes(remaining))
 
     def pad(self, start, padding):
         length = self.tell() - start
         newlength = length + (padding - 1) & ~(padding - 1)
         addLength = newlength - length
-        self.w(bytes([0] * addLength))
+        self.w(bytes(addLength))
 
     # Writer methods
 
     def w(self, value):
         """Writes value to file"""
-        self.oFile.write(value)
+        if self.position == len(self.buffer):
+            self.buffer += value
+        else:
+            self.wAt(self.position, value)
+        self.position += len(value)
+
+    def wAt(self, address: int, value):
+        """Writes value at an address, without moving the writer"""
+        end = address + len(value)
+        if end > len(self.buffer):
+            self.buffer += bytes(end - len(self.buffer))
+        self.buffer[address:end] = value
 
     def wByte(self, value):
         """Writes single byte"""
-        self.w(struct.pack(self.endian + "B", value))
+        self.w(self.structs["B"].pack(value))
 
     def wShort(self, value):
         """Writes a signed Short"""
-        self.w(struct.pack(self.endian + "h", value))
+        self.w(self.structs["h"].pack(value))
 
     def wUShort(self, value):
         """Writes an unsigned Short"""
-        self.w(struct.pack(self.endian + "H", value))
+        self.w(self.structs["H"].pack(value))
 
     def wHalf(self, value):
         """Writes a Float"""
-        self.w(struct.pack(self.endian + "e", value))
+        self.w(self.structs["e"].pack(value))
 
     def wInt(self, value):
         """Writes a signed Integer"""
-        self.w(struct.pack(self.endian + "i", value))
+        self.w(self.structs["i"].pack(value))
 
     def wUInt(self, value):
         """Writes an unsigned Integer"""
-        self.w(struct.pack(self.endian + "I", value))
+        self.w(self.structs["I"].pack(value))
 
     def wFloat(self, value):
         """Writes a Float"""
-        self.w(struct.pack(self.endian + "f", value))
+        self.w(self.structs["f"].pack(value))
 
     def wLong(self, value):
         """Writes a signed Long"""
-        self.w(struct.pack(self.endian + "q", value))
+        self.w(self.structs["q"].pack(value))
 
     def wULong(self, value):
         """Writes an unsigned Long"""
-        self.w(struct.pack(self.endian + "Q", value))
+        self.w(self.structs["Q"].pack(value))
 
     def wDouble(self, value):
         """Writes a Double"""
-        self.w(struct.pack(self.endian + "d", value))
+        self.w(self.structs["d"].pack(value))
 
     def wString(self, string):
         """Writes a String in utf-8"""
         self.w(string.encode('utf-8'))
         self.wByte(0x00)
 
+    # bulk writer methods
+
+    def wArray(self, fmt: str, values):
+        """Writes a list of values of the same type (struct format)"""
+        values = list(values)
+        self.w(struct.pack(f"{self.endian}{len(values)}{fmt}", *values))
+
+    def wUShorts(self, values):
+        """Writes a list of unsigned Shorts"""
+        self.wArray("H", values)
+
+    def wUInts(self, values):
+        """Writes a list of unsigned Integers"""
+        self.wArray("I", values)
+
+    def wFloats(self, values):
+        """Writes a list of Floats"""
+        self.wArray("f", values)
+
+    def wVector3s(self, vectors):
+        """Writes a list of 3D vectors as floats"""
+        self.wArray("f", (c for v in vectors for c in (v.x, v.y, v.z)))
+
+    # patching methods
+
+    def wUIntAt(self, address: int, value):
+        """Writes an unsigned Integer at an address,
+        without moving the writer"""
+        self.wAt(address, self.structs["I"].pack(value))
+
+    def wUIntsAt(self, address: int, values):
+        """Writes a list of unsigned Integers at an address,
+        without moving the writer"""
+        values = list(values)
+        self.wAt(address,
+                 struct.pack(f"{self.endian}{len(values)}I", *values))
+
 
 class FileReader:
+    """Handles file reading
+
+    The file is memory mapped, so that only the parts that get read
+    are actually loaded. Besides the single value methods, there are
+    batch methods which read entire arrays in one call
+
+    Default endian: little
+    """
 
     def __init__(self, filepath: str):
         import os
@@ -124,18 +208,81 @@ class FileReader:
             print("Invalid file path")
             self.filepath = None
         else:
-            oFile = open(filepath, "rb")  # read, binary
-            self.fileC = oFile.read()
-            oFile.close()
+            with open(filepath, "rb") as oFile:  # read, binary
+                try:
+                    self.fileC = mmap.mmap(oFile.fileno(), 0,
+                                           access=mmap.ACCESS_READ)
+                except ValueError:
+                    # empty files cant be mapped
+                    self.fileC = oFile.read()
             self.filepath = filepath
             self.endian = "<"
 
+    def close(self):
+        """Releases the file"""
+        if isinstance(self.fileC, mmap.mmap):
+            try:
+                self.fileC.close()
+            except BufferError:
+                # numpy arrays still use the data; freed along with them
+                pass
+
     def setBigEndian(self, bigEndian=False):
         self.endian = ">" if bigEndian else "<"
 
     def isBigEndian(self):
         return self.endian == ">"
 
+    # batch reading
+
+    def rView(self, address: int, length: int) -> memoryview:
+        """Returns a view on the file data (without copying it)"""
+        return memoryview(self.fileC)[address:address + length]
+
+    def rArray(self, fmt: str, address: int, count: int) -> tuple:
+        """Returns count values of a type (struct format)"""
+        return struct.unpack_from(f"{self.endian}{count}{fmt}",
+                                  self.fileC, address)
+
+    def rUShorts(self, address: int, count: int) -> tuple:
+        """Returns count unsigned Shorts"""
+        return self.rArray("H", address, count)
+
+    def rFloats(self, address: int, count: int) -> tuple:
+        """Returns count Floats"""
+        return self.rArray("f", address, count)
+
+    def rStrided(self, fmt: str, address: int, count: int, stride: int) -> list:
+        """Returns a list of count tuples, each read with the struct format,
+        with stride bytes in between the start of each tuple"""
+        if count == 0:
+            return list()
+        entry = struct.Struct(self.endian + fmt)
+        if stride > entry.size:
+            entry = struct.Struct(f"{self.endian}{fmt}{stride - entry.size}x")
+        # the padding of the last entry may be outside the file
+        length = stride * count
+        if address + length > len(self.fileC):
+            result = list(entry.iter_unpack(
+                self.rView(address, stride * (count - 1))))
+            result.append(struct.unpack_from(self.endian + fmt, self.fileC,
+                                             address + stride * (count - 1)))
+            return result
+        return list(entry.iter_unpack(self.rView(address, length)))
+
+    def rVector3s(self, address: int, count: int, stride: int = 12) -> list:
+        """Returns a list of count (x, y, z) float tuples"""
+        return self.rStrided("3f", address, count, stride)
+
+    def rNumpy(self, dtype: str, address: int, count: int):
+        """Returns a numpy array of count values (e.g. dtype "u2" or "f4")
+        viewing the file data directly"""
+        import numpy
+        return numpy.frombuffer(self.fileC,
+                                dtype=numpy.dtype(self.endian + dtype),
+                                count=count,
+                                offset=address)
+
     # reading bytes in a specific way
 
     def rByte(self, address: int):
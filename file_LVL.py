@@ -3,7 +3,8 @@ import os
 import mathutils
 
 from typing import List, Dict
-from . import fileHelper, enums, common, format_BASIC, format_GC, format_CHUNK
+from . import fileHelper, enums, common, format_BASIC, format_GC, format_CHUNK, \
+    strippifier
 
 DO = False  # Debug out
 
@@ -48,6 +49,7 @@ def read(context: bpy.types.Context,
         file_format = 'SA2B'
     else:
         print("no Valid file")
+        fileR.close()
         return {'CANCELLED'}
 
     if DO:
@@ -271,6 +273,7 @@ def read(context: bpy.types.Context,
 
         common.fixMaterialNames(allobjects)
 
+    fileR.close()
     return {'FINISHED'}
 
 
@@ -280,9 +283,16 @@ def write(context,
           write_Specular,
           use_selection,
           apply_modifs,
-          console_debug_output):
+          console_debug_output,
+          use_attach_cache=False,
+          attach_cache_size=512,
+          stream_meshes=False,
+          optimize_vertex_cache=False,
+          strip_swaps=False,
+          pool_precision=0):
 
     from .common import ModelData
+    from . import attachCache
 
     global DO
     DO = console_debug_output
@@ -290,8 +300,13 @@ def write(context,
     format_BASIC.DO = DO
     format_CHUNK.DO = DO
     format_GC.DO = DO
+    attachCache.DO = DO
 
     format_CHUNK.writeSpecular = write_Specular
+    strippifier.optimizeVertexCache = optimize_vertex_cache
+    strippifier.stripSwaps = strip_swaps
+    format_GC.poolPrecision = pool_precision if pool_precision > 0 else None
+    format_GC.poolStats.clear()
 
     if DO:
         # clear console and enable debug outputs
@@ -329,17 +344,48 @@ def write(context,
     from bpy_extras.io_utils import axis_conversion
     global_matrix = axis_conversion(to_forward='-Z', to_up='Y',).to_4x4()
 
+    cache = None
+    if use_attach_cache:
+        cache = attachCache.AttachCache(attachCache.defaultFolder(),
+                                        attach_cache_size * 1024 * 1024)
+
+    def convertBASIC(m, isCollision=False):
+        mats = format_BASIC.Material.fromMaterialList(m.materials)
+        return format_BASIC.Attach.convert(m, global_matrix, 0, mats,
+                                           isCollision=isCollision)
+
+    def writeBASIC(fileW, labels, meshDict, m, mesh):
+        # the materials get written in front of each attach
+        mats = format_BASIC.Material.fromMaterialList(m.materials) \
+            if mesh is None else mesh.materials
+        matPtr = format_BASIC.Material.writeMaterials(fileW,
+                                                      mats,
+                                                      m.name,
+                                                      labels)
+        if mesh is not None:
+            mesh.matPtr = matPtr
+            mesh.write(fileW, labels, meshDict)
+            if DO:
+                print("Mesh written:", mesh.name)
+
+    def writeAttach(fileW, labels, meshDict, m, mesh):
+        if mesh is not None:
+            mesh.write(fileW, labels, meshDict)
+            if DO:
+                print("Mesh written:", mesh.name)
+
     # creating and getting variables to use in the export process
     if export_format == 'SA1':
         # the sa1 format doesnt need to
         # seperate between collision and visual meshes
-        objects, meshes, materials, mObjects \
+        objects, meshes, materials, mObjects, restoreModifiers \
             = common.convertObjectData(context,
                                        use_selection,
                                        apply_modifs,
                                        global_matrix,
                                        export_format,
-                                       True)
+                                       True,
+                                       stream_meshes)
         if objects == {'FINISHED'}:
             fileW.close()
             return {'FINISHED'}
@@ -351,18 +397,15 @@ def write(context,
         # then writing mesh data
         if DO:
             print(" == Writing BASIC attaches == \n")
-        for m in meshes:
-            matPtr, bscMaterials \
-                = format_BASIC.Material.writeMaterials(fileW,
-                                                       m.materials,
-                                                       m.name,
-                                                       labels)
-            mesh = format_BASIC.Attach.fromMesh(m,
-                                                global_matrix,
-                                                matPtr,
-                                                bscMaterials)
-            if mesh is not None:
-                mesh.write(fileW, labels, vMeshDict)
+        try:
+            attachCache.writeAttaches(fileW, labels, vMeshDict, meshes,
+                                      convertBASIC, writeBASIC,
+                                      cache, global_matrix, materials,
+                                      (export_format, "BASIC"),
+                                      stream_meshes)
+        finally:
+            # streamed meshes get evaluated while being written
+            restoreModifiers()
         if DO:
             print(" - - - - \n")
     else:
@@ -375,66 +418,62 @@ def write(context,
             colMat = format_BASIC.Material()
         colMat.write(fileW)
 
-        objects, cMeshes, vMeshes, materials, cObjects, vObjects \
-            = common.convertObjectData(context,
-                                       use_selection,
-                                       apply_modifs,
-                                       global_matrix,
-                                       export_format,
-                                       True)
+        (objects, cMeshes, vMeshes, materials, cObjects, vObjects,
+         restoreModifiers) = common.convertObjectData(context,
+                                                      use_selection,
+                                                      apply_modifs,
+                                                      global_matrix,
+                                                      export_format,
+                                                      True,
+                                                      stream_meshes)
         if objects == {'FINISHED'}:
             fileW.close()
             return {'FINISHED'}
 
         # writing the collision meshes
         cMeshDict = dict()
-        if DO:
-            print(" == Writing BASIC attaches == \n")
-        for m in cMeshes:
-            matPtr, bscMaterials \
-                = format_BASIC.Material.writeMaterials(
-                    fileW,
-                    m.materials,
-                    m.name,
-                    labels)
-
-            mesh = format_BASIC.Attach.fromMesh(
-                m,
-                global_matrix,
-                matPtr,
-                bscMaterials,
-                isCollision=True)
-
-            if mesh is not None:
-                mesh.write(fileW, labels, cMeshDict)
-                if DO:
-                    print("Mesh written:", mesh.name)
-        if DO:
-            print("")
-
-        # writing visual meshes
-        if export_format == 'SA2':
+        try:
             if DO:
-                print(" == Writing CHUNK attaches == \n")
-            for m in vMeshes:
-                mesh = format_CHUNK.Attach.fromMesh(m,
-                                                    global_matrix,
-                                                    materials)
-                if mesh is not None:
-                    mesh.write(fileW, labels, vMeshDict)
-                    if DO:
-                        print("Mesh written:", mesh.name)
-        else:
+                print(" == Writing BASIC attaches == \n")
+            attachCache.writeAttaches(fileW, labels, cMeshDict, cMeshes,
+                                      lambda m: convertBASIC(m, True),
+                                      writeBASIC,
+                                      cache, global_matrix, materials,
+                                      (export_format, "COLLISION"),
+                                      stream_meshes)
             if DO:
-                print(" == Writing GC attaches == \n")
-            for m in vMeshes:
-                mesh = format_GC.Attach.fromMesh(m, global_matrix, materials)
-                if mesh is not None:
-                    mesh.write(fileW, labels, vMeshDict)
-                    if DO:
-                        print("Mesh written:", mesh.name)
-        if DO:
-            print("")
+                print("")
+
+            # writing visual meshes
+            if export_format == 'SA2':
+                if DO:
+                    print(" == Writing CHUNK attaches == \n")
+                attachCache.writeAttaches(
+                    fileW, labels, vMeshDict, vMeshes,
+                    lambda m: format_CHUNK.Attach.convert(m,
+                                                          global_matrix,
+                                                          materials),
+                    writeAttach,
+                    cache, global_matrix, materials,
+                    (export_format, "CHUNK", write_Specular),
+                    stream_meshes)
+            else:
+                if DO:
+                    print(" == Writing GC attaches == \n")
+                attachCache.writeAttaches(
+                    fileW, labels, vMeshDict, vMeshes,
+                    lambda m: format_GC.Attach.convert(m,
+                                                       global_matrix,
+                                                       materials),
+                    writeAttach,
+                    cache, global_matrix, materials,
+                    (export_format, "GC"),
+                    stream_meshes)
+            if DO:
+                print("")
+        finally:
+            # streamed meshes get evaluated while being written
+            restoreModifiers()
 
     # writing model data
     ModelData.updateMeshPointer(objects, vMeshDict, cMeshDict)
@@ -529,10 +568,8 @@ def write(context,
     labelsAddress = fileW.tell()
 
     # writing the
-    fileW.seek(8, 0)  # go to the location of the model properties addrees
-    fileW.wUInt(landTableAddress)  # and write the address
-    fileW.wUInt(labelsAddress)  # labels address
-    fileW.seek(0, 2)  # then return back to the end
+    # write the landtable and labels address to the file header
+    fileW.wUIntsAt(8, (landTableAddress, labelsAddress))
 
     if DO:
         print(" == Landtable info ==")
@@ -566,6 +603,12 @@ def write(context,
                 print("", o.name)
         print(" - - - -\n")
 
+    if cache is not None:
+        cache.close()
+    common.printVertexCacheStats()
+    common.printSwapStats()
+    format_GC.printPoolStats()
+
     common.writeMethaData(fileW, labels, context.scene)
 
     fileW.close()
@@ -1,7 +1,8 @@
 import bpy
 import os
 import mathutils
-from . import fileHelper, enums, common, format_BASIC, format_CHUNK, format_GC
+from . import fileHelper, enums, common, format_BASIC, format_CHUNK, format_GC, \
+    exportStats, strippifier
 from .common import ModelData
 from typing import Dict, List
 
@@ -41,6 +42,7 @@ def read(context: bpy.types.Context,
         file_format = 'SA2B'
     else:
         print("no Valid file")
+        fileR.close()
         return {'CANCELLED'}
 
     if DO:
@@ -290,6 +292,7 @@ def read(context: bpy.types.Context,
         for o in objects:
             o.debug()
 
+    fileR.close()
     return {'FINISHED'}
 
 def readWithValues(context: bpy.types.Context, filepath: str, noDoubleVerts: bool, console_debug_output: bool, position: List, rotation: List, scale: List):
@@ -320,6 +323,7 @@ def readWithValues(context: bpy.types.Context, filepath: str, noDoubleVerts: boo
         file_format = 'SA2B'
     else:
         print("no Valid file")
+        fileR.close()
         return {'CANCELLED'}
 
     if DO:
@@ -573,6 +577,7 @@ def readWithValues(context: bpy.types.Context, filepath: str, noDoubleVerts: boo
     bpy.context.active_object.rotation_euler = (rotation[0], rotation[1], rotation[2])
     bpy.context.active_object.scale = (scale[0], scale[1], scale[2])
 
+    fileR.close()
     return {'FINISHED'}
 
 def write(context,
@@ -581,7 +586,13 @@ def write(context,
           write_Specular,
           use_selection,
           apply_modifs,
-          console_debug_output):
+          console_debug_output,
+          optimize_vertex_cache=False,
+          strip_swaps=False,
+          weight_threshold=0.0,
+          max_weights=0,
+          compact_weights=False,
+          pool_precision=0):
     from .common import ModelData
 
     global DO
@@ -592,6 +603,14 @@ def write(context,
     format_GC.DO = DO
 
     format_CHUNK.writeSpecular = write_Specular
+    strippifier.optimizeVertexCache = optimize_vertex_cache
+    strippifier.stripSwaps = strip_swaps
+    format_CHUNK.minWeight = weight_threshold
+    format_CHUNK.maxInfluences = max_weights
+    format_CHUNK.compactWeights = compact_weights
+    format_CHUNK.weightStats[:] = [0, 0, 0, 0]
+    format_GC.poolPrecision = pool_precision if pool_precision > 0 else None
+    format_GC.poolStats.clear()
 
     if DO:
         # clear console and enable debug outputs
@@ -645,36 +664,43 @@ def write(context,
         # bscMaterials \
         # = format_BASIC.Material.writeMaterials(fileW, materials, labels)
         # then writing mesh data
-        for m in meshes:
-            matPtr, bscMaterials \
-                = format_BASIC.Material.writeMaterials(fileW,
-                                                       m.materials,
-                                                       m.name,
-                                                       labels)
-            mesh = format_BASIC.Attach.fromMesh(m,
-                                                global_matrix,
-                                                matPtr,
-                                                bscMaterials)
+        bscMaterials = [format_BASIC.Material.fromMaterialList(m.materials)
+                        for m in meshes]
+        attaches = common.convertAttaches(
+            [format_BASIC.Attach.convert(m, global_matrix, 0, mats)
+             for m, mats in zip(meshes, bscMaterials)])
+
+        for m, mats, mesh in zip(meshes, bscMaterials, attaches):
+            matPtr = format_BASIC.Material.writeMaterials(fileW,
+                                                          mats,
+                                                          m.name,
+                                                          labels)
             if mesh is not None:
-                mesh.write(fileW, labels, meshDict)
+                mesh.matPtr = matPtr
+                with exportStats.span("writeAttach"):
+                    mesh.write(fileW, labels, meshDict)
 
     elif export_format == 'SA2':
         # armature meshes get written differently
         isArmature = (len(objects) == 1
                       and isinstance(objects[0], common.Armature))
         if not isArmature:
-            for m in meshes:
-                mesh = format_CHUNK.Attach.fromMesh(m,
-                                                    global_matrix,
-                                                    materials)
+            attaches = common.convertAttaches(
+                [format_CHUNK.Attach.convert(m, global_matrix, materials)
+                 for m in meshes])
+            for mesh in attaches:
                 if mesh is not None:
-                    mesh.write(fileW, labels, meshDict)
+                    with exportStats.span("writeAttach"):
+                        mesh.write(fileW, labels, meshDict)
 
     else:
-        for m in meshes:
-            mesh = format_GC.Attach.fromMesh(m, global_matrix, materials)
+        attaches = common.convertAttaches(
+            [format_GC.Attach.convert(m, global_matrix, materials)
+             for m in meshes])
+        for mesh in attaches:
             if mesh is not None:
-                mesh.write(fileW, labels, meshDict)
+                with exportStats.span("writeAttach"):
+                    mesh.write(fileW, labels, meshDict)
 
     # writing model data
     if export_format == 'SA2' and isArmature:  # writing an armature
@@ -687,10 +713,8 @@ def write(context,
         modelPtr = ModelData.writeObjectList(objects, fileW, labels)
 
     labelsAddress = fileW.tell()
-    fileW.seek(8, 0)  # go to the location of the model properties addrees
-    fileW.wUInt(modelPtr)  # and write the address
-    fileW.wUInt(labelsAddress)
-    fileW.seek(0, 2)  # then return back to the end
+    # write the model and labels address to the file header
+    fileW.wUIntsAt(8, (modelPtr, labelsAddress))
 
     if DO:
         print(" == Model file info ==")
@@ -708,6 +732,11 @@ def write(context,
                 print("", o.name)
         print(" - - - -\n")
 
+    common.printVertexCacheStats()
+    common.printSwapStats()
+    format_GC.printPoolStats()
+    format_CHUNK.printWeightStats()
+
     # writing chunk data
     common.writeMethaData(fileW, labels, context.scene)
 
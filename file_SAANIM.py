@@ -2,8 +2,10 @@ import bpy
 import mathutils
 import os
 import math
+import numpy
 
 from typing import Dict, List, Tuple
+from . import enums, common
 
 # Big thanks to @SageOfMirrors, without whom
 # this would have taken at least 10 times longer to make!
@@ -14,176 +16,424 @@ class ArmatureInvalidException(Exception):
         super().__init__(message)
 
 
+class ModelKeys:
+    """Keyframes of one model part (the root or a bone).
+
+    Each channel is a (frames, values) tuple of arrays, or None if the
+    model part doesnt have the channel. The values are in the space of
+    the file (y up): positions and scales as floats and rotations as
+    euler angles (XZY) in radians"""
+
+    position: Tuple[numpy.ndarray, numpy.ndarray]
+    rotation: Tuple[numpy.ndarray, numpy.ndarray]
+    scale: Tuple[numpy.ndarray, numpy.ndarray]
+
+    def __init__(self, position=None, rotation=None, scale=None):
+        self.position = position
+        self.rotation = rotation
+        self.scale = scale
+
+
+class Animation:
+    """Contents of an animation file"""
+
+    name: str
+    frameCount: int
+    modelParts: int
+    bezierInterpolation: bool
+    shortRot: bool
+    models: Dict[int, ModelKeys]
+
+    def __init__(self,
+                 name: str,
+                 frameCount: int,
+                 modelParts: int,
+                 bezierInterpolation: bool,
+                 shortRot: bool):
+        self.name = name
+        self.frameCount = frameCount
+        self.modelParts = modelParts
+        self.bezierInterpolation = bezierInterpolation
+        self.shortRot = shortRot
+        self.models = dict()
+
+
+# == binary files ==
+#
+# the binary format keeps the keyframes as NJS_MOTION data:
+#
+#   0x00 ulong  "SAANIM" indicator, with the version in the highest byte
+#   0x08 uint   motion address
+#   0x0C uint   name address (zero terminated utf-8)
+#   0x10 uint   model parts; the highest bit is set for short rotations
+#
+# the motion is the address of the model part table, the frame count,
+# the channel flags (ushort) and the channel count | interpolation
+# (ushort). Each model part in the table has an address for each
+# channel, followed by the keyframe count of each channel. A keyframe
+# is the frame number followed by 3 values.
+
+fileVersion = 1
+
+# channel flags, in the order in which the channels are stored
+channelFlags = {"position": 0x1, "rotation": 0x2, "scale": 0x4}
+splineInterpolation = 0x40
+
+floatKey = [("frame", "u4"), ("value", "f4", 3)]
+angleKey = [("frame", "u4"), ("value", "i4", 3)]
+shortAngleKey = [("frame", "u2"), ("value", "i2", 3)]
+
+
+def keyType(channel: str, shortRot: bool, endian: str) -> numpy.dtype:
+    """Returns the keyframe struct of a channel"""
+    if channel != "rotation":
+        key = floatKey
+    elif shortRot:
+        key = shortAngleKey
+    else:
+        key = angleKey
+    return numpy.dtype([(n, endian + t, *shape) for n, t, *shape in key])
+
+
+def readBinary(filepath: str) -> Animation:
+    from . import fileHelper
+    fileR = fileHelper.FileReader(filepath)
+    if fileR.filepath is None:
+        return None
+
+    indicator = fileR.rULong(0)
+    if indicator & 0x00FFFFFFFFFFFFFF != enums.ANIMFormatIndicator.SAANIM.value:
+        print("Not a .saanim file:", filepath)
+        fileR.close()
+        return None
+
+    motionAddr = fileR.rUInt(8)
+    nameAddr = fileR.rUInt(0xC)
+    modelParts = fileR.rUInt(0x10)
+    shortRot = bool(modelParts & 0x80000000)
+    modelParts &= 0x7FFFFFFF
+
+    name = fileR.rString(nameAddr)[:-1] if nameAddr != 0 else ""
+
+    tableAddr = fileR.rUInt(motionAddr)
+    frameCount = fileR.rUInt(motionAddr + 4)
+    flags = fileR.rUShort(motionAddr + 8)
+    inpFn = fileR.rUShort(motionAddr + 10)
+
+    anim = Animation(name, frameCount, modelParts,
+                     bool(inpFn & splineInterpolation), shortRot)
+
+    channels = [c for c, f in channelFlags.items() if flags & f]
+    channelCount = inpFn & 0xF
+    for m in range(modelParts):
+        addr = tableAddr + m * channelCount * 8
+        addresses = fileR.rArray("I", addr, channelCount)
+        counts = fileR.rArray("I", addr + channelCount * 4, channelCount)
+
+        model = ModelKeys()
+        for channel, keyAddr, count in zip(channels, addresses, counts):
+            if keyAddr == 0 or count == 0:
+                continue
+            keys = numpy.frombuffer(
+                fileR.fileC,
+                dtype=keyType(channel, shortRot, fileR.endian),
+                count=count,
+                offset=keyAddr)
+            frames = keys["frame"].astype(int)
+            values = keys["value"].astype(float)
+            if channel == "rotation":
+                values = numpy.radians(values / (0x10000 / 360.0))
+            setattr(model, channel, (frames, values))
+
+        if any(getattr(model, c) is not None for c in channels):
+            anim.models[m] = model
+
+    fileR.close()
+    return anim
+
+
+def writeBinary(filepath: str, anim: Animation):
+    from . import fileHelper
+
+    # short rotation keyframes store the frame in a short too
+    if anim.shortRot and anim.frameCount > 0x10000:
+        raise common.ExportError(
+            "Short rotations only support up to 65536 frames")
+
+    fileW = fileHelper.FileWriter(filepath)
+    fileW.wULong(enums.ANIMFormatIndicator.SAANIM.value | (fileVersion << 56))
+    fileW.wUInt(0)  # placeholder for the motion address
+    fileW.wUInt(0)  # placeholder for the name address
+    fileW.wUInt(anim.modelParts | (0x80000000 if anim.shortRot else 0))
+
+    nameAddr = fileW.tell()
+    fileW.wString(anim.name)
+    fileW.align(4)
+
+    channels = [c for c in channelFlags
+                if any(getattr(m, c) is not None
+                       for m in anim.models.values())]
+    table = [[0] * len(channels) * 2 for m in range(anim.modelParts)]
+
+    # keyframes
+    for index, model in anim.models.items():
+        for c, channel in enumerate(channels):
+            if getattr(model, channel) is None:
+                continue
+            frames, values = getattr(model, channel)
+
+            if channel == "rotation":
+                bits = 16 if anim.shortRot else 32
+                values = common.RadToBAMSArray(values, not anim.shortRot)
+                # stored signed
+                values = (values + (1 << (bits - 1))) % (1 << bits) \
+                    - (1 << (bits - 1))
+
+            keys = numpy.empty(len(frames),
+                               dtype=keyType(channel, anim.shortRot,
+                                             fileW.endian))
+            keys["frame"] = frames
+            keys["value"] = values
+
+            table[index][c] = fileW.tell()
+            table[index][len(channels) + c] = len(keys)
+            fileW.w(keys.tobytes())
+            fileW.align(4)
+
+    tableAddr = fileW.tell()
+    for t in table:
+        fileW.wUInts(t)
+
+    motionAddr = fileW.tell()
+    fileW.wUInt(tableAddr)
+    fileW.wUInt(anim.frameCount)
+    fileW.wUShort(sum(channelFlags[c] for c in channels))
+    fileW.wUShort(len(channels)
+                  | (splineInterpolation if anim.bezierInterpolation else 0))
+
+    fileW.wUIntsAt(8, [motionAddr, nameAddr])
+    fileW.close()
+
+
+# == json files ==
+
+def readJSON(filepath: str) -> Animation:
+    import json
+    with open(filepath) as f:
+        anim = json.load(f)
+
+    frameCount = anim["Frames"]
+    # the json files get written with 32 bit rotations
+    # either way, so the flag is ignored
+    shortRot = False
+    result = Animation(anim["Name"],
+                       frameCount,
+                       anim["ModelParts"],
+                       anim.get("InteroplationMode", 0) == 1,
+                       shortRot)
+
+    def keys(values: Dict[str, str], parse):
+        frames = sorted(f for f in map(int, values.keys()) if f < frameCount)
+        if len(frames) == 0:
+            return None
+        return (numpy.array(frames),
+                numpy.array([parse(values[str(f)].split(", "))
+                             for f in frames], dtype=float))
+
+    for m, mdl in anim["Models"].items():
+        result.models[int(m)] = ModelKeys(
+            keys(mdl["Position"], lambda v: [float(c) for c in v]),
+            keys(mdl["Rotation"],
+                 lambda v: [common.BAMSToRad(int(c, 16), shortRot)
+                            for c in v]),
+            keys(mdl["Scale"], lambda v: [float(c) for c in v]))
+
+    return result
+
+
+def writeJSON(filepath: str, anim: Animation):
+    models = dict()
+    for index, m in anim.models.items():
+        model = jsonEmptyModel()
+
+        if m.position is not None:
+            jsonPos = model["Position"]
+            for f, (x, y, z) in zip(m.position[0].tolist(),
+                                    m.position[1].tolist()):
+                jsonPos[str(f)] = \
+                    f"{round(x, 6)}, {round(y, 6)}, {round(z, 6)}"
+
+        if m.rotation is not None:
+            jsonRot = model["Rotation"]
+            bams = common.RadToBAMSArray(m.rotation[1], True)
+            for f, rot in zip(m.rotation[0].tolist(), bams.tolist()):
+                jsonRot[str(f)] = ", ".join(hex(r)[2:] for r in rot)
+
+        if m.scale is not None:
+            jsonScale = model["Scale"]
+            for f, (x, y, z) in zip(m.scale[0].tolist(),
+                                    m.scale[1].tolist()):
+                jsonScale[str(f)] = \
+                    f"{round(x, 6)}, {round(y, 6)}, {round(z, 6)}"
+
+        models[str(index)] = model
+
+    jsonF = dict()
+    jsonF["Models"] = models
+    jsonF["Frames"] = anim.frameCount
+    jsonF["Name"] = anim.name
+    jsonF["ModelParts"] = anim.modelParts
+    jsonF["InteroplationMode"] = 1 if anim.bezierInterpolation else 0
+    jsonF["ShortRot"] = anim.shortRot
+
+    import json
+    with open(filepath, 'w') as outfile:
+        json.dump(jsonF, outfile, indent=2)
+
+
+# == importing ==
+
+def setKeyframes(curves: List[bpy.types.FCurve],
+                 frames: numpy.ndarray,
+                 values: numpy.ndarray):
+    """Fills the (already added) keyframes of the curves, one value
+    column per curve"""
+    co = numpy.empty((len(frames), 2), dtype=numpy.float32)
+    co[:, 0] = frames
+    for i, k in enumerate(curves):
+        co[:, 1] = values[:, i]
+        k.keyframe_points.foreach_set("co", co.ravel())
+        for keyframe in k.keyframe_points:
+            keyframe.interpolation = "LINEAR"
+
+
 def read(
         filepath: str,
         nameConv,
         obj):
-    from .common import BAMSToRad
 
     print("importing", filepath)
     if filepath.endswith(".json"):
-        import json
-        f = open(filepath)
-        anim = json.load(f)
-        f.close()
-
-        armature = obj.data
-        modelParts = anim["ModelParts"]
-
-        if len(obj.pose.bones) + 1 != modelParts:
-            raise ArmatureInvalidException(
-                f"Could not load Animation "
-                f"{os.path.basename(filepath)[:len(filepath) - 5]}"
-                ": Bone Count does not math!\n"
-                f"{obj.name} bone count: {str(len(obj.pose.bones) + 1)}\n"
-                f"File Bone count: {str(modelParts)}")
-
-        name = ""
-        if nameConv != "CONTENT":
-            name = os.path.basename(filepath)[:-5]
+        anim = readJSON(filepath)
+    elif filepath.endswith(".saanim"):
+        anim = readBinary(filepath)
+    else:
+        return
+    if anim is None:
+        return
+
+    fileName = os.path.splitext(os.path.basename(filepath))[0]
+    modelParts = anim.modelParts
+
+    if len(obj.pose.bones) + 1 != modelParts:
+        raise ArmatureInvalidException(
+            f"Could not load Animation "
+            f"{fileName}"
+            ": Bone Count does not math!\n"
+            f"{obj.name} bone count: {str(len(obj.pose.bones) + 1)}\n"
+            f"File Bone count: {str(modelParts)}")
+
+    name = ""
+    if nameConv != "CONTENT":
+        name = fileName
+        try:
+            name = int(name)
+            name = str(name).zfill(3)
+        except Exception:
+            pass
+    if nameConv != "FILE":
+        if len(name) > 0:
+            name += "_"
+        name += anim.name
+
+    action = bpy.data.actions.new(name)
+    action.use_fake_user = True
+
+    # creating the fcurves for later usage
+    for m, mdl in anim.models.items():
+        if m == 0:
+            basePath = ""
+            mtx = obj.matrix_local
+            group = action.groups.new("Root")
+            rotMode = obj.rotation_mode
+        else:
+            # the root is a bone too, but doesnt count as one, hence -1
             try:
-                name = int(name)
-                name = str(name).zfill(3)
+                bone = obj.pose.bones[m - 1]
             except Exception:
-                pass
-        if nameConv != "FILE":
-            if len(name) > 0:
-                name += "_"
-            name += anim["Name"]
-
-        action = bpy.data.actions.new(name)
-        action.use_fake_user = True
-        frame_count = anim["Frames"]
-        shortRot = anim["ShortRot"]
-        shortRot = False
-
-        # creating the fcurves for later usage
-        for m in anim["Models"]:
-            if int(m) == 0:
-                basePath = ""
-                mtx = obj.matrix_local
-                group = action.groups.new("Root")
-                rotMode = obj.rotation_mode
+                continue
+            basePath = "pose.bones[\"{}\"].".format(bone.name)
+
+            if bone.bone.parent is None:
+                mtx = obj.matrix_local.inverted() @ bone.bone.matrix_local
             else:
-                # the root is a bone too, but doesnt count as one, hence -1
-                try:
-                    bone = obj.pose.bones[int(m) - 1]
-                except Exception:
-                    continue
-                basePath = "pose.bones[\"{}\"].".format(bone.name)
-
-                if bone.bone.parent is None:
-                    mtx = obj.matrix_local.inverted() @ bone.bone.matrix_local
+                mtx = (obj.matrix_local.inverted()
+                       @ bone.bone.parent.matrix_local).inverted() \
+                      @ bone.bone.matrix_local
+
+            group = action.groups.new(bone.name)
+            rotMode = bone.rotation_mode
+
+        isQuat = rotMode == 'QUATERNION'
+
+        if mdl.position is not None:
+            frames, values = mdl.position
+            posCurves = list()
+            dataPath = basePath + "location"
+            for pos in range(3):
+                pos_comp = action.fcurves.new(data_path=dataPath,
+                                              index=pos)
+                pos_comp.keyframe_points.add(len(frames))
+                pos_comp.auto_smoothing = "NONE"
+                pos_comp.group = group
+                posCurves.append(pos_comp)
+
+            # y up to z up
+            values = numpy.stack((values[:, 0],
+                                  -values[:, 2],
+                                  values[:, 1]), axis=1)
+            values -= numpy.array(mtx.to_translation())
+            setKeyframes(posCurves, frames, values)
+
+        if mdl.rotation is not None:
+            frames, values = mdl.rotation
+            rotCurves = list()
+            dataPath = basePath + (
+                "rotation_quaternion" if isQuat else "rotation_euler")
+            for rot in range(4 if isQuat else 3):
+                quat_comp = action.fcurves.new(data_path=dataPath,
+                                               index=rot)
+                quat_comp.keyframe_points.add(len(frames))
+                quat_comp.auto_smoothing = "NONE"
+                quat_comp.group = group
+                rotCurves.append(quat_comp)
+
+            mtxInv = mtx.inverted()
+            rotations = list()
+            for x, y, z in values.tolist():
+                rotMtx = mathutils.Euler((x, -z, y), 'XZY')\
+                    .to_matrix().to_4x4()
+
+                if isQuat:
+                    rotations.append((mtxInv @ rotMtx).to_quaternion())
                 else:
-                    mtx = (obj.matrix_local.inverted()
-                           @ bone.bone.parent.matrix_local).inverted() \
-                          @ bone.bone.matrix_local
-
-                group = action.groups.new(bone.name)
-                rotMode = bone.rotation_mode
-
-            isQuat = rotMode == 'QUATERNION'
-
-            mdl = anim["Models"][m]
-
-            posCurves: list = None
-            rotCurves: list = None
-            scaleCurves: list = None
-
-            if len(mdl["Position"]) > 0:
-                posCurves = list()
-                dataPath = basePath + "location"
-                for pos in range(3):
-                    pos_comp = action.fcurves.new(data_path=dataPath,
-                                                  index=pos)
-                    pos_comp.keyframe_points.add(len(mdl["Position"]))
-                    pos_comp.auto_smoothing = "NONE"
-                    pos_comp.group = group
-                    posCurves.append(pos_comp)
-
-            if len(mdl["Rotation"]) > 0:
-                rotCurves = list()
-                dataPath = basePath + (
-                    "rotation_quaternion" if isQuat else "rotation_euler")
-                for rot in range(4 if isQuat else 3):
-                    quat_comp = action.fcurves.new(data_path=dataPath,
-                                                   index=rot)
-                    quat_comp.keyframe_points.add(len(mdl["Rotation"]))
-                    quat_comp.auto_smoothing = "NONE"
-                    quat_comp.group = group
-                    rotCurves.append(quat_comp)
-
-            if len(mdl["Scale"]) > 0:
-                scaleCurves = list()
-                dataPath = basePath + "scale"
-                for scale in range(3):
-                    scale_comp = action.fcurves.new(
-                        data_path=dataPath,
-                        index=scale)
-                    scale_comp.keyframe_points.add(len(mdl["Scale"]))
-                    scale_comp.group = group
-                    scaleCurves.append(scale_comp)
-
-            posFrameID = 0
-            rotFrameID = 0
-            scaleFrameID = 0
-
-            for frame in range(frame_count):
-                frameStr = str(frame)
-
-                if posCurves is not None and frameStr in mdl["Position"]:
-                    posVec = mdl["Position"][frameStr]
-                    posVec = posVec.split(", ")
-                    posVec = mathutils.Vector(
-                        (float(posVec[0]),
-                         -float(posVec[2]),
-                         float(posVec[1])))
-                    posVec = posVec - mtx.to_translation()
-
-                    for i, k in enumerate(posCurves):
-                        keyframe = k.keyframe_points[posFrameID]
-                        keyframe.interpolation = "LINEAR"
-                        keyframe.co = frame, posVec[i]
-
-                    posFrameID += 1
-
-                if rotCurves is not None and frameStr in mdl["Rotation"]:
-
-                    rotVec = mdl["Rotation"][frameStr]
-                    rotVec = rotVec.split(", ")
-                    rotVec = (BAMSToRad(int(rotVec[0], 16), shortRot),
-                              -BAMSToRad(int(rotVec[2], 16), shortRot),
-                              BAMSToRad(int(rotVec[1], 16), shortRot))
-
-                    rotMtx = mathutils.Euler(rotVec, 'XZY')\
-                        .to_matrix().to_4x4()
-
-                    if isQuat:
-                        rotVec = (mtx.inverted() @ rotMtx).to_quaternion()
-                    else:
-                        rotVec = (mtx.inverted() @ rotMtx).to_euler(rotMode)
-
-                    for i, k in enumerate(rotCurves):
-                        keyframe = k.keyframe_points[rotFrameID]
-                        keyframe.interpolation = "LINEAR"
-                        keyframe.co = frame, rotVec[i]
-
-                    rotFrameID += 1
-
-                if scaleCurves is not None and frameStr in mdl["Scale"]:
-                    scaleVec = mdl["Scale"][frameStr]
-                    scaleVec = scaleVec.split(", ")
-                    scaleVec = (
-                        float(scaleVec[0]),
-                        float(scaleVec[2]),
-                        float(scaleVec[1]))
-
-                    for i, k in enumerate(scaleCurves):
-                        keyframe = k.keyframe_points[scaleFrameID]
-                        keyframe.interpolation = "LINEAR"
-                        keyframe.co = frame, scaleVec[i]
-
-                    scaleFrameID += 1
+                    rotations.append((mtxInv @ rotMtx).to_euler(rotMode))
+
+            setKeyframes(rotCurves, frames, numpy.array(rotations))
+
+        if mdl.scale is not None:
+            frames, values = mdl.scale
+            scaleCurves = list()
+            dataPath = basePath + "scale"
+            for scale in range(3):
+                scale_comp = action.fcurves.new(
+                    data_path=dataPath,
+                    index=scale)
+                scale_comp.keyframe_points.add(len(frames))
+                scale_comp.group = group
+                scaleCurves.append(scale_comp)
+
+            setKeyframes(scaleCurves, frames, values[:, (0, 2, 1)])
 
 
 def jsonEmptyModel():
@@ -280,18 +530,146 @@ def getFramesToCalc(
     return sorted(set(output))
 
 
-def setFrameValues(
-        curve: bpy.data.curves,
-        default: int,
-        channel: int,
-        outList: Dict[int, mathutils.Vector]):
-
-    if curve is None:
-        for v in outList.values():
-            v[channel] = default
-    else:
-        for k, v in outList.items():
-            v[channel] = curve.evaluate(k)
+# interpolation modes that sampleCurve evaluates itself
+interpolationIDs = {'CONSTANT': 0, 'LINEAR': 1, 'BEZIER': 2}
+
+
+def keyframeArray(points, attribute: str) -> numpy.ndarray:
+    """Returns a 2D vector attribute of all keyframes as an (n, 2) array"""
+    values = numpy.empty(len(points) * 2, dtype=numpy.float32)
+    points.foreach_get(attribute, values)
+    return values.reshape(-1, 2).astype(float)
+
+
+def sampleCurve(
+        curve: bpy.types.FCurve,
+        frames: numpy.ndarray) -> numpy.ndarray:
+    """Evaluates a curve at the frames, the same way that
+    curve.evaluate does, but for all frames at once.
+
+    Constant, linear and bezier segments get evaluated as arrays. Other
+    interpolations (easings) and curves with modifiers are left to
+    blender"""
+    points = curve.keyframe_points
+    if len(points) == 0 or len(curve.modifiers) > 0:
+        return numpy.array([curve.evaluate(f) for f in frames.tolist()])
+
+    co = keyframeArray(points, "co")
+    left = keyframeArray(points, "handle_left")
+    right = keyframeArray(points, "handle_right")
+    ipo = numpy.array([interpolationIDs.get(p.interpolation, -1)
+                       for p in points])
+    x = co[:, 0]
+    y = co[:, 1]
+    last = len(points) - 1
+
+    frames = numpy.asarray(frames, dtype=float)
+    values = numpy.empty(len(frames))
+
+    # extrapolation before the first and after the last keyframe
+    before = frames <= x[0]
+    after = ~before & (frames >= x[-1])
+    linear = curve.extrapolation == 'LINEAR'
+    for mask, end, neighbor, handle in ((before, 0, 1, left),
+                                        (after, last, last - 1, right)):
+        if not mask.any():
+            continue
+        values[mask] = y[end]
+        if not linear or ipo[end] == 0:
+            continue
+        if ipo[end] == 1:
+            if last == 0:
+                continue
+            # towards the neighboring keyframe
+            dx = x[neighbor] - x[end]
+            dy = y[neighbor] - y[end]
+        else:
+            # along the handle
+            dx = x[end] - handle[end, 0]
+            dy = y[end] - handle[end, 1]
+        if dx != 0:
+            values[mask] += (frames[mask] - x[end]) * dy / dx
+
+    inside = ~(before | after)
+    f = frames[inside]
+    k = numpy.searchsorted(x, f, side="right") - 1
+    k = numpy.minimum(k, last - 1)
+    x0, y0, x1, y1 = x[k], y[k], x[k + 1], y[k + 1]
+    result = numpy.empty(len(f))
+
+    # constant, and frames (almost) on a keyframe
+    result[:] = y0
+    onNext = numpy.abs(x1 - f) < 0.01
+    result[onNext] = y1[onNext]
+    between = (numpy.abs(f - x0) >= 0.01) & ~onNext
+
+    # linear
+    lin = between & (ipo[k] == 1) & (x1 != x0)
+    result[lin] = y0[lin] + (f[lin] - x0[lin]) \
+        / (x1[lin] - x0[lin]) * (y1[lin] - y0[lin])
+
+    # bezier
+    bez = between & (ipo[k] == 2)
+    if bez.any():
+        kb = k[bez]
+        p0 = co[kb]
+        p1 = right[kb]
+        p2 = left[kb + 1]
+        p3 = co[kb + 1]
+
+        # shortening handles that reach past the neighboring keyframe,
+        # so that the curve cant go back in time
+        h1 = numpy.abs(p0[:, 0] - p1[:, 0])
+        h2 = numpy.abs(p3[:, 0] - p2[:, 0])
+        length = p3[:, 0] - p0[:, 0]
+        fac = numpy.ones(len(kb))
+        long = h1 + h2 > length
+        fac[long] = length[long] / (h1 + h2)[long]
+        p1 = p0 - fac[:, None] * (p0 - p1)
+        p2 = p3 - fac[:, None] * (p3 - p2)
+
+        def bezier(t, a, b, c, d):
+            return a + t * (3 * (b - a)
+                            + t * (3 * (a - 2 * b + c)
+                                   + t * (d - a + 3 * (b - c))))
+
+        # finding the curve position of each frame by bisection
+        fb = f[bez]
+        lo = numpy.zeros(len(kb))
+        hi = numpy.ones(len(kb))
+        for i in range(48):
+            mid = (lo + hi) * 0.5
+            below = bezier(mid, p0[:, 0], p1[:, 0], p2[:, 0], p3[:, 0]) < fb
+            lo = numpy.where(below, mid, lo)
+            hi = numpy.where(below, hi, mid)
+        t = (lo + hi) * 0.5
+
+        flat = (p0[:, 1] == p1[:, 1]) & (p1[:, 1] == p2[:, 1]) \
+            & (p2[:, 1] == p3[:, 1])
+        result[bez] = numpy.where(
+            flat, p0[:, 1], bezier(t, p0[:, 1], p1[:, 1], p2[:, 1], p3[:, 1]))
+
+    # everything else
+    other = between & (ipo[k] == -1)
+    result[other] = [curve.evaluate(e) for e in f[other].tolist()]
+
+    values[inside] = result
+    return values
+
+
+def sampleChannels(
+        curves: List[bpy.types.FCurve],
+        defaults,
+        frames: numpy.ndarray) -> numpy.ndarray:
+    """Returns the values of the curves at the frames, one column per
+    curve. Channels without a curve get their default value"""
+    values = numpy.empty((len(frames), len(curves)))
+    for i, c in enumerate(curves):
+        if c is None:
+            values[:, i] = defaults[i]
+        else:
+            values[:, i] = sampleCurve(c, frames)
+    return values
 
 
 # cT = Use the current pose transform as default value for nonexistent channels
@@ -302,7 +680,6 @@ def write(
         bezierInterpolation: bool,
         cT: bool, obj):
 
-    from .common import RadToBAMS
     action: bpy.types.Action = obj.animation_data.action
     armature = obj.data
 
@@ -346,7 +723,11 @@ def write(
         newCurveMap[i[0]] = i[1]
     curveMap = newCurveMap
 
-    models = dict()
+    anim = Animation(action.name,
+                     int(frame_End) + 1,
+                     len(armature.bones) + 1,
+                     bezierInterpolation,
+                     shortRot)
     allFrames = range(0, int(frame_End + 1))
 
     for k, v in curveMap.items():
@@ -407,136 +788,82 @@ def write(
             elif name.endswith(endKey + "scale"):
                 scaleCurves.append(c)
 
-        model = jsonEmptyModel()
+        model = ModelKeys()
 
         # doing positions first
         if len(posCurves) > 0:
 
             # determining which frames to write first
-            frames = allFrames if bakeAll \
-                else getFramesToCalc(posCurves, frame_End)
-            positions: Dict[int, mathutils.Vector] \
-                = {f: mathutils.Vector() for f in frames}
+            frames = numpy.array(allFrames if bakeAll
+                                 else getFramesToCalc(posCurves, frame_End))
 
             curves = [None] * 3
-
             for c in posCurves:
                 curves[c.array_index] = c
 
-            if cT:
-                for c in curves:
-                    setFrameValues(
-                        c,
-                        defaultPos[c.array_index],
-                        c.array_index,
-                        positions)
-            else:
-                for c in curves:
-                    setFrameValues(
-                        c,
-                        0,
-                        c.array_index,
-                        positions)
-
-            jsonPos = model["Position"]
-            for k, v in positions.items():
-                pos = mtx @ v
-                jsonPos[str(k)] = \
-                    f"{round(pos.x, 6)}, {round(pos.z, 6)}, {round(-pos.y, 6)}"
+            values = sampleChannels(curves,
+                                    defaultPos if cT else (0, 0, 0),
+                                    frames)
+            pos = common.transformPoints(values, mtx)
+            model.position = (frames,
+                              numpy.stack((pos[:, 0], pos[:, 2], -pos[:, 1]),
+                                          axis=1))
 
         # next the rotations
         if len(rotCurves) > 0:
 
-            frames = allFrames if bakeAll \
-                else getFramesToCalc(rotCurves, frame_End)
+            frames = numpy.array(allFrames if bakeAll
+                                 else getFramesToCalc(rotCurves, frame_End))
             if rotType == 'QUATERNION':
-                rotations: Dict[int, mathutils.Vector] \
-                    = {f: mathutils.Quaternion() for f in frames}
                 curves = [None] * 4
-                identityRot = (0, 0, 0, 1)
+                identityRot = (1, 0, 0, 0)
             else:
-                rotations: Dict[int, mathutils.Vector] \
-                    = {f: mathutils.Euler() for f in frames}
                 curves = [None] * 3
                 identityRot = (0, 0, 0)
 
             for c in rotCurves:
                 curves[c.array_index] = c
 
-            if cT:
-                for c in curves:
-                    setFrameValues(
-                        c,
-                        defaultRot[c.array_index],
-                        c.array_index,
-                        rotations)
-            else:
-                for c in curves:
-                    setFrameValues(
-                        c,
-                        identityRot[c.array_index],
-                        c.array_index,
-                        rotations)
-
-            jsonRot = model["Rotation"]
-            for k, v in rotations.items():
-                # please dont kill me mathematicians owo'
-                matrix = mtx @ v.to_matrix().to_4x4()
+            values = sampleChannels(curves,
+                                    defaultRot if cT else identityRot,
+                                    frames)
 
-                rot = matrix.to_euler('XZY')
-
-                x = hex(RadToBAMS(rot.x, True))[2:]
-                y = hex(RadToBAMS(rot.z, True))[2:]
-                z = hex(RadToBAMS(-rot.y, True))[2:]
+            if rotType == 'QUATERNION':
+                matrices = common.quaternionsToMatrices(values)
+            else:
+                matrices = common.eulersToMatrices(
+                    values, 'XYZ' if rotType == 'AXIS_ANGLE' else rotType)
 
-                jsonRot[str(k)] = "{0}, {1}, {2}".format(x, y, z)
+            # please dont kill me mathematicians owo'
+            matrices = numpy.array(mtx.to_3x3()) @ matrices
+            rot = common.matricesToEulers(matrices, 'XZY')
+            model.rotation = (frames,
+                              numpy.stack((rot[:, 0], rot[:, 2], -rot[:, 1]),
+                                          axis=1))
 
         # and lastly the scale curves
         if len(scaleCurves) > 0:
 
-            frames = allFrames if bakeAll \
-                else getFramesToCalc(scaleCurves, frame_End)
-
-            scales: Dict[int, mathutils.Vector] \
-                = {f: mathutils.Vector() for f in frames}
+            frames = numpy.array(allFrames if bakeAll
+                                 else getFramesToCalc(scaleCurves, frame_End))
 
             curves = [None] * 3
-
             for c in scaleCurves:
                 curves[c.array_index] = c
 
-            if cT:
-                for c in curves:
-                    setFrameValues(
-                        c,
-                        defaultScale[c.array_index],
-                        c.array_index,
-                        scales)
-            else:
-                for c in curves:
-                    setFrameValues(c, 1, c.array_index, scales)
+            values = sampleChannels(curves,
+                                    defaultScale if cT else (1, 1, 1),
+                                    frames)
 
-            jsonScale = model["Scale"]
-            for k, v in scales.items():
-                # scaling doesnt need to get affected by any matrix,
-                # as it isnt part of the bones edit matrix
-                jsonScale[str(k)] = \
-                    f"{round(v.x, 6)}, {round(v.z, 6)}, {round(v.y, 6)}"
+            # scaling doesnt need to get affected by any matrix,
+            # as it isnt part of the bones edit matrix
+            model.scale = (frames, values[:, (0, 2, 1)])
 
-        models[str(index)] = model
-
-    # setting up the json file
-
-    jsonF = dict()
-    jsonF["Models"] = models
-    jsonF["Frames"] = int(frame_End) + 1
-    jsonF["Name"] = action.name
-    jsonF["ModelParts"] = len(armature.bones) + 1
-    jsonF["InteroplationMode"] = 1 if bezierInterpolation else 0
-    jsonF["ShortRot"] = shortRot
+        anim.models[index] = model
 
-    import json
-    with open(filepath, 'w') as outfile:
-        json.dump(jsonF, outfile, indent=2)
+    if filepath.endswith(".saanim"):
+        writeBinary(filepath, anim)
+    else:
+        writeJSON(filepath, anim)
 
     return {'FINISHED'}
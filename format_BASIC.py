@@ -2,9 +2,10 @@ import bpy
 import mathutils
 
 import math
+import numpy
 from typing import List, Dict, Tuple
 
-from . import enums, fileHelper, strippifier, common
+from . import enums, fileHelper, strippifier, common, exportStats
 from .common import Vector3, ColorARGB, UV, BoundingBox
 
 # note: In sa2's case, the BASIC model format is only used for collisions.
@@ -144,26 +145,26 @@ class Material:
         print("    Texture ID:", self.textureID)
         print("    Flags:", self.mFlags, "\n")
 
+    @classmethod
+    def fromMaterialList(cls,
+                         materials: List[bpy.types.Material]) -> list:
+        """converts the materials of a mesh to BASIC materials"""
+        if len(materials) == 0:
+            return [Material()]
+        return [Material.fromBlenderMat(m) for m in materials.values()]
+
     @classmethod
     def writeMaterials(cls,
                        fileW: fileHelper.FileWriter,
-                       materials: List[bpy.types.Material],
+                       mats: list,
                        meshname: str,
-                       labels: dict) -> Tuple[int, list]:
+                       labels: dict) -> int:
         """writes materials as BASIC materal data"""
-        mats = list()
         addr = fileW.tell()
         labels[addr] = "matlist_" + meshname
 
-        if len(materials) == 0:
-            bMat = Material()
-            bMat.write(fileW)
-            mats.append(bMat)
-        else:
-            for m in materials.values():
-                bMat = Material.fromBlenderMat(m)
-                bMat.write(fileW)
-                mats.append(bMat)
+        for m in mats:
+            m.write(fileW)
 
         global DO
         if DO:
@@ -171,7 +172,7 @@ class Material:
             for m in mats:
                 m.debug()
 
-        return [addr, mats]
+        return addr
 
     def write(self, fileW):
         # labels[fileW.tell()] = "mat_" + self.name
@@ -225,6 +226,15 @@ class PolyVert:
 
         return eID and ePNRM and eVC and eUV
 
+    def __hash__(self):
+        return hash(self.distinctKey())
+
+    def distinctKey(self, precision: int = None):
+        return (self.polyIndex,
+                common.distinctKey(self.polyNormal, precision),
+                common.distinctKey(self.color),
+                common.distinctKey(self.uv))
+
 
 class MeshSet:
     """A single mesh set in the model"""
@@ -240,6 +250,10 @@ class MeshSet:
     polys: List[List[PolyVert]]
     reverse: List[bool]
 
+    usePolyNormals: bool
+    useColor: bool
+    useUV: bool
+
     polyPtr: int
     polyAttribs: int
     polyNormalPtr: int
@@ -273,6 +287,10 @@ class MeshSet:
         else:
             self.reverse = reverse
 
+        self.usePolyNormals = usePolyNormals
+        self.useColor = useColor
+        self.useUV = useUV
+
         self.polyNormalPtr = -1 if usePolyNormals else 0
         self.ColorPtr = -1 if useColor else 0
         self.UVPtr = -1 if useUV else 0
@@ -288,26 +306,25 @@ class MeshSet:
                 fileW.wUShort(size)
             elif self.polytype == enums.PolyType.NPoly:
                 fileW.wUShort(min(0xFFFF, len(p)))
-            for l in p:
-                fileW.wUShort(l.polyIndex)
+            fileW.wUShorts(l.polyIndex for l in p)
         fileW.align(4)
 
         # writing poly normals (usually unused tho)
-        if self.polyNormalPtr == -1:
+        if self.usePolyNormals:
             self.polyNormalPtr = fileW.tell()
             for p in self.polys:
                 for l in p:
                     l.polyNormal.write(fileW)
 
         # writing colors
-        if self.ColorPtr == -1:
+        if self.useColor:
             self.ColorPtr = fileW.tell()
             for p in self.polys:
                 for l in p:
                     l.color.writeARGB(fileW)
 
         # writing uvs
-        if self.UVPtr == -1:
+        if self.useUV:
             self.UVPtr = fileW.tell()
             for p in self.polys:
                 for l in p:
@@ -451,20 +468,31 @@ class Attach:
                  materials: List[Material],
                  isCollision: bool = False):
         """Creates a BASIC mesh from a Blender mesh"""
+        return common.convertAttaches([cls.convert(mesh,
+                                                   export_matrix,
+                                                   matPtr,
+                                                   materials,
+                                                   isCollision)])[0]
+
+    @classmethod
+    def convert(cls, mesh: bpy.types.Mesh,
+                export_matrix: mathutils.Matrix,
+                matPtr: int,
+                materials: List[Material],
+                isCollision: bool = False):
+        """Conversion generator for common.convertAttaches"""
         global DO
 
-        # gettings the positions and normals
-        positions = [None] * len(mesh.vertices)
-        normals = common.getNormalData(mesh)
+        snapshot = common.MeshSnapshot.get(mesh, export_matrix)
+        exportStats.count(len(snapshot.positions),
+                          len(snapshot.polyLoopStart))
 
-        for i, v in enumerate(mesh.vertices):
-            positions[i] = Vector3(export_matrix @ v.co)
-            normals[i] = None if isCollision \
-                else Vector3(export_matrix @ normals[i])
+        # gettings the positions and normals
+        positions = snapshot.positionVectors()
+        normals = None if isCollision else snapshot.normalVectors()
 
         # calculating bounds
-        bounds = BoundingBox(mesh.vertices)
-        bounds.adjust(export_matrix)
+        bounds = BoundingBox(snapshot.positions)
 
         # determining which data the polys require
         usePolyNormals = False  # basically unused for our purposes
@@ -477,24 +505,38 @@ class Attach:
         # writing collisions, then it can directly just be 1 array
         polyLists = max(1, min(len(mesh.materials), len(materials)))
         polyListMin = polyLists - 1
-        # one poly list for each material
-        polys: List[List[PolyVert]] = [[] for i in range(polyLists)]
-
-        for f in mesh.polygons:
-            polyMat = polys[min(f.material_index, polyListMin)]
-            # we take the minimum number, this way if we use collisions,
-            # it will always place them in list no. 0
-            for lID in f.loop_indices:
-
-                loop = mesh.loops[lID]
-                vc = ColorARGB(mesh.vertex_colors[0].data[lID].color) \
-                    if useColor else None
-                uv = UV(mesh.uv_layers[0].data[lID].uv) if useUV else None
 
-                poly = PolyVert(loop.vertex_index, None, vc, uv)
-                polyMat.append(poly)
+        # one poly list for each material. each corner is a key of its
+        # vertex index, color and uv (see PolyVert.distinctKey)
+        loops, polygons = snapshot.loopOrder()
+        columns = (snapshot.loopVertices[loops],
+                   snapshot.colorValues()[loops] if useColor else None,
+                   snapshot.uvValues()[loops] if useUV else None)
+        # we take the minimum number, this way if we use collisions,
+        # it will always place them in list no. 0
+        loopMaterials = numpy.minimum(snapshot.polyMaterials[polygons],
+                                      polyListMin)
+        polys: List[List[tuple]] = list()
+        for i in range(polyLists):
+            selected = loopMaterials == i
+            polys.append(common.zipKeys(
+                *(None if c is None else c[selected] for c in columns)))
+
+        def polyVert(key):
+            index, color, uv = key
+            return PolyVert(index,
+                            None,
+                            None if color is None
+                            else ColorARGB.fromARGB(color),
+                            None if uv is None else UV.fromKey(uv))
+
+        # getting distinct polys and strippifying them; empty poly
+        # lists are ignored
+        allStrips = yield [("DISTINCT_STRIP", l, strippifier.stripSwaps,
+                            False, mesh.name)
+                           for l in polys if len(l) > 0]
+        allStrips = iter(allStrips)
 
-        # strippifying
         stripPolys = list()
         stripReverse: List[List[bool]] = list()
 
@@ -506,27 +548,27 @@ class Attach:
                 stripReverse.append(None)
                 continue
 
-            # getting distinct polys first
-
-            distinct, IDs = common.getDistinctwID(l)
-
-            stripIndices = strippifier.Strippify(IDs,
-                                                 doSwaps=False,
-                                                 concat=False,
-                                                 name=mesh.name)
-
-            # if the strips are longer than a
-            stripLength = 0
-            for s in stripIndices:
-                # +1 for the strip length in the poly data later on
-                stripLength += len(s) + 1
-                if s[0] == s[1]:
-                    stripLength -= 1
-
-            if stripLength > len(l):
+            firsts, IDs, stripIndices = next(allStrips)
+            distinct = [polyVert(l[i]) for i in firsts]
+
+            # writing a triangle list if thats smaller than the strips.
+            # each corner has an index, and a color and uv if used.
+            # strips have their length in front
+            cornerSize = 2 + (4 if useColor else 0) + (4 if useUV else 0)
+            encoding, stripIndices = strippifier.CheapestEncoding(
+                stripIndices,
+                lambda s: strippifier.stripsSize(s, cornerSize, 2, True),
+                lambda t: strippifier.triangleListSize(len(l) // 3, cornerSize))
+
+            if encoding == "LIST":
+                # written in the order of the mesh, unless reordered
+                # for the vertex cache
+                _, l = common.optimizeVertexCache(
+                    IDs, [distinct[i] for i in IDs])
                 stripPolys.append((enums.PolyType.Triangles, [l]))
                 stripReverse.append(None)
             else:
+                common.countVertexCache(stripIndices)
                 polyStrips = [None] * len(stripIndices)
                 revList: List[bool] = [True] * len(stripIndices)
 
@@ -588,7 +630,7 @@ class Attach:
             return None
         return Attach(mesh.name,
                       positions,
-                      None if isCollision else normals,
+                      normals,
                       meshsets,
                       matPtr,
                       materials,
@@ -602,14 +644,12 @@ class Attach:
 
         posPtr = fileW.tell()
         labels[posPtr] = "bsc_" + self.name + "_pos"
-        for p in self.positions:
-            p.write(fileW)
+        fileW.wVector3s(self.positions)
 
         if self.normals is not None:
             nrmPtr = fileW.tell()
             labels[nrmPtr] = "bsc_" + self.name + "_nrm"
-            for n in self.normals:
-                n.write(fileW)
+            fileW.wVector3s(self.normals)
         else:
             nrmPtr = 0
 
@@ -661,26 +701,15 @@ class Attach:
         nrm = fileR.rUInt(address + 4)
         vCount = fileR.rUInt(address + 8)
 
-        positions: List[Vector3] = list()
-        normals: List[Vector3] = list()
-
-        for v in range(vCount):
-            positions.append(
-                Vector3(
-                    (fileR.rFloat(pos),
-                     fileR.rFloat(pos + 4),
-                     fileR.rFloat(pos + 8))))
-            pos += 12
-
-            if nrm > 0:
-                normals.append(
-                    Vector3(
-                        (fileR.rFloat(nrm),
-                         fileR.rFloat(nrm + 4),
-                         fileR.rFloat(nrm + 8))))
-                nrm += 12
-            else:
-                normals.append(Vector3((0, 1, 0)))
+        positions: List[Vector3] = [
+            Vector3(p) for p in fileR.rVector3s(pos, vCount)]
+
+        if nrm > 0:
+            normals: List[Vector3] = [
+                Vector3(n) for n in fileR.rVector3s(nrm, vCount)]
+        else:
+            normals: List[Vector3] = [
+                Vector3((0, 1, 0)) for v in range(vCount)]
 
         tempAddr = fileR.rUInt(address + 12)
         meshSetCount = fileR.rUShort(address + 20)
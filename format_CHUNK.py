@@ -6,14 +6,33 @@ import copy
 import math
 from typing import List, Dict, Tuple
 import collections
+import numpy
 
-from . import enums, fileHelper, strippifier, common
+from . import enums, fileHelper, strippifier, common, exportStats
 from .common import Vector3, ColorARGB, UV, BoundingBox
 from .__init__ import SAMaterialSettings
 
 DO = False
 writeSpecular = True
 
+# weighted models: weights below minWeight get dropped (each vertex keeps
+# at least its biggest one), as well as all but the maxInfluences biggest
+# weights of each vertex (0 = no limit)
+minWeight = 0.0
+maxInfluences = 0
+# whether each vertex gets reset by the first bone that weighs it,
+# instead of the first bone writing every vertex
+compactWeights = False
+# vertex chunks and vertex writes of the weighted models,
+# followed by how many there would have been without the settings above
+weightStats = [0, 0, 0, 0]
+
+# limits of the chunk fields. Bigger data has to be split across chunks
+maxChunkSize = 0xFFFF  # size field (vertex chunks in ints, strips in shorts)
+maxStripCount = 0x3FFF  # the upper two bits are the user flag count
+maxStripLength = 0x7FFF  # negative lengths mark reversed strips
+maxVertexIndex = 0xFFFF
+
 
 class Vertex:
     """A single vertex in the model, stored in vertex chunksd"""
@@ -107,6 +126,35 @@ class VertexChunk:
             print("unsupported chunk format:", self.chunkType)
             return 0
 
+    def split(self) -> List["VertexChunk"]:
+        """Splits the vertices into chunks that fit into the size fields.
+
+        The vertices stay in order, so each chunk holds neighbouring
+        index buffer entries"""
+        vertexSize = self.vertexSize()
+        if vertexSize == 0 \
+                or vertexSize * len(self.vertices) + 1 <= maxChunkSize:
+            return [self]
+
+        # weighted vertices store their index in their ninja flags,
+        # the others are placed right after the previous chunk
+        weighted = self.chunkType \
+            == enums.ChunkType.Vertex_VertexNormalNinjaFlags
+
+        perChunk = (maxChunkSize - 1) // vertexSize
+        chunks = list()
+        offset = self.indexBufferOffset
+        for i in range(0, len(self.vertices), perChunk):
+            vertices = self.vertices[i:i + perChunk]
+            chunks.append(VertexChunk(self.chunkType,
+                                      self.weightType,
+                                      self.weightContinue,
+                                      offset,
+                                      vertices))
+            if not weighted:
+                offset += len(vertices)
+        return chunks
+
     def write(self, fileW: fileHelper.FileWriter):
         fileW.wByte(self.chunkType.value)
         fileW.wByte(self.weightType.value)
@@ -143,6 +191,12 @@ class PolyVert:
     def __eq__(self, other):
         return self.index == other.index and self.uv == other.uv
 
+    def __hash__(self):
+        return hash(self.distinctKey())
+
+    def distinctKey(self, precision: int = None):
+        return (self.index, common.distinctKey(self.uv))
+
     def write(self, fileW):
         fileW.wUShort(self.index)
 
@@ -470,15 +524,71 @@ class PolyChunk_Strip(PolyChunk):
             size += (len(s) * stripSize) + 1
         return size
 
+    def split(self) -> List["PolyChunk_Strip"]:
+        """Splits the strips into chunks that fit into the size fields.
+
+        Strips that are too long get cut into pieces which overlap by
+        two corners. The strips keep their order (which is the order
+        the strippifier walked the mesh in), so each chunk covers
+        neighbouring polygons"""
+        hasUV = self.chunkType == enums.ChunkType.Strip_StripUVN
+        cornerSize = 3 if hasUV else 1
+
+        # a single strip has to fit into a chunk too. Cutting at an even
+        # corner keeps the winding of the following piece
+        maxLength = min(maxStripLength, (maxChunkSize - 2) // cornerSize)
+        maxLength -= maxLength % 2
+
+        strips = list()
+        reversedStrips = list()
+        for strip, rev in zip(self.strips, self.reversedStrips):
+            while len(strip) > maxLength:
+                strips.append(strip[:maxLength])
+                reversedStrips.append(rev)
+                strip = strip[maxLength - 2:]
+            strips.append(strip)
+            reversedStrips.append(rev)
+
+        chunks = list()
+        start = 0
+        size = 1
+        for i, strip in enumerate(strips):
+            stripSize = len(strip) * cornerSize + 1
+            if size + stripSize > maxChunkSize or i - start >= maxStripCount:
+                chunks.append(PolyChunk_Strip(hasUV,
+                                              self.flags,
+                                              strips[start:i],
+                                              reversedStrips[start:i]))
+                start = i
+                size = 1
+            size += stripSize
+
+        if len(chunks) == 0:
+            self.strips = strips
+            self.reversedStrips = reversedStrips
+            return [self]
+
+        chunks.append(PolyChunk_Strip(hasUV,
+                                      self.flags,
+                                      strips[start:],
+                                      reversedStrips[start:]))
+        return chunks
+
     def write(self, fileW: fileHelper.FileWriter):
+        size = self.getSize()
+        if size > maxChunkSize or len(self.strips) > maxStripCount:
+            raise common.ExportError(
+                "Strip chunk too big (" + str(len(self.strips))
+                + " strips, size " + str(size) + "), it has to be split")
+
         super(PolyChunk_Strip, self).write(fileW)
         fileW.wByte(self.flags.value)
-        fileW.wUShort(self.getSize())
+        fileW.wUShort(size)
 
-        fileW.wUShort(min(0x3FFF, len(self.strips)))
+        fileW.wUShort(len(self.strips))
 
         for s, rev in zip(self.strips, self.reversedStrips):
-            size = min(0x7FFF, len(s)) * (-1 if rev else 1)
+            size = len(s) * (-1 if rev else 1)
             fileW.wShort(size)
             if self.chunkType == enums.ChunkType.Strip_StripUVN:
                 for p in s:
@@ -488,8 +598,12 @@ class PolyChunk_Strip(PolyChunk):
                     p.write(fileW)
 
 
-class Container(object):
-    pass
+def polyUVs(snapshot: common.MeshSnapshot) -> numpy.ndarray:
+    """Returns the uv values of every loop (see PolyVert.distinctKey),
+    which are those of UV() if the mesh has no uvs"""
+    if snapshot.loopUVs is not None:
+        return snapshot.uvValues()
+    return numpy.tile(UV().distinctKey(), (len(snapshot.loopVertices), 1))
 
 
 class Attach:
@@ -506,140 +620,60 @@ class Attach:
                  polyChunks: List[PolyChunk],
                  bounds: BoundingBox):
         self.name = name
-        self.polyChunks = polyChunks
         self.bounds = bounds
 
+        # splitting chunks that are too big for their size fields
         self.vertexChunks = list()
-        # getting the most out of the vertex chunks
         for v in vertexChunks:
-            if v.vertexSize() * len(v.vertices) < 0xFFFF:
-                self.vertexChunks.append(v)
-            else:
-                vertices = v.vertices
-                offset = v.indexBufferOffset
-
-                while len(vertices) > 0:
-                    vCount = min(0xFFFF - offset, math.floor(min(len(vertices)
-                                 * v.vertexSize(), 0xFFFF) / v.vertexSize()))
-
-                    chunkV = vertices[:vCount]
-                    vertices = vertices[vCount:]
-                    print("set:", len(chunkV), len(vertices))
-
-                    self.vertexChunks.append(
-                        VertexChunk(v.chunkType,
-                                    v.weightType,
-                                    v.weightContinue,
-                                    offset,
-                                    chunkV))
-                    offset += vCount
-
-        # optimizing poly chunks (well, only the strips)
+            self.vertexChunks.extend(v.split())
+
         self.polyChunks = list()
         for p in polyChunks:
-            if not isinstance(p, PolyChunk_Strip):
-                self.polyChunks.append(p)
+            if isinstance(p, PolyChunk_Strip):
+                self.polyChunks.extend(p.split())
             else:
-                p: PolyChunk_Strip = p
-
-                if p.getSize() > 0xFFFF or len(p.strips) > 0x3FFF:
-
-                    polyCSize = 3 \
-                        if p.chunkType == enums.ChunkType.Strip_StripUVN \
-                        else 1
-
-                    cSize = 1
-                    strips = list()
-                    revStrips = list()
-
-                    for c in range(len(strips)):
-                        strip = p.strips[c]
-                        stripSize = (len(strip) * polyCSize) + 1
-
-                        if cSize + stripSize > 0xFFFF or len(strips) >= 0x3FFF:
-                            self.polyChunks.append(
-                                PolyChunk_Strip(polyCSize == 3,
-                                                p.flags,
-                                                strips,
-                                                revStrips))
-                            strips = list()
-                            revStrips = list()
-                            cSize = 1
-
-                        strips.append(strip)
-                        revStrips.append(p.reversedStrips[c])
-
-                        cSize += stripSize
-
-                    if len(strips) > 0:
-                        self.polyChunks.append(
-                            PolyChunk_Strip(polyCSize == 3,
-                                            p.flags,
-                                            strips,
-                                            revStrips))
-
-                else:
-                    self.polyChunks.append(p)
+                self.polyChunks.append(p)
 
     @classmethod
-    def getPolygons(cls, mesh: bpy.types.Mesh,
+    def getPolygons(cls, snapshot: common.MeshSnapshot,
                     writeUVs: bool,
-                    polyVerts: List[PolyVert],
+                    polyKeys: List[tuple],
                     materials: Dict[str, bpy.types.Material]):
+        """Generator which yields the jobs for the polygons, which are
+        the distinct key (see PolyVert.distinctKey) of every loop, and
+        then returns the polygon chunks"""
 
-        # getting the distinct polygons
-        distinctPolys = list()
-        IDs = [0] * len(polyVerts)
-
-        distinctPolys, IDs = common.getDistinctwID(polyVerts)
+        mesh = snapshot.mesh
 
-        polygons: List[List[PolyVert]] \
-            = [[] for m in range(len(mesh.materials))]
-        if len(polygons) == 0:
-            polygons.append(list())
+        # getting the distinct polygons
+        (firsts, IDs), = yield [("DISTINCT", polyKeys, None)]
+        distinctPolys = [PolyVert(polyKeys[i][0], UV.fromKey(polyKeys[i][1]))
+                         for i in firsts]
 
         # assembling the polygons
-        for p in mesh.polygons:
-            for l in p.loop_indices:
-                polygons[p.material_index].append(IDs[l])
+        loops, loopPolygons = snapshot.loopOrder()
+        loopIDs = numpy.asarray(IDs, dtype=numpy.int64)[loops]
+        loopMaterials = snapshot.polyMaterials[loopPolygons]
+        polygons: List[List[int]] \
+            = [loopIDs[loopMaterials == m].tolist()
+               for m in range(max(1, len(mesh.materials)))]
 
         # converting triangle lists to strips
-        # [material specific][strip][polygon]
-        strips: List[List[List[PolyVert]]] = list()
-        stripRev: List[List[bool]] = list()
-
-        for l in polygons:
-            if len(l) == 0:
-                strips.append(None)
-                stripRev.append(None)
-                continue
-            stripIndices = strippifier.Strippify(l,
-                                                 doSwaps=False,
-                                                 concat=False,
-                                                 name=mesh.name)
+        # [material specific][strip][index]
+        strips: List[List[List[int]]] = list()
 
-            polyStrips = [None] * len(stripIndices)
-            polyStripsRev = [True] * len(stripIndices)
+        allStrips = yield [("STRIP", l, strippifier.stripSwaps, False, mesh.name)
+                           for l in polygons if len(l) > 0]
+        allStrips = iter(allStrips)
 
-            for i, strip in enumerate(stripIndices):
-                if strip[0] == strip[1]:
-                    polyStripsRev[i] = False
-                    strip = strip[1:]
-
-                tStrip = [0] * len(strip)
-                for j, index in enumerate(strip):
-                    tStrip[j] = distinctPolys[index]
-                polyStrips[i] = tStrip
-
-            strips.append(polyStrips)
-            stripRev.append(polyStripsRev)
+        for l in polygons:
+            strips.append(next(allStrips) if len(l) > 0 else None)
 
         # generating polygon chunks
         polyChunks: List[PolyChunk] = list()
 
-        for mID, strip in enumerate(zip(strips, stripRev)):
-            l, lrev = strip
-            if l is None:
+        for mID, stripIndices in enumerate(strips):
+            if stripIndices is None:
                 continue
 
             # getting material
@@ -774,7 +808,32 @@ class Attach:
                 if matProps.b_unknown:
                     stripFlags |= enums.StripFlags.Unknown
 
-            polyChunks.append(PolyChunk_Strip(stripUVs, stripFlags, l, lrev))
+            # writing one stitched strip if thats smaller. each strip
+            # has a short for its length, each corner a short for the
+            # index, plus two shorts for the uv. there are no triangle
+            # lists in strip chunks
+            cornerSize = 6 if stripUVs else 2
+            encoding, stripIndices = strippifier.CheapestEncoding(
+                stripIndices,
+                lambda s: strippifier.stripsSize(s, cornerSize, 2, True))
+            if DO and encoding != "STRIPS":
+                print("  ", mesh.name, "material", mID, "written",
+                      encoding.lower())
+            common.countVertexCache(stripIndices)
+
+            polyStrips = [None] * len(stripIndices)
+            polyStripsRev = [True] * len(stripIndices)
+
+            for i, strip in enumerate(stripIndices):
+                if strip[0] == strip[1]:
+                    polyStripsRev[i] = False
+                    strip = strip[1:]
+                polyStrips[i] = [distinctPolys[index] for index in strip]
+
+            polyChunks.append(PolyChunk_Strip(stripUVs,
+                                              stripFlags,
+                                              polyStrips,
+                                              polyStripsRev))
 
         return polyChunks
 
@@ -782,6 +841,14 @@ class Attach:
     def fromMesh(cls, mesh: bpy.types.Mesh,
                  export_matrix: mathutils.Matrix,
                  materials: List[bpy.types.Material]):
+        return common.convertAttaches(
+            [cls.convert(mesh, export_matrix, materials)])[0]
+
+    @classmethod
+    def convert(cls, mesh: bpy.types.Mesh,
+                export_matrix: mathutils.Matrix,
+                materials: List[bpy.types.Material]):
+        """Conversion generator for common.convertAttaches"""
 
         vertexType = mesh.saSettings.sa2ExportType
         if vertexType == 'VC' and len(mesh.vertex_colors) == 0:
@@ -791,73 +858,67 @@ class Attach:
         writeUVs = len(mesh.uv_layers) > 0
 
         vertices: List[Vertex] = list()
-        polyVerts: List[PolyVert] = list()
 
-        # getting normals
-        normals = common.getNormalData(mesh)
+        snapshot = common.MeshSnapshot.get(mesh, export_matrix)
+        exportStats.count(len(snapshot.positions),
+                          len(snapshot.polyLoopStart))
+        positions = snapshot.positions.tolist()
+        loopUVs = polyUVs(snapshot)
 
         if vertexType == 'VC':
-            verts: List[List[Vertex]] = [[] for v in mesh.vertices]
-
-            # generating the vertices with their colors
-            for l in mesh.loops:
-                vert = mesh.vertices[l.vertex_index]
-                col = ColorARGB(mesh.vertex_colors[0].data[l.index].color)
-
-                # only create the vertex if there isnt
-                # one with the same color already
-                foundV: Vertex = None
-                for v in verts[l.vertex_index]:
-                    if v.col == col:
-                        foundV = v
-                        break
-
-                if foundV is None:
-                    foundV = Vertex(
-                        l.vertex_index,
-                        0,
-                        Vector3(export_matrix @ vert.co),
+            # only one vertex gets created for each position and color
+            vertexKeys = common.zipKeys(snapshot.loopVertices,
+                                        snapshot.colorValues())
+            (firsts, vertexIDs), = yield [("DISTINCT", vertexKeys, None)]
+
+            # generating the vertices with their colors, ordered by
+            # their position
+            distinctVerts = [vertexKeys[i] for i in firsts]
+            order = sorted(range(len(distinctVerts)),
+                           key=lambda d: distinctVerts[d][0])
+            indices = [0] * len(order)
+            for i, d in enumerate(order):
+                vIndex, color = distinctVerts[d]
+                vertices.append(
+                    Vertex(
+                        vIndex,
+                        i,
+                        Vector3(positions[vIndex]),
                         Vector3(),
-                        col,
-                        0)
-                    verts[l.vertex_index].append(foundV)
-
-                uv = UV(mesh.uv_layers[0].data[l.index].uv) \
-                    if writeUVs else UV()
-                polyVerts.append(PolyVert(foundV, uv))
-
-            # correcting indices
-            i = 0
-            for v in verts:
-                for vt in v:
-                    vt.index = i
-                    vertices.append(vt)
-                    i += 1
+                        ColorARGB.fromARGB(color),
+                        0))
+                indices[d] = i + extraOffset
 
-            for p in polyVerts:
-                p.index = p.index.index + extraOffset
+            polyKeys = common.zipKeys(
+                numpy.asarray(indices, dtype=numpy.int64)[vertexIDs],
+                loopUVs)
 
         else:  # normals are a lot simpler to generate (luckily)
-            for v in mesh.vertices:
+            normals = snapshot.normals.tolist()
+            for i, pos in enumerate(positions):
                 vertices.append(
                     Vertex(
-                        v.index,
-                        v.index,
-                        Vector3(export_matrix @ v.co),
-                        Vector3(export_matrix @ normals[v.index]),
+                        i,
+                        i,
+                        Vector3(pos),
+                        Vector3(normals[i]),
                         None,
                         0))
 
-            for p in mesh.polygons:
-                for l in p.loop_indices:
-                    loop = mesh.loops[l]
-                    uv = UV(mesh.uv_layers[0].data[l].uv) if writeUVs else UV()
-                    polyVert = PolyVert(loop.vertex_index + extraOffset, uv)
-                    polyVerts.append(polyVert)
+            loops, _ = snapshot.loopOrder()
+            polyKeys = common.zipKeys(
+                snapshot.loopVertices[loops] + extraOffset, loopUVs[loops])
 
         # if DO:
         # print("degTris: " + degTris)
 
+        # the polygons index the vertices with shorts
+        if extraOffset + len(vertices) - 1 > maxVertexIndex:
+            raise common.ExportError(
+                "Mesh " + mesh.name + " has too many vertices for the chunk"
+                " format (" + str(len(vertices)) + ", index offset "
+                + str(extraOffset) + "); the limit is 65536")
+
         # creating the vertex chunk
         chunkType = enums.ChunkType.Vertex_VertexDiffuse8 \
             if vertexType == 'VC' else enums.ChunkType.Vertex_VertexNormal
@@ -869,10 +930,9 @@ class Attach:
                 extraOffset,
                 vertices)]
 
-        polyChunks = Attach.getPolygons(mesh, writeUVs, polyVerts, materials)
+        polyChunks = yield from Attach.getPolygons(snapshot, writeUVs, polyKeys, materials)
 
-        bounds = BoundingBox(mesh.vertices)
-        bounds.adjust(export_matrix)
+        bounds = BoundingBox(snapshot.positions)
 
         return Attach(mesh.name, vertexChunks, polyChunks, bounds)
 
@@ -959,44 +1019,61 @@ class Attach:
 
                 tmpAddr += 8
 
+                hasColor = \
+                    chunkType == enums.ChunkType.Vertex_VertexDiffuse8 \
+                    or chunkType == enums.ChunkType.Vertex_VertexNormalDiffuse8
+                hasNormal = \
+                    chunkType == enums.ChunkType.Vertex_VertexNormal \
+                    or chunkType == \
+                    enums.ChunkType.Vertex_VertexNormalNinjaFlags \
+                    or chunkType == enums.ChunkType.Vertex_VertexNormalDiffuse8
+                hasFlags = chunkType == \
+                    enums.ChunkType.Vertex_VertexNormalNinjaFlags
+
+                # the vertex data is interleaved, so each
+                # attribute gets read as a strided array
+                stride = 12
+                colAddr = tmpAddr + stride
+                if hasColor:
+                    stride += 4
+                nrmAddr = tmpAddr + stride
+                if hasNormal:
+                    stride += 12
+                flagsAddr = tmpAddr + stride
+                if hasFlags:
+                    stride += 4
+
+                # the position is part of every vertex
+                positions = fileR.rVector3s(tmpAddr, vertexCount, stride)
+                if hasColor:
+                    colors = fileR.rStrided("I", colAddr, vertexCount, stride)
+                if hasNormal:
+                    normals = fileR.rVector3s(nrmAddr, vertexCount, stride)
+                if hasFlags:
+                    flags = fileR.rStrided("I", flagsAddr, vertexCount, stride)
+
+                tmpAddr += stride * vertexCount
+
                 for i in range(vertexCount):
-                    # getting the position (part of every vertex)
-                    posX = fileR.rFloat(tmpAddr)
-                    posY = fileR.rFloat(tmpAddr + 4)
-                    posZ = fileR.rFloat(tmpAddr + 8)
+                    posX, posY, posZ = positions[i]
                     pos = Vector3((posX, -posZ, posY))
-                    tmpAddr += 12
 
                     col = None
-
-                    # getting color
-                    if chunkType == enums.ChunkType.Vertex_VertexDiffuse8 \
-                        or chunkType == \
-                            enums.ChunkType.Vertex_VertexNormalDiffuse8:
-                        col = ColorARGB.fromARGB(fileR.rUInt(tmpAddr))
-                        tmpAddr += 4
+                    if hasColor:
+                        col = ColorARGB.fromARGB(colors[i][0])
 
                     weight = 0
                     index = i
                     nrm = None
 
-                    if chunkType == enums.ChunkType.Vertex_VertexNormal \
-                            or chunkType == \
-                            enums.ChunkType.Vertex_VertexNormalNinjaFlags \
-                            or chunkType == \
-                            enums.ChunkType.Vertex_VertexNormalDiffuse8:
-                        nrmX = fileR.rFloat(tmpAddr)
-                        nrmY = fileR.rFloat(tmpAddr + 4)
-                        nrmZ = fileR.rFloat(tmpAddr + 8)
+                    if hasNormal:
+                        nrmX, nrmY, nrmZ = normals[i]
                         nrm = Vector3((nrmX, -nrmZ, nrmY))
-                        tmpAddr += 12
 
-                        if chunkType == \
-                                enums.ChunkType.Vertex_VertexNormalNinjaFlags:
-                            ninjaFlags = fileR.rUInt(tmpAddr)
+                        if hasFlags:
+                            ninjaFlags = flags[i][0]
                             weight = ((ninjaFlags >> 16) & 0xFF) / 255.0
                             index = ninjaFlags & 0xFFFF
-                            tmpAddr += 4
 
                     vertices.append(
                         Vertex(
@@ -1071,6 +1148,142 @@ class Attach:
 # stuff for weighted exporting and importing
 
 
+def weightMatrix(mesh: bpy.types.Mesh, groups: List[int]):
+    """Returns the weights of the vertices in the vertex groups as a
+    (vertex count, group count) array, and which vertices are in any
+    of the groups at all (even with a weight of 0)"""
+    columns = {g: i for i, g in enumerate(groups)}
+    rows = list()
+    cols = list()
+    values = list()
+    for v in mesh.vertices:
+        for g in v.groups:
+            c = columns.get(g.group)
+            if c is not None:
+                rows.append(v.index)
+                cols.append(c)
+                values.append(g.weight)
+
+    weights = numpy.zeros((len(mesh.vertices), len(groups)))
+    weights[rows, cols] = values
+    assigned = numpy.zeros(len(mesh.vertices), dtype=bool)
+    assigned[rows] = True
+    return weights, assigned
+
+
+def normalizeWeights(weights: numpy.ndarray):
+    """Scales the weights of each vertex so that they add up to 1"""
+    weightsAdded = weights.sum(axis=1, keepdims=True)
+    numpy.divide(weights, weightsAdded, out=weights, where=weightsAdded > 0)
+
+
+def limitWeights(weights: numpy.ndarray):
+    """Drops the weights that minWeight and maxInfluences dont allow
+    and normalizes the remaining ones again"""
+    if minWeight > 0:
+        biggest = weights.max(axis=1, keepdims=True)
+        weights[(weights < minWeight) & (weights < biggest)] = 0
+    if 0 < maxInfluences < weights.shape[1]:
+        order = numpy.argsort(-weights, axis=1, kind="stable")
+        rows = numpy.arange(len(weights))[:, None]
+        weights[rows, order[:, maxInfluences:]] = 0
+    normalizeWeights(weights)
+
+
+def weightPasses(statuses: List[enums.WeightStatus],
+                 weights: numpy.ndarray,
+                 assigned: numpy.ndarray,
+                 unweighted: int,
+                 compact: bool) -> list:
+    """Returns the vertex chunks that each bone (weight column) writes,
+    as (column, [(status, vertex indices, weights), ...]), in bone order.
+
+    unweighted is the column of bone -2, which takes the vertices
+    without weights, or None.
+
+    Normally the first bone writes every vertex, which resets them,
+    and the other bones add the vertices that they weigh. Every bone
+    writes a chunk, even if it is empty, and the last one ends the
+    mesh. With compact, each vertex gets reset by the first bone that
+    weighs it instead, so that no vertex is written with a weight of 0,
+    and bones without any vertices to write are left out"""
+    weights = weights.copy()
+    if compact:
+        # vertices with only weights of 0 count as unweighted
+        assigned = (weights > 0).any(axis=1)
+    if unweighted is not None:
+        weights[:, unweighted] = ~assigned
+    written = weights > 0
+    first = written.argmax(axis=1)
+    allVerts = numpy.arange(len(weights))
+
+    if not compact:
+        passes = list()
+        for column, status in enumerate(statuses):
+            if status == enums.WeightStatus.Start:
+                include = numpy.ones(len(weights), dtype=bool)
+            else:
+                include = written[:, column]
+            passes.append((column, [(status,
+                                     allVerts[include],
+                                     weights[include, column])]))
+        return passes
+
+    passes = list()
+    for column in range(len(statuses)):
+        include = written[:, column]
+        start = include & (first == column)
+        chunks = [(enums.WeightStatus.Start, start),
+                  (enums.WeightStatus.Middle, include & ~start)]
+        chunks = [(s, allVerts[i], weights[i, column])
+                  for s, i in chunks if i.any()]
+        if len(chunks) > 0:
+            passes.append((column, chunks))
+
+    # the mesh has to end with an end chunk. If the last bone only
+    # resets vertices, its last vertex gets reset with a weight of 0
+    # and then added again in an end chunk of its own
+    column, chunks = passes[-1]
+    status, indices, weight = chunks[-1]
+    if status == enums.WeightStatus.Middle:
+        chunks[-1] = (enums.WeightStatus.End, indices, weight)
+    else:
+        resetWeight = weight.copy()
+        resetWeight[-1] = 0
+        chunks[-1] = (status, indices, resetWeight)
+        chunks.append((enums.WeightStatus.End, indices[-1:], weight[-1:]))
+    return passes
+
+
+def printWeightStats():
+    """Prints how many vertex chunks and vertex writes the weight
+    settings saved"""
+    chunks, writes, plainChunks, plainWrites = weightStats
+    if plainChunks > 0:
+        print(" Bone weights: {} -> {} vertex chunks, {} -> {} vertex writes"
+              .format(plainChunks, chunks, plainWrites, writes))
+
+
+def boneVertices(indices: numpy.ndarray,
+                 co: numpy.ndarray,
+                 normals: numpy.ndarray,
+                 matrix: mathutils.Matrix,
+                 weights: numpy.ndarray) -> List[Vertex]:
+    """Transforms the vertices at the indices into the space of a bone
+    and returns them with their weights"""
+    positions = common.transformPoints(co[indices], matrix)
+    boneNormals = common.transformPoints(normals[indices], matrix.to_3x3())
+    lengths = numpy.linalg.norm(boneNormals, axis=1, keepdims=True)
+    numpy.divide(boneNormals, lengths, out=boneNormals, where=lengths > 0)
+
+    return [Vertex(i, i, Vector3(p), Vector3(n), None, w)
+            for i, p, n, w in zip(indices.tolist(),
+                                  positions.tolist(),
+                                  boneNormals.tolist(),
+                                  weights.tolist())]
+
+
+@exportStats.timed("format_CHUNK.fromWeightData")
 def fromWeightData(boneMap: Dict[str, mathutils.Matrix],
                    meshData: List[common.ArmatureMesh],
                    export_matrix: mathutils.Matrix,
@@ -1084,115 +1297,93 @@ def fromWeightData(boneMap: Dict[str, mathutils.Matrix],
         boneVertChunks[b] = list()
         bonePolyChunks[b] = list()
 
-    for m in meshData:
-        # data for every bone that has weights in this mesh
-        boneData: Dict[
-            int,
-            Tuple[
-                enums.WeightStatus,
-                mathutils.Matrix,
-                List[Vertex],
-                enums.ChunkType]
-            ] = dict()
-
-        for b in m.weightMap.keys():
-            index, status = m.weightMap[b]
-            boneData[index] = (
-                status,
-                export_matrix @ (
-                    boneMap[b].inverted()
-                    @ m.model.origObject.matrix_world),
-                list(),
-                enums.ChunkType.Vertex_VertexNormalNinjaFlags)
+    polyConversions = list()
+    meshBoneChunks = list()
+    limit = minWeight > 0 or maxInfluences > 0
 
+    for m in meshData:
         mesh = m.model.processedMesh
-        normals = common.getNormalData(mesh)
+        co = numpy.empty(len(mesh.vertices) * 3, dtype=numpy.float32)
+        mesh.vertices.foreach_get("co", co)
+        co = co.reshape(-1, 3)
+        normals = common.getNormalArray(mesh)
+        allVerts = numpy.arange(len(mesh.vertices))
+
+        bones = list(m.weightMap.keys())
+        groups = [m.weightMap[b][0] for b in bones]
+        statuses = [m.weightMap[b][1] for b in bones]
 
         # if the only bone is index -1, then
         # just write the entire mesh to the bone
-        if list(boneData.keys())[0] == -1:
-            status, matrix, vList, _ = boneData[-1]
-            for v in mesh.vertices:
-                vList.append(
-                    Vertex(
-                        v.index,
-                        v.index,
-                        Vector3(matrix @ v.co),
-                        Vector3(
-                            (matrix.to_3x3()
-                             @ normals[v.index]).normalized()),
-                        None, 1))
-            boneData[-1] = (
-                status,
-                matrix,
-                vList,
-                enums.ChunkType.Vertex_VertexNormal)
+        if groups[0] == -1:
+            passes = [(0, [(enums.WeightStatus.Start,
+                            allVerts,
+                            numpy.ones(len(allVerts)))])]
 
         else:
-            for v in mesh.vertices:
-                # get all used weights and the average weight, for proper normalizing
-                cWeight: Dict[int, float] = dict()
-                weightsAdded = 0
-                for g in v.groups:
-                    if g.group in boneData:
-                        weightsAdded += g.weight
-                        cWeight[g.group] = g.weight
-
-                # if there are no used weights, then attach it to index -2
-                if len(cWeight) == 0:
-                    status, matrix, vList, _ = boneData[-2]
-                    vList.append(
-                        Vertex(
-                            v.index,
-                            v.index,
-                            Vector3(matrix @ v.co),
-                            Vector3(
-                                (matrix.to_3x3() @ normals[v.index])
-                                .normalized()),
-                            None,
-                            1
-                        )
-                    )
-                else:
-                    for b in boneData.keys():
-                        if b not in cWeight:
-                            cWeight[b] = 0
-                    for k, weight in cWeight.items():
-                        if weightsAdded > 0:
-                            weight = weight / weightsAdded
-                        status, matrix, vList, _ = boneData[k]
-
-                        if status == enums.WeightStatus.Start or weight > 0:
-                            vList.append(
-                                Vertex(
-                                    v.index,
-                                    v.index,
-                                    Vector3(matrix @ v.co),
-                                    Vector3((
-                                        matrix.to_3x3()
-                                        @ normals[v.index]).normalized()),
-                                    None, weight))
+            weights, assigned = weightMatrix(mesh, groups)
+            normalizeWeights(weights)
+            unweighted = groups.index(-2) if -2 in groups else None
+
+            if limit or compactWeights:
+                limited = weights.copy()
+                if limit:
+                    limitWeights(limited)
+                passes = weightPasses(statuses, limited, assigned,
+                                      unweighted, compactWeights)
+                if passes[-1][1][-1][0] != enums.WeightStatus.End:
+                    raise common.ExportError(
+                        m.model.name + ": weights dont end with an end chunk")
+                plain = weightPasses(statuses, weights, assigned,
+                                     unweighted, False)
+                for i, p in enumerate((passes, plain)):
+                    chunks = [c for _, chunks in p for c in chunks]
+                    weightStats[i * 2] += len(chunks)
+                    weightStats[i * 2 + 1] += sum(len(c[1]) for c in chunks)
+            else:
+                passes = weightPasses(statuses, weights, assigned,
+                                      unweighted, False)
+
+        if groups[0] == -1:
+            chunkType = enums.ChunkType.Vertex_VertexNormal
+        else:
+            chunkType = enums.ChunkType.Vertex_VertexNormalNinjaFlags
+
+        boneChunks = list()
+        for column, chunks in passes:
+            b = bones[column]
+            matrix = export_matrix @ (
+                boneMap[b].inverted() @ m.model.origObject.matrix_world)
+            for status, indices, weight in chunks:
+                boneChunks.append((
+                    b,
+                    status,
+                    chunkType,
+                    boneVertices(indices, co, normals, matrix, weight)))
+
         # getting polygon data
 
-        writeUVs = len(mesh.uv_layers) > 0
-        polyVerts: List[PolyVert] = list()
-        for l in mesh.loops:
-            uv = UV(mesh.uv_layers[0].data[l.index].uv) if writeUVs else UV()
-            polyVert = PolyVert(l.vertex_index + m.indexBufferOffset, uv)
-            polyVerts.append(polyVert)
-
-        polyChunks = Attach.getPolygons(mesh, writeUVs, polyVerts, materials)
-
-        assignedPolys = False
-        for b, t in m.weightMap.items():
-            index, status = t
-            _, matrix, vList, chunkType = boneData[index]
+        snapshot = common.MeshSnapshot.get(mesh, export_matrix)
+        exportStats.count(len(snapshot.positions),
+                          len(snapshot.polyLoopStart))
+        writeUVs = snapshot.loopUVs is not None
+        polyKeys = common.zipKeys(
+            snapshot.loopVertices + m.indexBufferOffset, polyUVs(snapshot))
+
+        polyConversions.append(
+            Attach.getPolygons(snapshot, writeUVs, polyKeys, materials))
+        meshBoneChunks.append(boneChunks)
+
+    # strippifying the polygons of all meshes together
+    meshPolyChunks = common.convertAttaches(polyConversions)
+
+    for m, boneChunks, polyChunks in zip(meshData, meshBoneChunks, meshPolyChunks):
+        for b, status, chunkType, vList in boneChunks:
             vChunk = VertexChunk(chunkType, status, False, m.indexBufferOffset, vList)
             boneVertChunks[b].append(vChunk)
 
-            if len(m.weightMap) == 1 or status == enums.WeightStatus.End:
-                bonePolyChunks[b].extend(polyChunks)
-                assignedPolys = True
+        # the last bone draws the polygons, once all vertices are set
+        bonePolyChunks[boneChunks[-1][0]].extend(polyChunks)
 
     boneAttaches: Dict[str, Attach] = dict()
 
@@ -1202,15 +1393,8 @@ def fromWeightData(boneMap: Dict[str, mathutils.Matrix],
 
         if len(vChunks) > 0:
 
-            bounds = BoundingBox(None)
-            # if len(pChunks) > 0:
-            vertices = list()
-            for vc in vChunks:
-                for v in vc.vertices:
-                    vert = Container()
-                    vert.co = v.pos
-                    vertices.append(vert)
-            bounds = BoundingBox(vertices)
+            bounds = BoundingBox(numpy.array(
+                [tuple(v.pos) for vc in vChunks for v in vc.vertices]))
 
             boneAttaches[b] = Attach("atc_" + b, vChunks, pChunks, bounds)
 
@@ -1,14 +1,19 @@
 import bpy
 import math
 import mathutils
+import numpy
 from typing import List, Dict, Tuple
 import copy
 
-from . import fileHelper, enums, strippifier, common
+from . import fileHelper, enums, strippifier, common, exportStats
 from .common import Vector3, ColorARGB, UV, BoundingBox
 from .__init__ import SAMaterialSettings
 
 DO = False
+poolPrecision = None  # decimal places to round positions and normals to when pooling
+# per attribute: values before and after pooling, and the amount of
+# pools and of those that need 16 bit indices
+poolStats: Dict[str, List[int]] = dict()
 
 
 def debug(*string):
@@ -16,6 +21,65 @@ def debug(*string):
     if DO:
         print(*string)
 
+
+# how the pooled values get created from their keys
+# (see common.MeshSnapshot)
+poolTypes = {
+    "position": Vector3,
+    "normal": Vector3,
+    "color": ColorARGB.fromARGB,
+    "uv": UV.fromKey,
+}
+# how each pool gets written as a vertex array
+poolFormats = {
+    "position": (enums.VertexAttribute.Position, 12, enums.ComponentCount.Position_XYZ, enums.DataType.Float32),
+    "normal": (enums.VertexAttribute.Normal, 12, enums.ComponentCount.Normal_XYZ, enums.DataType.Float32),
+    "color": (enums.VertexAttribute.Color0, 4, enums.ComponentCount.Color_RGBA, enums.DataType.RGBA8),
+    "uv": (enums.VertexAttribute.Tex0, 4, enums.ComponentCount.TexCoord_ST, enums.DataType.Signed16),
+}
+
+
+def poolJobs(keys: Dict[str, list]) -> List[tuple]:
+    """Returns the jobs that pool the attribute values (positions,
+    normals, colors or uvs) by their keys.
+
+    Each results in the position of every distinct value, which get
+    written as the vertex array, and the ID of the pooled value for
+    each input value. Positions and normals get rounded to
+    poolPrecision for the comparison
+    """
+    precision = {"position": poolPrecision, "normal": poolPrecision}
+    return [("DISTINCT", k, precision.get(attr))
+            for attr, k in keys.items()]
+
+
+def reportPools(name: str, pools: Dict[str, Tuple[list, List[int]]]):
+    """Records the size of each attribute pool (the distinct values
+    and the IDs of the pool jobs) for printPoolStats, and
+    whether the pool can be indexed with 8 bit indices"""
+    for attr, (data, IDs) in pools.items():
+        wide = len(data) > 0x100
+        debug(" " + name, attr, "pool:", len(data),
+              "(16 bit)" if wide else "(8 bit)")
+
+        stats = poolStats.setdefault(attr, [0, 0, 0, 0])
+        stats[0] += len(IDs)
+        stats[1] += len(data)
+        stats[2] += 1
+        stats[3] += wide
+
+
+def printPoolStats():
+    """Prints how many values pooling saved per attribute, and how many
+    of the pools need 16 bit indices"""
+    if len(poolStats) == 0:
+        return
+    print(" Vertex pools: " + ", ".join(
+        "{} {} -> {} ({} of {} 16 bit)".format(attr, stats[0], stats[1],
+                                               stats[3], stats[2])
+        for attr, stats in poolStats.items()))
+
+
 # == Geometry parameters ==
 
 
@@ -351,10 +415,40 @@ class PolyVert:
     def __eq__(self, other):
         return self.posID == other.posID and self.nrmID == other.nrmID and self.vcID == other.vcID and self.uvID == other.uvID
 
+    def __hash__(self):
+        return hash(self.distinctKey())
+
+    def distinctKey(self, precision: int = None):
+        return (self.posID, self.nrmID, self.vcID, self.uvID)
+
     def __str__(self):
         return "(" + str(self.posID).zfill(3) + ", " + str(self.nrmID).zfill(3) + ", " + str(self.vcID).zfill(3) + ", " + str(self.uvID).zfill(3) + ")"
 
 
+def cornerSize(polys: List[PolyVert],
+               writeNRM: bool, writeVC: bool, writeUV: bool) -> int:
+    """Returns the size of a corner in the polygon data in bytes. Each
+    index is a byte, or a short if any of the polys needs a bigger one"""
+    size = 2 if any(p.posID > 0xFF for p in polys) else 1
+    if writeNRM:
+        size += 2 if any(p.nrmID > 0xFF for p in polys) else 1
+    if writeVC:
+        size += 2 if any(p.vcID > 0xFF for p in polys) else 1
+    if writeUV:
+        size += 2 if any(p.uvID > 0xFF for p in polys) else 1
+    return size
+
+
+def polygonsSize(polygons: List[list], cornerSize: int) -> int:
+    """Returns the size of polygon data in bytes, as written by
+    Geometry.writePolygons: strips of 3 corners are merged into a
+    single triangle list. Each primitive has a 3 byte header"""
+    strips = [l for l in polygons if len(l) != 3]
+    triangles = len(polygons) - len(strips)
+    return strippifier.stripsSize(strips, cornerSize, 3) \
+        + strippifier.triangleListSize(triangles, cornerSize, 3)
+
+
 class Geometry:
     """Holds a single polygon data set"""
 
@@ -586,6 +680,8 @@ class Vertices:
         if self.vType == enums.VertexAttribute.Color0 or self.vType == enums.VertexAttribute.Color1:
             for e in self.data:
                 e.writeRGBA(fileW)
+        elif self.vType == enums.VertexAttribute.Position or self.vType == enums.VertexAttribute.Normal:
+            fileW.wVector3s(self.data)
         else:
             for e in self.data:
                 e.write(fileW)
@@ -695,6 +791,14 @@ class Attach:
     def fromMesh(cls, mesh: bpy.types.Mesh,
                  export_matrix: mathutils.Matrix,
                  materials: List[bpy.types.Material]):
+        return common.convertAttaches(
+            [cls.convert(mesh, export_matrix, materials)])[0]
+
+    @classmethod
+    def convert(cls, mesh: bpy.types.Mesh,
+                export_matrix: mathutils.Matrix,
+                materials: List[bpy.types.Material]):
+        """Conversion generator for common.convertAttaches"""
 
         # determining which data should be written
         vertexType = mesh.saSettings.sa2ExportType
@@ -707,129 +811,97 @@ class Attach:
         # aquiring the vertex data
         vertices: List[Vertices] = list()
 
-        # position data is always required
-        posData = list()
-
-        posIDs = [0] * len(mesh.vertices)
-        for i, v in enumerate(mesh.vertices):
-            found = None
-            pos = Vector3(export_matrix @ v.co)
-            for j, p in enumerate(posData):
-                if p == pos:
-                    found = j
-                    break
-            if found is None:
-                posData.append(pos)
-                posIDs[i] = len(posData) - 1
-            else:
-                posIDs[i] = found
-        vertices.append( Vertices(enums.VertexAttribute.Position, 12, enums.ComponentCount.Position_XYZ, enums.DataType.Float32, posData))
+        snapshot = common.MeshSnapshot.get(mesh, export_matrix)
+        exportStats.count(len(snapshot.positions),
+                          len(snapshot.polyLoopStart))
 
-        # getting normal data
+        # pooling the vertex data. position data is always required
+        keys = {"position": snapshot.positionKeys()}
         if writeNRM:
-            nrmData = list()
-            nrmIDs = [0] * len(mesh.vertices)
-            normals = common.getNormalData(mesh)
-            for i, v in enumerate(mesh.vertices):
-                found = None
-                nrm = Vector3(export_matrix @ normals[i])
-                for j, n in enumerate(nrmData):
-                    if n == nrm:
-                        found = j
-                        break
-                if found is None:
-                    nrmData.append(nrm)
-                    nrmIDs[i] = len(nrmData) - 1
-                else:
-                    nrmIDs[i] = found
-            vertices.append( Vertices(enums.VertexAttribute.Normal, 12, enums.ComponentCount.Normal_XYZ, enums.DataType.Float32, nrmData))
-
-        # getting vertex color data
+            keys["normal"] = snapshot.normalKeys()
         if writeVC:
-            vcData = list()
-            vcIDs = [0] * len(mesh.vertex_colors[0].data)
-            for i, vc in enumerate(mesh.vertex_colors[0].data):
-                found = None
-                col = ColorARGB(vc.color)
-                for j, c in enumerate(vcData):
-                    if col == c:
-                        found = j
-                        break
-                if found is None:
-                    vcData.append(col)
-                    vcIDs[i] = len(vcData) - 1
-                else:
-                    vcIDs[i] = found
-            vertices.append( Vertices(enums.VertexAttribute.Color0, 4, enums.ComponentCount.Color_RGBA, enums.DataType.RGBA8, vcData))
-
-        # getting uv data
+            keys["color"] = snapshot.colorValues().tolist()
         if writeUV:
-            uvData = list()
-            uvIDs = [0] * len(mesh.uv_layers[0].data)
-            for i, uv in enumerate(mesh.uv_layers[0].data):
-                found = None
-                newUV = UV(uv.uv)
-                for j, uvD in enumerate(uvData):
-                    if newUV == uvD:
-                        found = j
-                        break
-                if found is None:
-                    uvData.append(newUV)
-                    uvIDs[i] = len(uvData) - 1
-                else:
-                    uvIDs[i] = found
-            vertices.append( Vertices(enums.VertexAttribute.Tex0, 4, enums.ComponentCount.TexCoord_ST, enums.DataType.Signed16, uvData))
+            keys["uv"] = list(map(tuple, snapshot.uvValues().tolist()))
 
-        # assembling polygons
+        pools = dict()
+        poolResults = yield poolJobs(keys)
+        for (attr, k), (firsts, IDs) in zip(keys.items(), poolResults):
+            pools[attr] = ([poolTypes[attr](k[i]) for i in firsts], IDs)
 
-        # preparing polygon lists
-        tris: List[List[PolyVert]] = [[] for n in range(len(mesh.materials))]
-        if len(tris) == 0:
-            tris.append([])
-
-        degTris = 0
-        for p in mesh.polygons:
-            triMat = tris[p.material_index]
-            for l in p.loop_indices:
-                loop = mesh.loops[l]
-
-                posID = posIDs[loop.vertex_index]
-                nrmID = None
-                vcID = None
-                uvID = None
-
-                if writeNRM:
-                    nrmID = nrmIDs[loop.vertex_index]
-                if writeVC:
-                    vcID = vcIDs[l]
-                if writeUV:
-                    uvID = uvIDs[l]
-
-                triMat.append( PolyVert(posID, nrmID, vcID, uvID) )
-
-            # checking for degenerate triangle
-            if triMat[-1].posID == triMat[-2].posID or triMat[-2].posID == triMat[-3].posID or triMat[-1].posID == triMat[-3].posID:
-                tris[p.material_index] = tris[p.material_index][:-3]
-                degTris += 1
+        for attr, (data, IDs) in pools.items():
+            vertices.append( Vertices(*poolFormats[attr], data))
+
+        reportPools(mesh.name, pools)
+
+        # assembling polygons; each corner is a key of its pool IDs
+        # (see PolyVert.distinctKey)
+
+        loops, polygons = snapshot.loopOrder()
+        loopVertices = snapshot.loopVertices[loops]
+
+        def cornerIDs(attr, indices):
+            if attr not in pools:
+                return None
+            return numpy.asarray(pools[attr][1], dtype=numpy.int64)[indices]
 
+        posIDs = cornerIDs("position", loopVertices)
+        columns = (posIDs,
+                   cornerIDs("normal", loopVertices),
+                   cornerIDs("color", loops),
+                   cornerIDs("uv", loops))
+
+        # removing degenerate triangles
+        ends = numpy.cumsum(snapshot.polyLoopTotal)
+        first, second, third = posIDs[ends - 1], posIDs[ends - 2], posIDs[ends - 3]
+        degenerate = (first == second) | (second == third) | (first == third)
+        keep = numpy.ones(len(loops), dtype=bool)
+        keep[(ends[degenerate, None] - numpy.arange(1, 4)).ravel()] = False
+
+        degTris = int(numpy.count_nonzero(degenerate))
         if degTris > 0:
             debug("degTris:", degTris)
 
+        # preparing polygon lists
+        loopMaterials = snapshot.polyMaterials[polygons]
+        tris: List[List[tuple]] = list()
+        for materialIndex in range(max(1, len(mesh.materials))):
+            selected = keep & (loopMaterials == materialIndex)
+            tris.append(common.zipKeys(*(None if c is None else c[selected] for c in columns)))
+
         #strippifying the poly data
 
         strips: List[List[List[PolyVert]]] = list() # material specific -> strip -> polygon
 
+        allStrips = yield [("DISTINCT_STRIP", l, strippifier.stripSwaps, False, mesh.name) for l in tris if len(l) > 0]
+        allStrips = iter(allStrips)
+
         for l in tris:
             if len(l) == 0:
                 strips.append(None)
                 continue
 
-            distinct = list()
-            IDs = [0] * len(l)
+            firsts, _, stripIndices = next(allStrips)
+            distinct = [PolyVert(*l[i]) for i in firsts]
+
+            # writing a stitched strip or a triangle list if thats smaller
+            size = cornerSize(distinct, writeNRM, writeVC, writeUV)
+
+            def sizeOf(polygons):
+                return polygonsSize(polygons, size)
 
-            distinct, IDs = common.getDistinctwID(l)
+            encoding, stripIndices = strippifier.CheapestEncoding(
+                stripIndices, sizeOf, sizeOf)
+            if encoding != "STRIPS":
+                debug(" ", mesh.name, "written", encoding.lower())
 
-            stripIndices = strippifier.Strippify(IDs, doSwaps=False, concat=False, name = mesh.name)
+            if strippifier.optimizeVertexCache:
+                # strips of 3 get written as one triangle list after
+                # the other strips (see Geometry.writePolygons)
+                longStrips = [s for s in stripIndices if len(s) != 3]
+                triangles = [i for s in stripIndices if len(s) == 3 for i in s]
+                triangles, _ = common.optimizeVertexCache(triangles, strips=longStrips)
+                stripIndices = longStrips + [triangles[i:i + 3] for i in range(0, len(triangles), 3)]
 
             polyStrips = [None] * len(stripIndices)
 
@@ -1083,8 +1155,7 @@ class Attach:
                 opaqueGeom.append(geom)
 
         # calculating the bounds
-        bounds = BoundingBox(mesh.vertices)
-        bounds.adjust(export_matrix)
+        bounds = BoundingBox(snapshot.positions)
 
         return Attach(mesh.name, vertices, opaqueGeom, transparentGeom, bounds)
 
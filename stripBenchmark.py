@@ -0,0 +1,367 @@
+# benchmark and regression check for the strippifier backends.
+#
+# can be run with any python 3 interpreter, as it only loads
+# strippifier.py (which doesnt depend on blender):
+#
+#   python stripBenchmark.py [--corpus corpus.json] [--baseline base.json]
+#
+# by default, the results get compared with stripBaseline.json, which
+# holds the strips of the class and array backends for the generated
+# meshes. It has no timings, as those depend on the machine; a baseline
+# with timings can be written with --update --baseline mine.json.
+# It has no dll results either: the strips of the array backend are
+# the same as those of the class, but havent been compared with the
+# dll ones. On windows, --backends class,array,dll --dll IOSA2.dll
+# shows them side by side
+#
+# meshes of real models can be added to a corpus file from within blender,
+# with the addon installed:
+#
+#   blender -b --python stripBenchmark.py -- --models a.sa1mdl b.sa2mdl
+#           --write-corpus corpus.json
+#
+# the exit code is 1 if any backend regressed against the baseline
+
+import argparse
+import contextlib
+import importlib
+import importlib.util
+import io
+import json
+import os
+import random
+import sys
+import time
+from typing import List, Dict
+
+DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(DIR, "stripBaseline.json")
+
+
+def loadStrippifier():
+    """Loads strippifier.py without importing the addon package"""
+    spec = importlib.util.spec_from_file_location(
+        "strippifier", os.path.join(DIR, "strippifier.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# == corpus ==
+
+def grid(width: int, height: int, shuffle=False, holes=0.0, flips=0.0,
+         seed=0) -> List[int]:
+    """A triangulated plane of width x height quads
+
+    shuffle: randomizes the triangle order
+    holes: chance of a quad to be left out
+    flips: chance of a triangle to face the other way"""
+    rnd = random.Random(seed)
+    tris = list()
+    for y in range(height):
+        for x in range(width):
+            if holes > 0 and rnd.random() < holes:
+                continue
+            a = y * (width + 1) + x
+            b = a + 1
+            c = a + width + 1
+            d = c + 1
+            tris.append((a, c, b))
+            tris.append((b, c, d))
+    if flips > 0:
+        tris = [(t[0], t[2], t[1]) if rnd.random() < flips else t
+                for t in tris]
+    if shuffle:
+        rnd.shuffle(tris)
+    return [i for t in tris for i in t]
+
+
+def sphere(rings: int, segments: int) -> List[int]:
+    """A closed uv sphere (with poles), as it would come out of blender"""
+    indices = list()
+    top = 0
+    bottom = 1 + (rings - 1) * segments
+
+    def ringVert(r, s):
+        return 1 + r * segments + (s % segments)
+
+    for s in range(segments):
+        indices.extend((top, ringVert(0, s), ringVert(0, s + 1)))
+        indices.extend((bottom, ringVert(rings - 2, s + 1),
+                        ringVert(rings - 2, s)))
+
+    for r in range(rings - 2):
+        for s in range(segments):
+            a = ringVert(r, s)
+            b = ringVert(r, s + 1)
+            c = ringVert(r + 1, s)
+            d = ringVert(r + 1, s + 1)
+            indices.extend((a, c, b, b, c, d))
+    return indices
+
+
+def soup(count: int, seed=0) -> List[int]:
+    """Loose triangles, none of them connected"""
+    indices = list(range(count * 3))
+    rnd = random.Random(seed)
+    tris = [indices[i:i + 3] for i in range(0, len(indices), 3)]
+    rnd.shuffle(tris)
+    return [i for t in tris for i in t]
+
+
+def syntheticCorpus() -> Dict[str, List[int]]:
+    return {
+        "grid_8x8": grid(8, 8),
+        "grid_32x32": grid(32, 32),
+        "grid_32x32_shuffled": grid(32, 32, shuffle=True, seed=1),
+        "grid_64x64_holes": grid(64, 64, shuffle=True, holes=0.2, seed=2),
+        "grid_32x32_flipped": grid(32, 32, shuffle=True, flips=0.1, seed=5),
+        "grid_224x224_shuffled": grid(224, 224, shuffle=True, seed=3),
+        "sphere_16x32": sphere(16, 32),
+        "sphere_64x128": sphere(64, 128),
+        "soup_1000": soup(1000, seed=4),
+    }
+
+
+def extractCorpus(modelPaths: List[str]) -> Dict[str, List[int]]:
+    """Imports models with the addon and returns the triangulated index
+    lists of all imported meshes. Only works inside blender"""
+    import bpy
+    import bmesh
+
+    addon = os.path.basename(DIR)
+    file_MDL = importlib.import_module(addon + ".file_MDL")
+
+    corpus = dict()
+    for path in modelPaths:
+        bpy.ops.wm.read_homefile(use_empty=True)
+        file_MDL.read(bpy.context, path, True, False)
+
+        for obj in bpy.context.scene.objects:
+            if obj.type != 'MESH':
+                continue
+            bm = bmesh.new()
+            bm.from_mesh(obj.data)
+            bmesh.ops.triangulate(bm, faces=bm.faces)
+            indices = [v.index for f in bm.faces for v in f.verts]
+            bm.free()
+            if len(indices) > 0:
+                corpus[os.path.basename(path) + "/" + obj.name] = indices
+
+    return corpus
+
+
+# == measuring ==
+
+def getBackends(strippifier, dllPath: str = None) -> dict:
+
+    def classBackend(indexList):
+        # the class prints debug info, which would clutter the table
+        with contextlib.redirect_stdout(io.StringIO()):
+            return strippifier.Strippifier().Strippify(indexList)
+
+    def swapsBackend(indexList):
+        return strippifier.StrippifySwaps(indexList)[0]
+
+    backends = {
+        "class": classBackend,
+        "array": lambda l: strippifier.ArrayStrippifier().Strippify(l),
+        "swaps": swapsBackend,
+    }
+
+    if dllPath is not None:
+        import ctypes
+        dll = ctypes.cdll.LoadLibrary(dllPath)
+        backends["dll"] = lambda l: strippifier.StrippifyDLL(dll, l)
+
+    return backends
+
+
+def measure(strippifier, backend, indexList: List[int], repeats: int,
+            minTime: float) -> dict:
+    """Strippifies the index list and returns the strip statistics.
+    valid is whether the strips draw the triangles of the index list.
+
+    The fastest of at least repeats runs counts. Small meshes get run
+    until minTime seconds have passed, so that their timing isnt
+    down to a few noisy runs"""
+    triCount = len(indexList) // 3
+
+    best = None
+    runs = 0
+    total = 0
+    while runs < repeats or total < minTime:
+        start = time.perf_counter()
+        strips = backend(list(indexList))
+        duration = time.perf_counter() - start
+        if best is None or duration < best:
+            best = duration
+        runs += 1
+        total += duration
+
+    indexCount = 0
+    degenerates = 0
+    for s in strips:
+        indexCount += len(s)
+        for i in range(len(s) - 2):
+            if s[i] == s[i + 1] or s[i + 1] == s[i + 2] or s[i] == s[i + 2]:
+                degenerates += 1
+
+    return {
+        "strips": len(strips),
+        "stripsPerTri": round(len(strips) / triCount, 4),
+        "indices": indexCount,
+        "degenerates": degenerates,
+        "valid": strippifier.stripsEquivalent(indexList, strips),
+        "ms": round(best * 1000, 3),
+        "msPer1kTris": round(best * 1000 / (triCount / 1000), 3),
+    }
+
+
+def findRegressions(results: dict, baseline: dict, timeTolerance: float,
+                    timeFloor: float) -> List[str]:
+    """Compares the results with a baseline and returns the regressions.
+
+    Timings are only compared if the baseline has them, and only for
+    meshes that took at least timeFloor milliseconds in the baseline,
+    as anything faster is mostly noise"""
+    regressions = list()
+    for mesh, backends in results.items():
+        for name, res in backends.items():
+            base = baseline.get(mesh, dict()).get(name)
+            if base is None:
+                continue
+            if "error" in res:
+                regressions.append(f"{mesh} [{name}]: {res['error']}")
+                continue
+            if "error" in base:
+                continue
+            if not res["valid"]:
+                regressions.append(f"{mesh} [{name}]: wrong triangles")
+            for key in ("strips", "indices", "degenerates"):
+                if res[key] > base[key]:
+                    regressions.append(f"{mesh} [{name}]: {key} "
+                                       f"{base[key]} -> {res[key]}")
+            if timeTolerance > 0 and base.get("ms", 0) >= timeFloor \
+                    and res["msPer1kTris"] > base["msPer1kTris"] * timeTolerance:
+                regressions.append(f"{mesh} [{name}]: msPer1kTris "
+                                   f"{base['msPer1kTris']} -> {res['msPer1kTris']}")
+    return regressions
+
+
+def run(strippifier, corpus: Dict[str, List[int]], backends: dict,
+        repeats: int, minTime: float) -> dict:
+    results = dict()
+    print(f"{'mesh':<32} {'backend':<7} {'tris':>7} {'strips':>7} "
+          f"{'str/tri':>8} {'indices':>8} {'degen':>7} {'valid':>6} "
+          f"{'ms/1k':>8}")
+
+    for mesh, indexList in corpus.items():
+        results[mesh] = dict()
+        for name, backend in backends.items():
+            try:
+                res = measure(strippifier, backend, indexList, repeats,
+                              minTime)
+            except Exception as e:
+                res = {"error": f"{type(e).__name__}: {e}"}
+                print(f"{mesh:<32} {name:<7} {res['error']}")
+            else:
+                print(f"{mesh:<32} {name:<7} {len(indexList) // 3:>7} "
+                      f"{res['strips']:>7} {res['stripsPerTri']:>8} "
+                      f"{res['indices']:>8} {res['degenerates']:>7} "
+                      f"{str(res['valid']):>6} {res['msPer1kTris']:>8}")
+            results[mesh][name] = res
+
+    return results
+
+
+def main(args: List[str]) -> int:
+    parser = argparse.ArgumentParser(description="Strippifier benchmark")
+    parser.add_argument("--corpus", help="json file of additional meshes (name: index list)")
+    parser.add_argument("--no-synthetic", action="store_true", help="skip the generated meshes")
+    parser.add_argument("--backends", default="class,array", help="comma separated: class, array, swaps, dll")
+    parser.add_argument("--dll", help="path to IOSA2.dll (required for the dll backend)")
+    parser.add_argument("--repeats", type=int, default=3, help="runs per mesh, fastest one counts")
+    parser.add_argument("--min-time", type=float, default=0.2,
+                        help="seconds to keep repeating a mesh for, so that small meshes get more runs")
+    parser.add_argument("--baseline", default=BASELINE, help="baseline json to compare against (empty to skip)")
+    parser.add_argument("--update", action="store_true", help="write the results to the baseline instead of comparing")
+    parser.add_argument("--no-timings", action="store_true",
+                        help="leave the timings out of a written baseline, e.g. to share it between machines")
+    parser.add_argument("--time-tolerance", type=float, default=1.5,
+                        help="factor by which a backend may be slower than the baseline (0 to ignore timing)")
+    parser.add_argument("--time-floor", type=float, default=20,
+                        help="milliseconds a mesh has to take in the baseline for its timing to be compared")
+    parser.add_argument("--models", nargs="*", default=[], help="model files to extract meshes from (blender only)")
+    parser.add_argument("--write-corpus", help="write the extracted meshes to this corpus file")
+    args = parser.parse_args(args)
+
+    if args.models:
+        extracted = extractCorpus(args.models)
+        if args.write_corpus is None:
+            print("--models requires --write-corpus")
+            return 1
+        corpus = dict()
+        if os.path.isfile(args.write_corpus):
+            with open(args.write_corpus) as f:
+                corpus = json.load(f)
+        corpus.update(extracted)
+        with open(args.write_corpus, "w") as f:
+            json.dump(corpus, f)
+        print("wrote", len(extracted), "meshes to", args.write_corpus)
+        return 0
+
+    corpus = dict() if args.no_synthetic else syntheticCorpus()
+    if args.corpus is not None:
+        with open(args.corpus) as f:
+            corpus.update(json.load(f))
+
+    strippifier = loadStrippifier()
+    available = getBackends(strippifier, args.dll)
+    backends = dict()
+    for name in args.backends.split(","):
+        if name not in available:
+            print("backend", name, "not available")
+            return 1
+        backends[name] = available[name]
+
+    results = run(strippifier, corpus, backends, args.repeats, args.min_time)
+
+    if not args.baseline:
+        return 0
+
+    if args.update or not os.path.isfile(args.baseline):
+        baseline = dict()
+        if os.path.isfile(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        for mesh, res in results.items():
+            if args.no_timings:
+                res = {name: {k: v for k, v in r.items()
+                              if k not in ("ms", "msPer1kTris")}
+                       for name, r in res.items()}
+            baseline.setdefault(mesh, dict()).update(res)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2)
+        print("baseline written to", args.baseline)
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    regressions = findRegressions(results, baseline, args.time_tolerance,
+                                  args.time_floor)
+    if len(regressions) > 0:
+        print("\nRegressions:")
+        for r in regressions:
+            print(" " + r)
+        return 1
+
+    print("\nNo regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    # blender passes its own arguments; ours come after "--"
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else sys.argv[1:]
+    sys.exit(main(argv))
@@ -6,9 +6,38 @@
 from collections import Counter
 from typing import List, Tuple
 from ctypes import *
+import heapq
+import os
+import sys
 
 raiseTopoErrorG = True
 
+# which strippifier to use:
+# "AUTO" uses IOSA2.dll if it could be loaded, otherwise the python one
+# "DLL" always uses IOSA2.dll
+# "PYTHON" always uses the ArrayStrippifier, whose strips match the
+# Strippifier class, but arent verified against the dll
+backend = "AUTO"
+
+# amount of processes used by JobRunner: 0 uses one per cpu core,
+# 1 runs every job on the calling thread
+workers = 0
+# batches with less indices and keys in total are not worth starting
+# the processes for
+parallelMinIndices = 100000
+
+# whether the triangles of triangle lists get reordered for the post
+# transform vertex cache (see VertexCacheOrder), and the amount of
+# vertices the cache is assumed to hold
+optimizeVertexCache = False
+vertexCacheSize = 16
+
+# whether strips may use swaps to turn corners (see StrippifySwaps)
+stripSwaps = False
+# strips and indices written with swaps enabled, and the amount
+# there would have been without them
+swapStats = [0, 0, 0, 0]
+
 arrayBuffer = (c_int * 1)()
 
 
@@ -284,12 +313,16 @@ class Strippifier:
 
     @classmethod
     def brokenCullFlow(cls, triA: Triangle, triB: Triangle) -> bool:
-        for v in triA.vertices:
-            if v in triB.vertices:
-                t = triB.vertices.index(v)
-                tt = triA.vertices.index(v)
-                return triB.vertices[t - 1] is triA.vertices[tt - 1]
-        return None
+        """Whether two neighbouring triangles face different directions,
+        in which case their shared edge goes the same way in both"""
+        vertsA = triA.vertices
+        vertsB = triB.vertices
+        for i in range(3):
+            for j in range(3):
+                if vertsA[i - 1] is vertsB[j - 1] \
+                        and vertsA[i] is vertsB[j]:
+                    return True
+        return False
 
     def Strippify(self,
                   indexList: List[int],
@@ -357,8 +390,12 @@ class Strippifier:
             # which can only occur if the first tri also has only one
             # neighbour. Only two triangles in the strip! boom!
             if secNewTri is None:
-                currentVert = sharedVerts[1]
-                nextVert = sharedVerts[0]
+                # the strip is reversed to the triangles, so the vertex
+                # following prevVert in the triangle comes third
+                verts = currentTri.vertices
+                nextVert = verts[verts.index(prevVert) - 2]
+                currentVert = sharedVerts[0] \
+                    if nextVert is sharedVerts[1] else sharedVerts[1]
 
                 thirdVertex = newTri.getThirdVertex(currentVert,
                                                     nextVert).index
@@ -423,9 +460,10 @@ class Strippifier:
                         else:
                             newTri = firstTri.getNextStripTriSeq(prevVert,
                                                                  currentVert)
-                            if newTri is None:
-                                reachedEnd = True
-                                continue
+                        if newTri is None or Strippifier.brokenCullFlow(
+                                firstTri, newTri):
+                            reachedEnd = True
+                            continue
                         self.strip.reverse()
 
                         tTri = firstTri
@@ -436,7 +474,8 @@ class Strippifier:
                         reachedEnd = True
                         continue
 
-                # swapping if necessary (broken)
+                # swapping if the triangle after the next one doesnt
+                # continue from the current vertex
                 if doSwaps:
                     secNewTri = newTri.getNextStripTri(prevVert, currentVert)
                     if secNewTri is not None \
@@ -458,18 +497,20 @@ class Strippifier:
                 prevVert = currentVert
                 currentVert = nextVert
 
-                oldTri = currentTri
                 currentTri = newTri
                 currentTri.used = True
 
-                if Strippifier.brokenCullFlow(oldTri, currentTri):
-                    newTri = None
-                elif doSwaps:
+                if doSwaps:
                     newTri = secNewTri
                 else:
                     newTri = currentTri.getNextStripTriSeq(prevVert,
                                                            currentVert)
 
+                # the next triangle has to face the same direction
+                if newTri is not None \
+                        and Strippifier.brokenCullFlow(currentTri, newTri):
+                    newTri = None
+
             # checking if the triangle is reversed
             for i in range(3):
                 if self.strip[i] == firstTri.vertices[0].index:
@@ -483,21 +524,514 @@ class Strippifier:
             # getting the first tri
             firstTri = self.getFirstTri()
 
-        # now that we got all strips, we need to concat them (broken)
+        # now that we got all strips, we can concat them
         if concat:
-            # stitching the strips together
-            result = self.strips[0]
-            if len(self.strips) > 1:
-                for i in range(1, len(self.strips)):
-                    result.append(self.strips[i-1][-1])
-                    result.append(self.strips[i][0])
-                    result.extend(self.strips[i])
-            result = [result]
-        else:  # or we just return as is
-            result = self.strips
+            return joinStrips(self.strips)
+        return self.strips
+
+
+def joinStrips(strips: List[List[int]]) -> List[List[int]]:
+    """Stitches a list of strips together into a single strip.
+
+    The strips get connected by repeating the last index of one strip
+    and the first index of the next, which creates degenerate triangles
+    that dont get drawn. A strip always has to start at an even position
+    to keep its cull direction, so the last index is repeated once more
+    if necessary. A strip starting with a duplicate index (which flips
+    its cull direction) is started at an odd position instead"""
+    if len(strips) == 0:
+        return list()
+
+    result = list(strips[0])
+    for strip in strips[1:]:
+        flipped = len(strip) > 3 and strip[0] == strip[1]
+        if flipped:
+            strip = strip[1:]
+
+        result.append(result[-1])
+        if (len(result) + 1) % 2 != flipped:
+            result.append(result[-1])
+        result.append(strip[0])
+        result.extend(strip)
+    return [result]
+
+
+def stripTriangles(strips: List[List[int]]) -> List[List[int]]:
+    """Returns the triangles drawn by strips, with the corners in the
+    order of the first (even) triangle of a strip. Degenerate triangles
+    are left out"""
+    triangles = list()
+    for strip in strips:
+        for i in range(len(strip) - 2):
+            a, b, c = strip[i:i + 3]
+            if a == b or b == c or a == c:
+                continue
+            triangles.append([a, b, c] if i % 2 == 0 else [b, a, c])
+    return triangles
+
+
+def stripsEquivalent(indexList: List[int], strips: List[List[int]]) -> bool:
+    """Whether strips draw exactly the triangles of an index list, facing
+    the opposite direction (like the strips of the strippifiers do).
+    Degenerate triangles are ignored"""
+
+    def key(a, b, c):
+        # rotating the smallest index to the front keeps the winding
+        if a < b and a < c:
+            return (a, b, c)
+        if b < c:
+            return (b, c, a)
+        return (c, a, b)
+
+    expected = Counter()
+    for i in range(0, len(indexList) - 2, 3):
+        a, b, c = indexList[i:i + 3]
+        if a != b and b != c and a != c:
+            expected[key(a, c, b)] += 1
+
+    drawn = Counter(key(*t) for t in stripTriangles(strips))
+    return expected == drawn
+
+
+def stripsSize(strips: List[List[int]],
+               cornerSize: int,
+               headerSize: int,
+               flipFlag: bool = False) -> int:
+    """Returns the encoded size of strips, with a header of headerSize
+    per strip and cornerSize per corner. With flipFlag, a duplicate
+    first index is not written, but stored in the header instead"""
+    size = 0
+    for s in strips:
+        corners = len(s)
+        if flipFlag and s[0] == s[1]:
+            corners -= 1
+        size += headerSize + corners * cornerSize
+    return size
+
+
+def triangleListSize(triangles: int,
+                     cornerSize: int,
+                     headerSize: int = 0) -> int:
+    """Returns the encoded size of a list of triangles"""
+    if triangles == 0:
+        return 0
+    return headerSize + triangles * 3 * cornerSize
+
+
+def CheapestEncoding(strips: List[List[int]],
+                     stripsSize,
+                     listSize=None) -> Tuple[str, List[List[int]]]:
+    """Picks the smallest way of writing strips:
+
+    - "STRIPS": the strips as they are
+    - "STITCHED": a single strip (see joinStrips)
+    - "LIST": a triangle list (see stripTriangles)
+
+    stripsSize(strips) returns the size of writing a list of strips in
+    the format, listSize(triangles) that of a triangle list, or None if
+    the format has no triangle lists. Returns the encoding and the
+    strips or triangles to write"""
+    options = [("STRIPS", strips, stripsSize(strips))]
+
+    if len(strips) > 1:
+        stitched = joinStrips(strips)
+        options.append(("STITCHED", stitched, stripsSize(stitched)))
+
+    if listSize is not None:
+        triangles = stripTriangles(strips)
+        options.append(("LIST", triangles, listSize(triangles)))
+
+    # the first option wins on a tie, so nothing changes needlessly
+    encoding, result, size = min(options, key=lambda o: o[2])
+    return encoding, result
+
+
+class ArrayStrippifier:
+    """Native free strippifier working on flat index arrays
+
+    A plain python port of the Strippifier class, not a numpy one:
+    instead of building vertex, edge and triangle objects, the topology
+    is stored in flat lists indexed by triangle/edge/vertex number. The
+    amount of unused neighbours of each triangle and unused triangles
+    of each vertex is kept up to date whenever a triangle gets used,
+    and triangles are sorted into buckets by their unused neighbour
+    count, so that looking for the next starting triangle doesnt
+    require going over the entire mesh again.
+
+    Its strips are only verified to be the same as those of the
+    Strippifier class (see stripBaseline.json). IOSA2.dll started out
+    as a port of that class, but the two have never been compared, so
+    the strips may differ from the dll ones.
+
+    It takes about 5 - 16 ms per 1000 triangles (stripBenchmark.py,
+    CPython 3.11), against 12 - 170 ms for the class, which grows
+    with the mesh size. The dll has not been timed against it
+    """
+
+    def buildTopology(self, indexList: List[int], raiseTopoError: bool):
+        """Reads the index list into the adjacency arrays"""
+        triCount = len(indexList) // 3
+        vertCount = max(indexList) + 1
+
+        self.triVerts = [indexList[i * 3:i * 3 + 3] for i in range(triCount)]
+        self.triEdges = [[] for t in range(triCount)]
+        self.neighbours = [[] for t in range(triCount)]
+        self.edgeVerts = list()
+        self.edgeTris = list()
+        self.edgeLookup = dict()
+        self.vertTris = [0] * vertCount
+
+        for t, verts in enumerate(self.triVerts):
+            for i in range(-1, 2):
+                v1 = verts[i]
+                v2 = verts[i + 1]
+                self.vertTris[v1] += 1
+
+                key = (v1, v2) if v1 < v2 else (v2, v1)
+                e = self.edgeLookup.get(key)
+                if e is None:
+                    e = len(self.edgeVerts)
+                    self.edgeLookup[key] = e
+                    self.edgeVerts.append((v1, v2))
+                    self.edgeTris.append(list())
+                elif raiseTopoError and len(self.edgeTris[e]) > 1:
+                    raise TopologyError("Some Edge has more than 2 faces!"
+                                        " cant strippify!")
+
+                for n in self.edgeTris[e]:
+                    self.neighbours[n].append(t)
+                    self.neighbours[t].append(n)
+                self.edgeTris[e].append(t)
+                self.triEdges[t].append(e)
+
+        self.used = [False] * triCount
+        self.triNeighbours = [len(n) for n in self.neighbours]
+
+        self.buckets = dict()
+        for t, c in enumerate(self.triNeighbours):
+            if c not in self.buckets:
+                self.buckets[c] = list()
+            # indices are added in order, so the lists are valid heaps
+            self.buckets[c].append(t)
+
+    def use(self, tri: int):
+        """Marks a triangle as used and updates the neighbour counts"""
+        if self.used[tri]:
+            return
+        self.used[tri] = True
+        for v in self.triVerts[tri]:
+            self.vertTris[v] -= 1
+        for n in self.neighbours[tri]:
+            self.triNeighbours[n] -= 1
+            if not self.used[n]:
+                c = self.triNeighbours[n]
+                if c not in self.buckets:
+                    self.buckets[c] = list()
+                heapq.heappush(self.buckets[c], n)
+
+    def firstInBucket(self, count: int):
+        """Returns the lowest unused triangle with the given
+        amount of unused neighbours"""
+        bucket = self.buckets.get(count)
+        while bucket:
+            t = bucket[0]
+            if not self.used[t] and self.triNeighbours[t] == count:
+                return t
+            heapq.heappop(bucket)
+        return None
 
+    def addZTriangle(self, tri: int):
+        """creates a strip from a triangle with no (free) neighbours"""
+        v = self.triVerts[tri]
+        self.strips.append([v[0], v[2], v[1]])
+        self.written += 1
+        self.use(tri)
+
+    def getFirstTri(self):
+        # the first triangle with one neighbour gets picked. if there is
+        # none, the first triangle with the lowest amount of neighbours.
+        # triangles without neighbours that come before it get written
+        result = self.firstInBucket(1)
+        while True:
+            t = self.firstInBucket(0)
+            if t is None or result is not None and t > result:
+                break
+            self.addZTriangle(t)
+
+        if result is None:
+            for c in sorted(self.buckets.keys()):
+                if c > 1 and c < 0xFFFF:
+                    result = self.firstInBucket(c)
+                    if result is not None:
+                        break
         return result
 
+    def hasVertex(self, tri: int, v: int) -> bool:
+        return v in self.triVerts[tri]
+
+    def getThirdVertex(self, tri: int, v1: int, v2: int) -> int:
+        verts = self.triVerts[tri]
+        if not (v1 in verts and v2 in verts):
+            return None
+        for v in verts:
+            if v == v1 or v == v2:
+                continue
+            return v
+        return None
+
+    def getSharedEdge(self, tri: int, otherTri: int) -> int:
+        otherEdges = self.triEdges[otherTri]
+        for e in self.triEdges[tri]:
+            if e in otherEdges:
+                return e
+        return None
+
+    def brokenCullFlow(self, triA: int, triB: int) -> bool:
+        """Whether two neighbouring triangles face different directions,
+        in which case their shared edge goes the same way in both"""
+        vertsA = self.triVerts[triA]
+        vertsB = self.triVerts[triB]
+        for i in range(3):
+            for j in range(3):
+                if vertsA[i - 1] == vertsB[j - 1] and vertsA[i] == vertsB[j]:
+                    return True
+        return False
+
+    def getNextStripTri(self, tri: int, prevVert=None, curVert=None):
+        used = self.used
+        trisToUse = [t for t in self.neighbours[tri] if not used[t]]
+
+        if len(trisToUse) == 0:
+            return None
+        if len(trisToUse) == 1:
+            return trisToUse[0]
+
+        weights = [0] * len(trisToUse)
+        vConnection = [0] * len(trisToUse)
+        biggestConnection = 0
+
+        hasBase = prevVert is not None and curVert is not None
+
+        for i, t in enumerate(trisToUse):
+            weights[i] = self.triNeighbours[t]
+
+            if weights[i] == 0:
+                return t
+
+            if hasBase:
+                if self.hasVertex(t, curVert):
+                    weights[i] -= 1
+                    vConnection[i] = self.vertTris[prevVert]
+                else:
+                    weights[i] += 1
+                    vConnection[i] = self.vertTris[curVert]
+            else:
+                eVerts = self.edgeVerts[self.getSharedEdge(t, tri)]
+                vConnection[i] = self.vertTris[eVerts[0]] \
+                    + self.vertTris[eVerts[1]] - 2
+
+            if vConnection[i] > biggestConnection:
+                biggestConnection = vConnection[i]
+
+        for i, v in enumerate(vConnection):
+            if v < biggestConnection:
+                weights[i] -= 1
+            else:
+                weights[i] += 1
+
+        index = 0
+        for i in range(1, len(trisToUse)):
+            if weights[i] < weights[index] \
+                    or hasBase \
+                    and weights[i] == weights[index] \
+                    and self.hasVertex(trisToUse[i], curVert):
+                index = i
+
+        return trisToUse[index]
+
+    def getNextStripTriSeq(self, tri: int, prevVert: int, curVert: int):
+        if prevVert is None or curVert is None:
+            return None
+        key = (prevVert, curVert) if prevVert < curVert \
+            else (curVert, prevVert)
+        e = self.edgeLookup.get(key)
+        if e is None:
+            return None
+        for t in self.edgeTris[e]:
+            if t != tri and not self.used[t]:
+                return t
+        return None
+
+    def Strippify(self,
+                  indexList: List[int],
+                  doSwaps=False,
+                  concat=False,
+                  raiseTopoError=False):
+        """creates a triangle strip from a triangle list.
+
+        If concat is True, all strips will be combined into one.
+
+        If its False, it will return an array of strips"""
+
+        self.strips = list()
+        self.written = 0
+        if len(indexList) < 3:
+            return self.strips
+
+        self.buildTopology(indexList, raiseTopoError)
+        triCount = len(self.triVerts)
+
+        firstTri = self.getFirstTri()
+
+        while self.written != triCount:
+            currentTri = firstTri
+            self.use(currentTri)
+
+            newTri = self.getNextStripTri(currentTri)
+
+            # degenerate triangles can be their own neighbour, in which
+            # case there is no actual neighbour left after using it
+            if newTri is None or self.brokenCullFlow(currentTri, newTri):
+                self.addZTriangle(currentTri)
+                firstTri = self.getFirstTri()
+                continue
+
+            self.use(newTri)
+
+            sharedVerts = self.edgeVerts[
+                self.getSharedEdge(currentTri, newTri)]
+            prevVert = self.getThirdVertex(currentTri,
+                                           sharedVerts[0],
+                                           sharedVerts[1])
+
+            secNewTri = self.getNextStripTri(newTri)
+
+            if secNewTri is None:
+                # the strip is reversed to the triangles, so the vertex
+                # following prevVert in the triangle comes third
+                verts = self.triVerts[currentTri]
+                nextVert = verts[verts.index(prevVert) - 2]
+                currentVert = sharedVerts[0] \
+                    if nextVert == sharedVerts[1] else sharedVerts[1]
+
+                thirdVertex = self.getThirdVertex(newTri,
+                                                  currentVert,
+                                                  nextVert)
+
+                self.strips.append([prevVert,
+                                    currentVert,
+                                    nextVert,
+                                    thirdVertex])
+                self.written += 2
+
+                firstTri = self.getFirstTri()
+                continue
+
+            elif self.hasVertex(secNewTri, sharedVerts[0]):
+                currentVert = sharedVerts[1]
+                nextVert = sharedVerts[0]
+            else:
+                currentVert = sharedVerts[0]
+                nextVert = sharedVerts[1]
+
+            strip = [prevVert, currentVert, nextVert]
+            self.written += 1
+
+            prevVert = nextVert
+            currentVert = self.getThirdVertex(newTri, currentVert, nextVert)
+
+            currentTri = newTri
+            newTri = None if self.brokenCullFlow(currentTri, secNewTri) \
+                else secNewTri
+
+            reachedEnd = False
+            reversedList = False
+            while not reachedEnd:
+
+                strip.append(currentVert)
+                self.written += 1
+
+                if newTri is None:
+
+                    if not reversedList \
+                            and self.triNeighbours[firstTri] > 0:
+                        reversedList = True
+                        prevVert = strip[1]
+                        currentVert = strip[0]
+                        if doSwaps:
+                            newTri = self.getNextStripTri(firstTri,
+                                                          prevVert,
+                                                          currentVert)
+                        else:
+                            newTri = self.getNextStripTriSeq(firstTri,
+                                                             prevVert,
+                                                             currentVert)
+                        if newTri is None \
+                                or self.brokenCullFlow(firstTri, newTri):
+                            reachedEnd = True
+                            continue
+                        strip.reverse()
+
+                        tTri = firstTri
+                        firstTri = currentTri
+                        currentTri = tTri
+
+                    else:
+                        reachedEnd = True
+                        continue
+
+                if doSwaps:
+                    secNewTri = self.getNextStripTri(newTri,
+                                                     prevVert,
+                                                     currentVert)
+                    if secNewTri is not None \
+                            and not self.hasVertex(secNewTri, currentVert):
+                        strip.append(prevVert)
+
+                        t = prevVert
+                        prevVert = currentVert
+                        currentVert = t
+
+                nextVert = self.getThirdVertex(newTri, prevVert, currentVert)
+
+                if nextVert is None:
+                    reachedEnd = True
+                    continue
+
+                prevVert = currentVert
+                currentVert = nextVert
+
+                currentTri = newTri
+                self.use(currentTri)
+
+                if doSwaps:
+                    newTri = secNewTri
+                else:
+                    newTri = self.getNextStripTriSeq(currentTri,
+                                                     prevVert,
+                                                     currentVert)
+
+                # the next triangle has to face the same direction
+                if newTri is not None \
+                        and self.brokenCullFlow(currentTri, newTri):
+                    newTri = None
+
+            # checking if the triangle is reversed
+            firstVerts = self.triVerts[firstTri]
+            for i in range(3):
+                if strip[i] == firstVerts[0]:
+                    if firstVerts[1] == strip[0 if i == 2 else i + 1]:
+                        strip.insert(0, strip[0])
+                    break
+
+            self.strips.append(strip)
+
+            firstTri = self.getFirstTri()
+
+        if concat:
+            return joinStrips(self.strips)
+        return self.strips
+
 
 def Strippify(indexList: List[int],
               doSwaps=False,
@@ -505,9 +1039,78 @@ def Strippify(indexList: List[int],
               raiseTopoError=False,
               name: str = ""):
 
-    from . import common
+    from . import common, exportStats
     dll = common.DLL
 
+    with exportStats.span("Strippify"):
+        exportStats.count(triangles=len(indexList) // 3)
+
+        if doSwaps:
+            # only the python strippifier swaps correctly
+            try:
+                strips, counts = StrippifySwaps(indexList,
+                                                concat,
+                                                raiseTopoError)
+            except TopologyError as e:
+                raise Exception(name + " failed to strippify") from e
+            addSwapStats(counts)
+            return strips
+
+        if backend == "PYTHON" or backend == "AUTO" and dll is None:
+            try:
+                return ArrayStrippifier().Strippify(
+                    indexList,
+                    doSwaps=doSwaps,
+                    concat=concat,
+                    raiseTopoError=raiseTopoError)
+            except TopologyError as e:
+                raise Exception(name + " failed to strippify") from e
+
+        return StrippifyDLL(dll, indexList, doSwaps, concat,
+                            raiseTopoError, name)
+
+
+def StrippifySwaps(indexList: List[int],
+                   concat=False,
+                   raiseTopoError=False):
+    """Strippifies with swaps, which let a strip turn corners by
+    repeating an index, and without them. Returns the strips with less
+    indices (counting one more for the header of each strip), and the
+    strip and index counts of the result and of the strips without swaps
+    """
+    swapped = ArrayStrippifier().Strippify(indexList,
+                                           doSwaps=True,
+                                           raiseTopoError=raiseTopoError)
+    plain = ArrayStrippifier().Strippify(indexList,
+                                         raiseTopoError=raiseTopoError)
+
+    swappedIndices = sum(len(s) for s in swapped)
+    plainIndices = sum(len(s) for s in plain)
+    if swappedIndices + len(swapped) < plainIndices + len(plain):
+        counts = (len(swapped), swappedIndices, len(plain), plainIndices)
+        strips = swapped
+    else:
+        counts = (len(plain), plainIndices, len(plain), plainIndices)
+        strips = plain
+
+    if concat:
+        strips = joinStrips(strips)
+    return strips, counts
+
+
+def addSwapStats(counts: Tuple[int, int, int, int]):
+    for i, c in enumerate(counts):
+        swapStats[i] += c
+
+
+def StrippifyDLL(dll,
+                 indexList: List[int],
+                 doSwaps=False,
+                 concat=False,
+                 raiseTopoError=False,
+                 name: str = ""):
+    """Strippifies an index list using a loaded IOSA2.dll"""
+
     # int pointer type
     IntPtr = POINTER(c_int)
 
@@ -556,3 +1159,331 @@ def Strippify(indexList: List[int],
         else:
             output[-1].append(i)
     return output
+
+
+# == jobs ==
+# JobRunner runs batches of jobs, which are plain tuples so that
+# they can be sent to the worker processes. The first item is the kind:
+# ("STRIP", indexList, doSwaps, concat, name) -> strips
+# ("DISTINCT", keys, precision) -> (firsts, IDs), see DistinctKeys
+# ("DISTINCT_STRIP", keys, doSwaps, concat, name) -> (firsts, IDs, strips),
+#     which strippifies the IDs of the distinct keys
+
+
+def DistinctKeys(keys: list,
+                 precision: int = None) -> Tuple[List[int], List[int]]:
+    """Returns the position of the first occurrence of every distinct
+    key, in order, and for every key the index of its distinct one.
+
+    Works like common.getDistinctwID, but on plain hashable keys, so
+    that it can run in a worker process. If a precision is given, the
+    keys are tuples of floats that get rounded to that many decimal
+    places"""
+    firsts = list()
+    IDs = [0] * len(keys)
+    lookup = dict()
+
+    for i, key in enumerate(keys):
+        if precision is not None:
+            key = tuple(round(v, precision) for v in key)
+        found = lookup.get(key)
+        if found is None:
+            found = len(firsts)
+            lookup[key] = found
+            firsts.append(i)
+        IDs[i] = found
+
+    return firsts, IDs
+
+
+def RunJob(job: tuple, strippify):
+    """Returns the result of a job, using
+    strippify(indexList, doSwaps, concat, name) for the strips"""
+    kind = job[0]
+    if kind == "STRIP":
+        return strippify(*job[1:])
+    if kind == "DISTINCT":
+        return DistinctKeys(job[1], job[2])
+    if kind == "DISTINCT_STRIP":
+        firsts, IDs = DistinctKeys(job[1])
+        return firsts, IDs, strippify(IDs, *job[2:])
+    raise ValueError("Unknown job kind " + str(kind))
+
+
+def WorkerJob(job: tuple, dllPath: str = None):
+    """Runs a job in a worker process, strippifying with IOSA2.dll
+    loaded from dllPath, or with the ArrayStrippifier if dllPath is
+    None or the job uses swaps. Returns the result and the swap counts
+    of its strips (see StrippifySwaps)"""
+    counts = list()
+
+    def strippify(indexList, doSwaps, concat, name):
+        if dllPath is not None and not doSwaps:
+            return StrippifyDLL(workerDLL(dllPath), indexList,
+                                concat=concat, name=name)
+        try:
+            if doSwaps:
+                strips, c = StrippifySwaps(indexList, concat)
+                counts.append(c)
+                return strips
+            return ArrayStrippifier().Strippify(indexList, concat=concat)
+        except TopologyError as e:
+            raise Exception(name + " failed to strippify: "
+                            + str(e)) from None
+
+    return RunJob(job, strippify), counts
+
+
+# IOSA2.dll as loaded by a worker process
+loadedDLL = None
+
+
+def workerDLL(path: str):
+    """Returns IOSA2.dll, loading it on the first call.
+
+    The dll keeps the last strip in a static variable, so it cant be
+    shared between threads; every worker process loads its own copy"""
+    global loadedDLL
+    if loadedDLL is None:
+        loadedDLL = cdll.LoadLibrary(path)
+    return loadedDLL
+
+
+def standaloneModule():
+    """Returns this file loaded as the top level module "strippifier".
+
+    The worker processes cant import the addon package (it needs
+    blender), so the job function has to be pickled from a module
+    that can be imported by its own"""
+    module = sys.modules.get("strippifier")
+    if module is None:
+        import importlib.util
+        spec = importlib.util.spec_from_file_location("strippifier",
+                                                      __file__)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        sys.modules["strippifier"] = module
+    return module
+
+
+class JobRunner:
+    """Runs batches of jobs and returns their results in the same order.
+
+    Uses a process pool if a batch is big enough, otherwise each job
+    runs in turn. The pool gets started by the first batch that needs
+    it and is kept for the following ones, so that conversions running
+    several rounds of jobs (see common.convertAttaches) only start the
+    workers once. The workers load IOSA2.dll themselves when it is used.
+    executable is the python interpreter to start the workers with"""
+
+    def __init__(self, executable: str = None):
+        from . import common
+        self.executable = executable
+        self.pool = None
+        self.dllPath = None
+        if backend != "PYTHON" and common.DLL is not None:
+            self.dllPath = common.DLL._name
+
+        if workers > 0:
+            self.processes = workers
+        elif hasattr(os, "sched_getaffinity"):
+            self.processes = len(os.sched_getaffinity(0))
+        else:
+            self.processes = os.cpu_count() or 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def run(self, jobs: List[tuple]) -> list:
+        from . import exportStats
+
+        indexCount = sum(len(j[1]) for j in jobs)
+        triangles = sum(len(j[1]) for j in jobs if j[0] != "DISTINCT") // 3
+
+        with exportStats.span("StrippifyAll"):
+            exportStats.count(triangles=triangles)
+
+            if min(self.processes, len(jobs)) < 2 \
+                    or indexCount < parallelMinIndices:
+                return self.serial(jobs)
+
+            try:
+                return self.parallel(jobs)
+            except OSError as e:
+                print(" Running jobs in parallel failed (" + str(e)
+                      + "), continuing on a single core")
+                self.close()
+                self.processes = 1
+                return self.serial(jobs)
+
+    def serial(self, jobs: List[tuple]) -> list:
+        def strippify(indexList, doSwaps, concat, name):
+            return Strippify(indexList, doSwaps=doSwaps,
+                             concat=concat, name=name)
+
+        return [RunJob(j, strippify) for j in jobs]
+
+    def parallel(self, jobs: List[tuple]) -> list:
+        """Runs the jobs across the worker processes"""
+        from concurrent.futures.process import BrokenProcessPool
+
+        if self.pool is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            # spawning, as forking blender is not safe
+            context = multiprocessing.get_context("spawn")
+            if self.executable is not None:
+                context.set_executable(self.executable)
+            self.pool = ProcessPoolExecutor(self.processes,
+                                            mp_context=context)
+
+        job = standaloneModule().WorkerJob
+
+        # the workers get the sys.path of this process when starting,
+        # which is during submitting. They need this folder in there
+        # to import the standalone module
+        folder = os.path.dirname(os.path.abspath(__file__))
+        sys.path.insert(0, folder)
+        try:
+            # biggest jobs first, so that no worker is left with a big
+            # one at the end
+            order = sorted(range(len(jobs)), key=lambda i: -len(jobs[i][1]))
+            futures = dict()
+            for i in order:
+                futures[i] = self.pool.submit(job, jobs[i], self.dllPath)
+            sys.path.remove(folder)
+            folder = None
+            results = list()
+            for i in range(len(jobs)):
+                result, counts = futures[i].result()
+                for c in counts:
+                    addSwapStats(c)
+                results.append(result)
+            return results
+        except BrokenProcessPool as e:
+            raise OSError("worker process died") from e
+        finally:
+            if folder is not None:
+                sys.path.remove(folder)
+
+
+def StrippifyAll(jobs: List[tuple],
+                 executable: str = None) -> list:
+    """Runs a single batch of jobs (see JobRunner)"""
+    with JobRunner(executable) as runner:
+        return runner.run(jobs)
+
+
+# == vertex cache optimization ==
+
+def VertexCacheOrder(indexList: List[int], cacheSize: int) -> List[int]:
+    """Returns the order in which the triangles of an index list
+    should be drawn, so that their vertices get reused from the
+    post transform vertex cache as often as possible.
+
+    Tom Forsyth's "Linear-Speed Vertex Cache Optimisation": every vertex
+    is scored by its position in a simulated LRU cache and by how many
+    of its triangles are left, and the triangle with the highest total
+    score among the cached vertices gets drawn next"""
+    triCount = len(indexList) // 3
+    if triCount == 0:
+        return list()
+    vertCount = max(indexList) + 1
+
+    triVerts = [tuple(set(indexList[t * 3:t * 3 + 3]))
+                for t in range(triCount)]
+    vertTris = [[] for v in range(vertCount)]
+    for t, verts in enumerate(triVerts):
+        for v in verts:
+            vertTris[v].append(t)
+
+    # the last triangle's vertices get a fixed score, so that
+    # the next triangle doesnt just pick the oldest of them
+    lastTriScore = 0.75
+    positionScores = [lastTriScore] * 3 + [
+        (1 - (i - 3) / (cacheSize - 3)) ** 1.5 for i in range(3, cacheSize)]
+
+    def vertexScore(position: int, remaining: int) -> float:
+        if remaining == 0:
+            return -1
+        score = 0 if position < 0 else positionScores[position]
+        return score + 2 * remaining ** -0.5
+
+    remaining = [len(t) for t in vertTris]
+    position = [-1] * vertCount
+    vertScores = [vertexScore(-1, r) for r in remaining]
+    added = [False] * triCount
+
+    order = list()
+    cache: List[int] = list()
+    best = max(range(triCount),
+               key=lambda t: sum(vertScores[v] for v in triVerts[t]))
+    nextUnadded = 0
+
+    while True:
+        order.append(best)
+        added[best] = True
+        verts = triVerts[best]
+        for v in verts:
+            remaining[v] -= 1
+            vertTris[v].remove(best)
+
+        # the triangle's vertices move to the front of the cache
+        cache = list(verts) + [v for v in cache if v not in verts]
+        dropped = cache[cacheSize:]
+        del cache[cacheSize:]
+        for v in dropped:
+            position[v] = -1
+        for i, v in enumerate(cache):
+            position[v] = i
+
+        # rescoring the affected vertices and their triangles
+        for v in dropped + cache:
+            vertScores[v] = vertexScore(position[v], remaining[v])
+
+        best = None
+        bestScore = -1
+        for v in cache:
+            for t in vertTris[v]:
+                score = sum(vertScores[u] for u in triVerts[t])
+                if score > bestScore:
+                    best = t
+                    bestScore = score
+
+        if best is None:
+            # nothing left around the cached vertices; continuing with
+            # the first triangle that hasnt been drawn yet
+            while nextUnadded < triCount and added[nextUnadded]:
+                nextUnadded += 1
+            if nextUnadded == triCount:
+                break
+            best = nextUnadded
+
+    return order
+
+
+def CacheMisses(indexList: List[int], cacheSize: int) -> int:
+    """Returns how many vertices of an index list miss a FIFO vertex
+    cache when drawn in order (divided by the triangle count,
+    this is the ACMR)"""
+    cached = set()
+    fifo = list()
+    misses = 0
+    for v in indexList:
+        if v in cached:
+            continue
+        misses += 1
+        cached.add(v)
+        fifo.append(v)
+        if len(fifo) > cacheSize:
+            cached.discard(fifo.pop(0))
+    return misses